@@ -0,0 +1,102 @@
+# access_log.py
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ACCESS_LOG_FILE = "./access_log.sqlite3"
+# Requests older than this are dropped, and no longer count for popularity
+ACCESS_LOG_RETENTION = 14 * 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS accesses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    result TEXT,
+    at REAL NOT NULL
+)
+"""
+_INDEX = "CREATE INDEX IF NOT EXISTS accesses_kind_at ON accesses (kind, at)"
+
+# Cache state of a track when a download was requested
+DOWNLOAD_RESULTS = ("file_id", "cached", "miss")
+
+
+class AccessLog:
+    """
+    Log of user requests kept in SQLite: searches (key = the normalized query) and download
+    button presses (key = the video_id, with the cache state it was found in).
+    The prewarmer ranks tracks and queries by it, and it gives the download hit ratio over any window.
+    """
+
+    def __init__(self, db_path=ACCESS_LOG_FILE, retention=ACCESS_LOG_RETENTION):
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.execute(_SCHEMA)
+            self._db.execute(_INDEX)
+
+    def record(self, kind, key, result=None):
+        """Logs one request. `kind` is "search" or "download", `result` one of DOWNLOAD_RESULTS for downloads."""
+        with self._lock, self._db:
+            self._db.execute("INSERT INTO accesses (kind, key, result, at) VALUES (?, ?, ?, ?)", (kind, key, result, time.time()))
+
+    def top(self, kind, limit, since=None, min_count=1):
+        """Returns [(key, count)] of the most requested keys of a kind since `since` (a timestamp), most requested first."""
+        since = since if since is not None else time.time() - self.retention
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, COUNT(*) AS n FROM accesses WHERE kind = ? AND at >= ?"
+                " GROUP BY key HAVING n >= ? ORDER BY n DESC, MAX(at) DESC LIMIT ?",
+                (kind, since, min_count, limit),
+            ).fetchall()
+        return [(row["key"], row["n"]) for row in rows]
+
+    def hit_ratio(self, since=None):
+        """
+        Returns the download requests since `since` and the share of them that found the track cached
+        ("hit_ratio") and that could be sent by file_id without uploading ("file_id_ratio").
+        """
+        since = since if since is not None else time.time() - self.retention
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT result, COUNT(*) AS n FROM accesses WHERE kind = 'download' AND at >= ? GROUP BY result", (since,)
+            ).fetchall()
+        counts = {row["result"]: row["n"] for row in rows}
+        total = sum(counts.values())
+        return {
+            "requests": total,
+            "hit_ratio": (counts.get("file_id", 0) + counts.get("cached", 0)) / total if total else 0.0,
+            "file_id_ratio": counts.get("file_id", 0) / total if total else 0.0,
+        }
+
+    def prune(self):
+        """Drops requests older than the retention period. Returns the number removed."""
+        with self._lock, self._db:
+            removed = self._db.execute("DELETE FROM accesses WHERE at < ?", (time.time() - self.retention,)).rowcount
+        if removed:
+            logger.info("Pruned %s old entries from the access log.", removed)
+        return removed
+
+    def close(self):
+        self._db.close()
+
+
+_access_log = None
+
+
+def init_access_log(db_path=ACCESS_LOG_FILE, retention=None):
+    """Opens the shared access log. Call once at startup."""
+    global _access_log
+    _access_log = AccessLog(db_path, retention=retention or ACCESS_LOG_RETENTION)
+    return _access_log
+
+
+def get_access_log():
+    """Returns the shared access log, or None when init_access_log() was not called."""
+    return _access_log
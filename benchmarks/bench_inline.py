@@ -0,0 +1,144 @@
+# benchmarks/bench_inline.py
+"""
+Benchmarks inline mode in two parts:
+
+    index       lookup latency of title_index.TitleIndex with --tracks synthetic titles/artists, for
+                queries typed character by character (every prefix is a lookup, as Telegram sends them)
+    end_to_end  inline queries through the bot with the fakes and the Telegram stub of run_bench.py:
+                a query for searched but never sent tracks (answered empty, fetched and uploaded in the background),
+                the same query afterwards (answered with cached audio), and a query the index does not know
+                (searched upstream in the background, its results fetched and uploaded by the next query)
+
+Reports latencies in milliseconds and the result counts as JSON. Nothing leaves the machine.
+
+    python benchmarks/bench_inline.py [--tracks 20000] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fakes  # noqa: E402
+from run_bench import _Bench, _percentile  # noqa: E402
+
+UPLOAD_CHAT_ID = -1001
+SYLLABLES = ["ka", "lo", "mi", "ren", "su", "ta", "vel", "no", "dra", "xi", "po", "lu", "shi", "ber", "an", "to"]
+
+
+def _word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def bench_index(track_count, query_count=200):
+    from title_index import TitleIndex
+    rng = random.Random(7)
+    index = TitleIndex(max_tracks=track_count)
+    tracks = [(f"id{i:09d}", " ".join(_word(rng) for _ in range(rng.randint(1, 4))), _word(rng).capitalize()) for i in range(track_count)]
+    started = time.perf_counter()
+    for video_id, title, artist in tracks:
+        index.add(video_id, title, artist, 200, file_id=f"file-{video_id}" if rng.random() < 0.5 else None)
+    build_seconds = time.perf_counter() - started
+
+    latencies, found = [], []
+    for video_id, title, artist in rng.sample(tracks, query_count):
+        query = f"{artist} {title}"
+        for end in range(1, len(query) + 1):
+            started = time.perf_counter()
+            results = index.search(query[:end])
+            latencies.append(time.perf_counter() - started)
+        found.append(video_id in {track["video_id"] for track in results})
+    return {
+        "tracks": track_count,
+        "build_seconds": round(build_seconds, 2),
+        "lookups": len(latencies),
+        "lookup_ms": {label: round(_percentile(latencies, fraction) * 1000, 3) for label, fraction in (("p50", 0.5), ("p99", 0.99))},
+        "lookup_max_ms": round(max(latencies) * 1000, 3),
+        "full_query_finds_track": sum(found) / len(found),
+    }
+
+
+async def bench_end_to_end(args):
+    import bot
+    import inline_search
+    import search_cache
+    from title_index import init_title_index, get_title_index
+
+    bench = _Bench(args, tempfile.mkdtemp(prefix="bench_inline_"))
+    await bench.setup()
+    init_title_index()
+    bot.PREWARM_CHAT_ID = UPLOAD_CHAT_ID
+    inline_search.INLINE_SEARCH_DELAY = 0.2
+    user_id = bench.new_chats(1)[0]
+
+    async def inline(query):
+        update_id = next(bench.update_ids)
+        started = time.perf_counter()
+        await bench.application.process_update(bench.Update.de_json({"update_id": update_id, "inline_query": {
+            "id": str(update_id), "query": query, "offset": "", "from": bench._user(user_id),
+        }}, bench.application.bot))
+        answered_at, results = bench.stub.inline_answers[str(update_id)]
+        return {"answer_ms": round((answered_at - started) * 1000, 1), "results": len(results)}
+
+    async def wait_for(condition, timeout):
+        deadline = time.perf_counter() + timeout
+        while not condition() and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        return condition()
+
+    try:
+        # A chat search puts its results into the index, none of them has been sent yet
+        await bench.application.process_update(bench.Update.de_json(bench.message_update(user_id, "inline bench"), bench.application.bot))
+        searched = get_title_index().search("bench")
+        query = searched[0]["title"].lower()
+        first = await inline(query)
+        uploaded = await wait_for(lambda: any(track["file_id"] for track in get_title_index().search(query)), args.timeout)
+        second = await inline(query)
+        # A query nothing is known for (the fake titles do not contain its words, like a lyrics search):
+        # answered empty, searched upstream in the background, then its results are fetched and uploaded
+        unknown_query = "never searched before"
+        unknown_first = await inline(unknown_query)
+        found = await wait_for(lambda: bool(search_cache.peek(unknown_query, inline_search.INLINE_SEARCH_RESULTS)), args.timeout)
+        await inline(unknown_query)
+        await asyncio.gather(*inline_search._background, return_exceptions=True)
+        unknown_later = await inline(unknown_query)
+    finally:
+        await asyncio.gather(*inline_search._background, return_exceptions=True)
+        await bench.teardown()
+    return {
+        "uncached_query": first,
+        "after_background_upload": {**second, "uploaded": uploaded},
+        "unknown_query": unknown_first,
+        "unknown_query_after_background_search": {**unknown_later, "searched": found},
+        "uploads": bench.stub.calls.get("sendAudio", 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tracks", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--download-workers", type=int, default=2)
+    parser.add_argument("--upload-latency", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    os.environ.setdefault("BENCH_PAYLOAD_BYTES", "300000")
+    results = {"index": bench_index(args.tracks), "end_to_end": asyncio.run(bench_end_to_end(args))}
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
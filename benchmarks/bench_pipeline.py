@@ -0,0 +1,202 @@
+# benchmarks/bench_pipeline.py
+"""
+Compares the temp-file download -> transcode -> rename pipeline with the streaming pipeline
+(yt_downloader.STREAMING_PIPELINE) for peak disk usage, wall time and memory.
+
+The source audio is served from a local HTTP server with Range support, so no YouTube access is needed.
+Requires ffmpeg in PATH. Each variant runs in its own process so its memory figures are not mixed up.
+
+    python benchmarks/bench_pipeline.py [--source FILE] [--mode native|mp3] [--runs 3] [--output results.json]
+"""
+import argparse
+import http.server
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from download_worker import STREAM_READ_SIZE, _http_chunks, _pipe_to_ffmpeg, _stream_output  # noqa: E402
+
+
+class _RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves files from the working directory, honouring single "bytes=a-b" Range headers like googlevideo does."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        range_header = self.headers.get("Range")
+        if range_header:
+            first, _, last = range_header.removeprefix("bytes=").partition("-")
+            start, end = int(first), min(int(last) if last else size - 1, size - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(max(0, end - start + 1)))
+        self.end_headers()
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(STREAM_READ_SIZE, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+
+def _serve(directory):
+    handler = lambda *args, **kwargs: _RangeHandler(*args, directory=directory, **kwargs)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _open_range(url):
+    return lambda start, end: urllib.request.urlopen(urllib.request.Request(url, headers={"Range": f"bytes={start}-{end}"}))
+
+
+def _dir_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def _temp_file_pipeline(url, work_dir, mode, source_codec):
+    """Mirrors the yt-dlp + FFmpegExtractAudio flow: download to a temp file, convert to a second temp file, rename."""
+    source_path = os.path.join(work_dir, "track_temp.src")
+    with open(source_path, "wb") as f:
+        for chunk in _http_chunks(_open_range(url)):
+            f.write(chunk)
+    container, ffmpeg_output_args = _stream_output(mode, source_codec, {})
+    processed_path = os.path.join(work_dir, f"track_temp.{container}")
+    subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", source_path, *ffmpeg_output_args, processed_path],
+        check=True,
+    )
+    os.remove(source_path)
+    final_path = os.path.join(work_dir, f"track.{container}")
+    os.rename(processed_path, final_path)
+    return final_path
+
+
+def _streaming_pipeline(url, work_dir, mode, source_codec):
+    container, ffmpeg_output_args = _stream_output(mode, source_codec, {})
+    part_path = os.path.join(work_dir, f"track.{container}.part")
+    _pipe_to_ffmpeg(_http_chunks(_open_range(url)), ffmpeg_output_args, part_path)
+    final_path = os.path.join(work_dir, f"track.{container}")
+    os.replace(part_path, final_path)
+    return final_path
+
+
+VARIANTS = {"temp_file": _temp_file_pipeline, "streaming": _streaming_pipeline}
+
+
+def _run_variant(variant, url, mode, source_codec, result_queue):
+    """Runs one variant in a fresh process and reports wall time, peak disk usage and peak RSS."""
+    work_dir = tempfile.mkdtemp(prefix=f"bench_{variant}_")
+    peak_disk = 0
+    done = threading.Event()
+
+    def sample_disk():
+        nonlocal peak_disk
+        while not done.is_set():
+            peak_disk = max(peak_disk, _dir_size(work_dir))
+            time.sleep(0.005)
+
+    sampler = threading.Thread(target=sample_disk, daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    final_path = VARIANTS[variant](url, work_dir, mode, source_codec)
+    wall = time.perf_counter() - started
+    done.set()
+    sampler.join()
+    result_queue.put({
+        "variant": variant,
+        "wall_seconds": wall,
+        "peak_disk_bytes": max(peak_disk, _dir_size(work_dir)),
+        "output_bytes": os.path.getsize(final_path),
+        # ru_maxrss is in KiB on Linux
+        "python_peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "ffmpeg_peak_rss_kib": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    })
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _generate_source(directory, seconds=240):
+    """Creates an AAC (m4a) test track with ffmpeg, fragmented like YouTube's DASH audio so it can be read from a pipe."""
+    path = os.path.join(directory, "source.m4a")
+    subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+         "-c:a", "aac", "-b:a", "128k", "-movflags", "frag_keyframe+empty_moov", path],
+        check=True,
+    )
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", help="audio file to serve (default: a generated 4 minute AAC track)")
+    parser.add_argument("--source-codec", default="mp4a.40.2", help="codec of the source as yt-dlp reports it")
+    parser.add_argument("--mode", choices=("native", "mp3"), default="native")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    serve_dir = tempfile.mkdtemp(prefix="bench_source_")
+    source = args.source or _generate_source(serve_dir)
+    if args.source:
+        shutil.copy(source, serve_dir)
+    server = _serve(serve_dir)
+    url = f"http://127.0.0.1:{server.server_address[1]}/{os.path.basename(source)}"
+
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for run in range(args.runs):
+        for variant in VARIANTS:
+            result_queue = ctx.Queue()
+            process = ctx.Process(target=_run_variant, args=(variant, url, args.mode, args.source_codec, result_queue))
+            process.start()
+            result = result_queue.get()
+            process.join()
+            result["run"] = run
+            results.append(result)
+
+    summary = {}
+    for variant in VARIANTS:
+        runs = [r for r in results if r["variant"] == variant]
+        summary[variant] = {
+            key: sorted(r[key] for r in runs)[len(runs) // 2]
+            for key in ("wall_seconds", "peak_disk_bytes", "python_peak_rss_kib", "ffmpeg_peak_rss_kib")
+        }
+    report = {
+        "benchmark": "pipeline",
+        "mode": args.mode,
+        "source_bytes": os.path.getsize(source),
+        "runs": results,
+        "median": summary,
+    }
+    server.shutdown()
+    shutil.rmtree(serve_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
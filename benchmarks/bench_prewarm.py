@@ -0,0 +1,121 @@
+# benchmarks/bench_prewarm.py
+"""
+Measures what cache prewarming does after a cold start. An access log is filled with a request
+history drawn from a Zipf-like popularity curve (a few tracks get most of the requests), as if the
+bot had run for a while and then restarted with an empty ./cache. The same demand is then replayed
+twice on an empty cache, through button_callback like real download requests:
+
+    cold        no prewarming
+    prewarmed   one prewarmer pass first (with an upload chat, so file_ids are ready)
+
+Reports the download hit ratio from the access log, the share sent by file_id and the request latency
+of both runs, plus what the prewarm pass fetched. Uses the fakes and the Telegram stub of run_bench.py.
+
+    python benchmarks/bench_prewarm.py [--catalog 40] [--history 300] [--requests 60] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fakes  # noqa: E402
+from run_bench import _Bench, _percentile  # noqa: E402
+
+UPLOAD_CHAT_ID = -1001
+# Requests pressed at once when replaying the demand
+REPLAY_BATCH = 5
+
+
+def _demand(catalog, count, seed, exponent=1.1):
+    """`count` video_ids drawn from `catalog` with weight 1/rank^exponent."""
+    weights = [1 / (rank + 1) ** exponent for rank in range(len(catalog))]
+    return random.Random(seed).choices(catalog, weights=weights, k=count)
+
+
+async def _run(args, prewarm):
+    import access_log
+    import prewarmer
+    from rate_limiter import configure_rate_limiter
+
+    work_dir = tempfile.mkdtemp(prefix="bench_prewarm_")
+    bench = _Bench(args, work_dir)
+    await bench.setup()
+    configure_rate_limiter(args.rate_limit, args.rate_limit)
+    log = access_log.init_access_log(os.path.join(work_dir, "access_log.sqlite3"))
+    catalog = fakes._video_ids_for("bench-prewarm", args.catalog)
+    for video_id in _demand(catalog, args.history, seed=1):
+        log.record("download", video_id, "miss")
+    # Only the replayed requests count for the hit ratio
+    replay_started_at = time.time()
+    time.sleep(0.01)
+
+    prewarm_report, prewarm_seconds = None, None
+    if prewarm:
+        prewarmer.PREWARM_PAUSE = 0.0
+        warmer = prewarmer.Prewarmer(upload_chat_id=UPLOAD_CHAT_ID, top_tracks=args.top_tracks)
+        warmer._context = bench.application
+        started = time.perf_counter()
+        prewarm_report = await warmer.run_once()
+        prewarm_seconds = time.perf_counter() - started
+
+    latencies, timeouts = [], 0
+    requests = _demand(catalog, args.requests, seed=2)
+    try:
+        for start in range(0, len(requests), REPLAY_BATCH):
+            batch_latencies, batch_timeouts = await bench._run_downloads(requests[start:start + REPLAY_BATCH])
+            latencies += batch_latencies
+            timeouts += batch_timeouts
+        ratio = log.hit_ratio(since=replay_started_at)
+    finally:
+        await bench.teardown()
+        log.close()
+    return {
+        "requests": ratio["requests"],
+        "hit_ratio": round(ratio["hit_ratio"], 3),
+        "file_id_ratio": round(ratio["file_id_ratio"], 3),
+        "timeouts": timeouts,
+        "latency_ms": {label: round(value * 1000, 1) if value is not None else None
+                       for label, value in (("p50", _percentile(latencies, 0.50)), ("p95", _percentile(latencies, 0.95)))},
+        "prewarm": prewarm_report and {key: prewarm_report[key] for key in ("warm", "fetched", "uploaded", "failed")},
+        "prewarm_seconds": prewarm_seconds and round(prewarm_seconds, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--catalog", type=int, default=40, help="distinct tracks in the demand")
+    parser.add_argument("--history", type=int, default=300, help="logged requests before the restart")
+    parser.add_argument("--requests", type=int, default=60, help="requests replayed after the restart")
+    parser.add_argument("--top-tracks", type=int, default=15, help="tracks the prewarmer keeps warm")
+    parser.add_argument("--rate-limit", type=float, default=20.0, help="requests per second per egress")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--download-workers", type=int, default=2)
+    parser.add_argument("--upload-latency", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    os.environ.setdefault("BENCH_EXTRACT_LATENCY", "0.2")
+    os.environ.setdefault("BENCH_DOWNLOAD_LATENCY", "0.3")
+    os.environ.setdefault("BENCH_PAYLOAD_BYTES", "300000")
+    results = {"catalog": args.catalog, "history": args.history, "top_tracks": args.top_tracks, "runs": {}}
+    for name, prewarm in (("cold", False), ("prewarmed", True)):
+        results["runs"][name] = asyncio.run(_run(args, prewarm))
+        print(f"{name}: hit ratio {results['runs'][name]['hit_ratio']:.0%}", file=sys.stderr)
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
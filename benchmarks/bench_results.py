@@ -0,0 +1,116 @@
+# benchmarks/bench_results.py
+"""
+Measures paging through stored search results (see result_sets). Each of --chats chats searches
+once, pages forward through every page of the results keyboard and back to the first one, and then
+downloads a track from the last page, all through the real handlers:
+
+    search    the one upstream search that fetches the whole result set
+    paging    "Next"/"Prev" presses, answered from memory
+    download  a track button (tr_<set id>:<index>) pressed after paging
+
+Reports latencies in milliseconds and the upstream searches of each phase as JSON. Uses the fakes
+and the Telegram stub of run_bench.py.
+
+    python benchmarks/bench_results.py [--chats 4] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fakes  # noqa: E402
+from run_bench import _Bench, _percentile  # noqa: E402
+
+
+def _upstream_searches():
+    """Backend searches so far, from the search stage of the metrics."""
+    import metrics
+    return sum(series[-1] for key, series in metrics.STAGE_DURATION._series.items() if ("stage", "search") in key)
+
+
+def _buttons(bench, chat_id, prefix):
+    return [button["callback_data"] for row in bench.stub.keyboards.get(chat_id, []) for button in row
+            if button.get("callback_data", "").startswith(prefix)]
+
+
+async def _press(bench, chat_id, data):
+    started = time.perf_counter()
+    await bench.application.process_update(bench.Update.de_json(bench.callback_update(chat_id, data), bench.application.bot))
+    return time.perf_counter() - started
+
+
+async def _browse(bench, chat_id, query):
+    """Searches, pages to the last page and back. Returns (search seconds, page press seconds, pages, track buttons of the last page)."""
+    search_seconds = await bench._timed_update(bench.message_update(chat_id, query))
+    set_id = _buttons(bench, chat_id, "tr_")[0][len("tr_"):].split(":")[0]
+    page, page_seconds, last_page_tracks = 0, [], None
+    for step in (1, -1):
+        while f"pg_{set_id}:{page + step}" in _buttons(bench, chat_id, "pg_"):
+            page_seconds.append(await _press(bench, chat_id, f"pg_{set_id}:{page + step}"))
+            page += step
+            if step == 1:
+                last_page_tracks = _buttons(bench, chat_id, "tr_")
+    return search_seconds, page_seconds, len(page_seconds) // 2 + 1, last_page_tracks
+
+
+async def run(args):
+    bench = _Bench(args, tempfile.mkdtemp(prefix="bench_results_"))
+    await bench.setup()
+    chats = bench.new_chats(args.chats)
+    try:
+        searches_before = _upstream_searches()
+        browsed = await asyncio.gather(*(_browse(bench, chat_id, f"results query {chat_id}") for chat_id in chats))
+        searches_after_paging = _upstream_searches()
+        started = {chat_id: time.perf_counter() for chat_id in chats}
+        await asyncio.gather(*(_press(bench, chat_id, last_page_tracks[0]) for chat_id, (_, _, _, last_page_tracks) in zip(chats, browsed)))
+        deadline = time.perf_counter() + args.timeout
+        while time.perf_counter() < deadline and not all(chat_id in bench.stub.audio_sent for chat_id in chats):
+            await asyncio.sleep(0.01)
+        download_seconds = [bench.stub.audio_sent[chat_id][0] - started[chat_id] for chat_id in chats if chat_id in bench.stub.audio_sent]
+        searches_after_download = _upstream_searches()
+    finally:
+        await bench.teardown()
+
+    def latency(values):
+        return {label: round(_percentile(values, fraction) * 1000, 1) for label, fraction in (("p50", 0.5), ("p95", 0.95))} if values else None
+
+    page_seconds = [seconds for _, presses, _, _ in browsed for seconds in presses]
+    return {
+        "chats": len(chats),
+        "pages_per_search": browsed[0][2],
+        "search": {"latency_ms": latency([seconds for seconds, _, _, _ in browsed]), "upstream_searches": searches_after_paging - searches_before},
+        "paging": {"presses": len(page_seconds), "latency_ms": latency(page_seconds)},
+        "download": {"completed": len(download_seconds), "latency_ms": latency(download_seconds),
+                     "upstream_searches": searches_after_download - searches_after_paging},
+        "handler_errors": bench.handler_errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--download-workers", type=int, default=2)
+    parser.add_argument("--upload-latency", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    os.environ.setdefault("BENCH_PAYLOAD_BYTES", "300000")
+    results = asyncio.run(run(args))
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
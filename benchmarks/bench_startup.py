@@ -0,0 +1,110 @@
+# benchmarks/bench_startup.py
+"""
+Measures how long the bot takes to start, each run in a fresh interpreter:
+
+    import_bot          importing bot.py (everything the bot loads before it can answer /start)
+    first_ytmusic       creating the YTMusic client for the first search
+    download_pool       starting the download process pool until every worker has loaded the
+                        download code and yt_dlp, as before its first job
+
+Nothing is sent to YouTube or Telegram. `--repo` measures another checkout of the bot, e.g. a
+`git worktree` of an older commit, so two versions can be compared with `--compare`.
+
+    python benchmarks/bench_startup.py [--runs 5] [--repo DIR] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+# Seconds every pool job holds its worker, so the jobs cannot all run on the first worker that is up
+POOL_JOB_HOLD = 0.2
+
+
+def _load_modules(module_names):
+    """Pool job: imports the modules a download job needs in the worker, then holds the worker for a moment."""
+    for name in module_names:
+        importlib.import_module(name)
+    time.sleep(POOL_JOB_HOLD)
+    return os.getpid()
+
+
+def _child(measurement, repo):
+    """Runs one measurement in this (fresh) interpreter and prints the milliseconds it took."""
+    sys.path.insert(0, repo)
+    os.chdir(repo)
+    import logging
+    logging.disable(logging.CRITICAL)
+    started = time.perf_counter()
+    if measurement == "import_bot":
+        import bot  # noqa: F401
+    elif measurement == "first_ytmusic":
+        import yt_music_search
+        started = time.perf_counter()
+        yt_music_search._ytmusic_client()
+    elif measurement == "download_pool":
+        import bot  # noqa: F401
+        import executor
+        # The module the download functions are pickled from; older versions kept them in yt_downloader
+        worker_module = "download_worker" if os.path.exists(os.path.join(repo, "download_worker.py")) else "yt_downloader"
+        pool = executor._get_download_pool()
+        started = time.perf_counter()
+        futures = [pool.submit(_load_modules, [worker_module, "yt_dlp"]) for _ in range(executor.DOWNLOAD_WORKERS)]
+        workers = {future.result() for future in futures}
+        elapsed = time.perf_counter() - started - POOL_JOB_HOLD
+        executor.shutdown_pools()
+        print(json.dumps({"ms": elapsed * 1000, "workers": len(workers)}))
+        return
+    print(json.dumps({"ms": (time.perf_counter() - started) * 1000}))
+
+
+def _measure(measurement, repo, runs):
+    values = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", measurement, "--repo", repo],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        values.append(json.loads(output.strip().splitlines()[-1])["ms"])
+    return {"median_ms": round(statistics.median(values), 1), "min_ms": round(min(values), 1), "max_ms": round(max(values), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--repo", default=os.path.dirname(BENCH_DIR))
+    parser.add_argument("--output")
+    parser.add_argument("--compare")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    repo = os.path.abspath(args.repo)
+    if args.child:
+        _child(args.child, repo)
+        return
+
+    commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repo, capture_output=True, text=True).stdout.strip()
+    results = {"commit": commit, "runs": args.runs, "measurements": {}}
+    for measurement in ("import_bot", "first_ytmusic", "download_pool"):
+        results["measurements"][measurement] = _measure(measurement, repo, args.runs)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        results["compared_to"] = baseline.get("commit")
+        for measurement, values in results["measurements"].items():
+            before = baseline["measurements"].get(measurement, {}).get("median_ms")
+            if before:
+                values["change"] = f"{(values['median_ms'] - before) / before:+.0%}"
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# benchmarks/bench_variants.py
+"""
+Measures quality variants (yt_downloader.AUDIO_VARIANTS). For --tracks tracks that are not cached yet,
+the original and every variant are requested at once through button_callback, each in its own chat:
+
+    cold     the original is downloaded once and every variant is transcoded from it
+    repeat   the same requests again, all answered from the cache by file_id
+
+Reports the requests that went to YouTube (extractions and downloads, counted at the rate limiter),
+the transcodes and the latency per quality of both rounds. Uses the fakes and the Telegram stub of
+run_bench.py, where a transcode burns BENCH_TRANSCODE_CPU seconds of CPU in a download worker.
+
+    python benchmarks/bench_variants.py [--tracks 5] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fakes  # noqa: E402
+from run_bench import _Bench, _percentile  # noqa: E402
+
+
+def _stage_count(stage, **labels):
+    """How often a stage was recorded in the metrics, over all label values not given."""
+    import metrics
+    wanted = {("stage", stage), *labels.items()}
+    return sum(series[-1] for key, series in metrics.STAGE_DURATION._series.items() if wanted <= set(key))
+
+
+def _upstream_requests():
+    return {
+        "extractions": _stage_count("rate_limit", before="extract"),
+        "downloads": _stage_count("rate_limit", before="download"),
+        "transcodes": sum(_stage_count("transcode", mode=quality) for quality in _qualities()[1:]),
+    }
+
+
+def _qualities():
+    from yt_downloader import AUDIO_VARIANTS
+    return [None, *AUDIO_VARIANTS]
+
+
+async def _round(bench, video_ids):
+    """Requests every quality of every track at once. Returns the latencies per quality, timeouts and upstream requests."""
+    before = _upstream_requests()
+    qualities = _qualities()
+    # _run_downloads presses dl_<id>, so the quality goes along with the id
+    requests = [f"{video_id}:{quality}" if quality else video_id for video_id in video_ids for quality in qualities]
+    latencies, timeouts = await bench._run_downloads(requests)
+    # Latencies come back in request order as long as every request finished
+    per_quality = {}
+    if not timeouts:
+        for index, latency in enumerate(latencies):
+            per_quality.setdefault(qualities[index % len(qualities)] or "original", []).append(latency)
+    after = _upstream_requests()
+    return {
+        "requests": len(requests),
+        "timeouts": timeouts,
+        "upstream": {key: after[key] - before[key] for key in after},
+        "latency_ms_p50": {quality: round(_percentile(values, 0.5) * 1000, 1) for quality, values in per_quality.items()},
+    }
+
+
+async def run(args):
+    bench = _Bench(args, tempfile.mkdtemp(prefix="bench_variants_"))
+    await bench.setup()
+    video_ids = fakes._video_ids_for("bench-variants", args.tracks)
+    try:
+        cold = await _round(bench, video_ids)
+        repeat = await _round(bench, video_ids)
+    finally:
+        await bench.teardown()
+    return {"tracks": args.tracks, "qualities": [quality or "original" for quality in _qualities()],
+            "cold": cold, "repeat": repeat, "handler_errors": bench.handler_errors,
+            "documents_sent": bench.stub.calls.get("sendDocument", 0)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tracks", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--download-workers", type=int, default=2)
+    parser.add_argument("--upload-latency", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    os.environ.setdefault("BENCH_PAYLOAD_BYTES", "300000")
+    results = asyncio.run(run(args))
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# benchmarks/fakes.py
+"""
+Offline stand-ins for YTMusic (search, get_album, get_playlist) and yt_dlp.YoutubeDL with configurable latency and payloads.
+
+Settings are read from environment variables so that download pool processes (started with
+"spawn") pick up the same configuration when install() runs as their initializer:
+
+    BENCH_SEARCH_LATENCY     seconds per YTMusic/ytsearch call          (default 0.15)
+    BENCH_EXTRACT_LATENCY    seconds per info extraction                (default 0.3)
+    BENCH_DOWNLOAD_LATENCY   seconds of simulated network per download  (default 0.5)
+    BENCH_TRANSCODE_CPU      seconds of busy CPU per transcode          (default 0.2, 0 for stream copies),
+                             also per ffmpeg run of download_worker.transcode (quality variants)
+    BENCH_PAYLOAD_BYTES      size of the downloaded audio file          (default 3 MB)
+"""
+import hashlib
+import os
+import re
+import time
+
+
+def _setting(name, default):
+    return float(os.environ.get(name, default))
+
+
+def _burn_cpu(seconds):
+    """Busy-loops for `seconds` of wall time to stand in for ffmpeg work."""
+    deadline = time.perf_counter() + seconds
+    value = b"x"
+    while time.perf_counter() < deadline:
+        value = hashlib.sha256(value).digest()
+
+
+def _fake_track(video_id):
+    number = int(hashlib.md5(video_id.encode()).hexdigest()[:6], 16)
+    return {
+        "title": f"Bench Track {number % 1000}",
+        "artist": f"Bench Artist {number % 97}",
+        "duration": 120 + number % 180,
+    }
+
+
+def _video_ids_for(query, count):
+    """Deterministic 11-character ids for a query, so repeated queries return the same tracks."""
+    ids = []
+    for i in range(count):
+        digest = hashlib.sha1(f"{query}:{i}".encode()).hexdigest()
+        ids.append(digest[:11])
+    return ids
+
+
+class FakeYTMusic:
+    """Answers search() like ytmusicapi.YTMusic after BENCH_SEARCH_LATENCY seconds."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def search(self, query, filter=None, limit=20, **kwargs):
+        time.sleep(_setting("BENCH_SEARCH_LATENCY", 0.15))
+        if filter in ("albums", "playlists"):
+            return [self._collection(collection_id, filter) for collection_id in _video_ids_for(f"{filter}:{query}", limit)]
+        items = []
+        for video_id in _video_ids_for(f"{filter}:{query}", limit):
+            track = _fake_track(video_id)
+            items.append({
+                "videoId": video_id,
+                "title": track["title"],
+                "artists": [{"name": track["artist"]}],
+                "duration_seconds": track["duration"],
+                "thumbnails": [{"url": f"https://example.invalid/{video_id}.jpg"}],
+                "resultType": "song" if filter == "songs" else "video",
+            })
+        return items
+
+    @staticmethod
+    def _collection(collection_id, filter):
+        number = int(hashlib.md5(collection_id.encode()).hexdigest()[:6], 16)
+        if filter == "albums":
+            return {"browseId": f"MPREb_{collection_id}", "title": f"Bench Album {number % 1000}",
+                    "artists": [{"name": f"Bench Artist {number % 97}"}], "year": str(1970 + number % 50), "resultType": "album"}
+        return {"browseId": f"VLPL{collection_id}", "title": f"Bench Playlist {number % 1000}",
+                "author": f"Bench Curator {number % 97}", "itemCount": str(5 + number % 20), "resultType": "playlist"}
+
+    def _tracks(self, collection_id, count):
+        tracks = []
+        for video_id in _video_ids_for(collection_id, count):
+            track = _fake_track(video_id)
+            tracks.append({"videoId": video_id, "title": track["title"], "artists": [{"name": track["artist"]}],
+                           "duration_seconds": track["duration"]})
+        return tracks
+
+    def get_album(self, browseId):
+        time.sleep(_setting("BENCH_SEARCH_LATENCY", 0.15))
+        album = self._collection(browseId, "albums")
+        return {"title": album["title"], "artists": album["artists"], "tracks": self._tracks(browseId, 5 + len(browseId) % 8)}
+
+    def get_playlist(self, playlistId, limit=100, **kwargs):
+        time.sleep(_setting("BENCH_SEARCH_LATENCY", 0.15))
+        playlist = self._collection(playlistId, "playlists")
+        tracks = self._tracks(playlistId, int(playlist["itemCount"]))[:limit]
+        return {"title": playlist["title"], "author": {"name": playlist["author"]}, "trackCount": len(tracks), "tracks": tracks}
+
+
+class FakeYoutubeDL:
+    """Implements the parts of yt_dlp.YoutubeDL the bot uses, with simulated latency and output files."""
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add_progress_hook(self, hook):
+        pass
+
+    def add_postprocessor_hook(self, hook):
+        pass
+
+    def close(self):
+        pass
+
+    def extract_info(self, url, download=False):
+        search = re.match(r"ytsearch(\d*):(.*)", url)
+        if search:
+            time.sleep(_setting("BENCH_SEARCH_LATENCY", 0.15))
+            count = int(search.group(1) or 1)
+            entries = []
+            for video_id in _video_ids_for(search.group(2), count):
+                track = _fake_track(video_id)
+                entries.append({"id": video_id, "title": track["title"], "channel": track["artist"], "duration": track["duration"]})
+            return {"_type": "playlist", "entries": entries}
+
+        time.sleep(_setting("BENCH_EXTRACT_LATENCY", 0.3))
+        video_id = url.rsplit("v=", 1)[-1]
+        track = _fake_track(video_id)
+        return {
+            "id": video_id,
+            "title": track["title"],
+            "uploader": track["artist"],
+            "duration": track["duration"],
+            "webpage_url": url,
+            # Not a plain HTTP stream, so the streaming pipeline falls back to the temp-file path
+            "protocol": "m3u8_native",
+            "ext": "m4a",
+            "acodec": "mp4a.40.2",
+            "url": f"https://example.invalid/{video_id}.m4a",
+        }
+
+    @staticmethod
+    def sanitize_info(info, remove_private_keys=False):
+        return dict(info)
+
+    def process_ie_result(self, info, download=True):
+        if not download:
+            return info
+        time.sleep(_setting("BENCH_DOWNLOAD_LATENCY", 0.5))
+        codec = "m4a"
+        for postprocessor in self.params.get("postprocessors", []):
+            codec = postprocessor.get("preferredcodec", codec)
+        # Native mode keeps AAC sources as stream copies, anything else is a transcode
+        if not (codec == "m4a" and info.get("acodec", "").startswith("mp4a")):
+            _burn_cpu(_setting("BENCH_TRANSCODE_CPU", 0.2))
+        output_path = self.params["outtmpl"].replace("%(id)s", info["id"]).replace("%(ext)s", codec)
+        with open(output_path, "wb") as f:
+            f.write(b"\0" * int(_setting("BENCH_PAYLOAD_BYTES", 3_000_000)))
+        return info
+
+    def download(self, urls):
+        for url in urls:
+            self.process_ie_result(self.extract_info(url), download=True)
+        return 0
+
+
+def fake_ffmpeg(args):
+    """Stands in for download_worker._run_ffmpeg: burns CPU and writes an output sized by the "-b:a" bitrate."""
+    source_path, output_path = args[args.index("-i") + 1], args[-1]
+    bitrate = args[args.index("-b:a") + 1] if "-b:a" in args else "128k"
+    _burn_cpu(_setting("BENCH_TRANSCODE_CPU", 0.2))
+    with open(output_path, "wb") as f:
+        f.write(b"\0" * (os.path.getsize(source_path) * int(bitrate.rstrip("k")) // 256))
+    return 0, ""
+
+
+def install():
+    """
+    Replaces YoutubeDL, YTMusic and the ffmpeg runs of download_worker with the fakes in this process.
+    Also used as the download pool initializer.
+    """
+    import yt_dlp
+    import download_worker
+    yt_dlp.YoutubeDL = FakeYoutubeDL
+    download_worker._run_ffmpeg = fake_ffmpeg
+    try:
+        # yt_music_search creates its clients on first use, from whatever ytmusicapi.YTMusic is then
+        import ytmusicapi
+        ytmusicapi.YTMusic = FakeYTMusic
+    except ImportError:
+        pass
@@ -0,0 +1,302 @@
+# benchmarks/run_bench.py
+"""
+Offline end-to-end benchmark of the bot. Synthetic chats are driven through handle_search_query and
+button_callback, with fakes for YTMusic/yt-dlp (benchmarks/fakes.py) and a local stand-in for the
+Telegram Bot API (benchmarks/telegram_stub.py). Nothing leaves the machine.
+
+Scenarios:
+    search_miss   every chat sends a different query
+    search_hit    the same queries again (search cache)
+    cache_miss    every chat downloads a different, uncached track
+    cache_hit     new chats download the same tracks again (served by Telegram file_id)
+    burst         all chats at once: half search, half download a few popular uncached tracks
+
+Reports p50/p95/p99 latency, throughput, CPU and RSS per scenario as JSON. Download latency is
+measured from the button press until the stub receives sendAudio for that chat.
+
+    python benchmarks/run_bench.py [--chats 20] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fakes  # noqa: E402
+from telegram_stub import TelegramStub, BOT_ID  # noqa: E402
+
+SCENARIOS = ("search_miss", "search_hit", "cache_miss", "cache_hit", "burst")
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _proc_cpu_seconds(pid):
+    """utime + stime of a process from /proc (Linux only), None elsewhere."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _proc_peak_rss_kib(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class _Bench:
+    def __init__(self, args, work_dir):
+        self.args = args
+        self.work_dir = work_dir
+        self.update_ids = iter(range(1, 10**9))
+        self.next_chat_id = 100000
+        self.handler_errors = 0
+
+    def _user(self, chat_id):
+        return {"id": chat_id, "is_bot": False, "first_name": f"Chat{chat_id}"}
+
+    def message_update(self, chat_id, text):
+        update_id = next(self.update_ids)
+        return {"update_id": update_id, "message": {
+            "message_id": update_id, "date": int(time.time()), "text": text,
+            "chat": {"id": chat_id, "type": "private"}, "from": self._user(chat_id),
+        }}
+
+    def callback_update(self, chat_id, data):
+        update_id = next(self.update_ids)
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "chat_instance": str(chat_id), "data": data, "from": self._user(chat_id),
+            "message": {
+                "message_id": update_id, "date": int(time.time()), "text": "Here's what I found:",
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": BOT_ID, "is_bot": True, "first_name": "BenchBot"},
+            },
+        }}
+
+    def new_chats(self, count):
+        chats = list(range(self.next_chat_id, self.next_chat_id + count))
+        self.next_chat_id += count
+        return chats
+
+    async def setup(self):
+        import bot
+        import executor
+        import search_cache
+        from cache_manager import init_cache
+        from job_scheduler import init_scheduler
+        from telegram import Update
+
+        logging.getLogger().setLevel(logging.WARNING)
+        self.Update = Update
+        fakes.install()
+        executor.configure_pools(download_workers=self.args.download_workers)
+        # Download workers are separate processes, they need the fakes installed as well
+        executor._download_pool = ProcessPoolExecutor(
+            max_workers=executor.DOWNLOAD_WORKERS, mp_context=multiprocessing.get_context("spawn"), initializer=fakes.install,
+        )
+        self.executor = executor
+        search_cache.configure_search_cache()
+        init_cache(cache_dir=os.path.join(self.work_dir, "cache"))
+        self.scheduler = init_scheduler(
+            bot._run_download_job, db_path=os.path.join(self.work_dir, "jobs.sqlite3"),
+            max_concurrent=self.args.concurrency, max_per_chat=1, max_pending_per_chat=1000,
+        )
+        self.stub = TelegramStub(upload_latency=self.args.upload_latency).start()
+        self.application = bot.build_application(f"{BOT_ID}:BENCH", base_url=self.stub.base_url)
+        self.application.add_error_handler(self._count_error)
+        await self.application.initialize()
+        self.scheduler.attach(self.application)
+
+    async def _count_error(self, update, context):
+        self.handler_errors += 1
+        logging.getLogger(__name__).error(f"Handler error: {context.error!r}")
+
+    async def teardown(self):
+        # Jobs still finishing up (deleting their progress message) must not hit a closed database
+        await self.scheduler.drain(timeout=self.args.timeout)
+        await self.application.shutdown()
+        self.scheduler.close()
+        self.executor.shutdown_pools(wait=True)
+        self.stub.stop()
+
+    async def _timed_update(self, payload):
+        started = time.perf_counter()
+        await self.application.process_update(self.Update.de_json(payload, self.application.bot))
+        return time.perf_counter() - started
+
+    async def _run_searches(self, queries):
+        chats = self.new_chats(len(queries))
+        return list(await asyncio.gather(*(
+            self._timed_update(self.message_update(chat_id, query)) for chat_id, query in zip(chats, queries)
+        )))
+
+    async def _run_downloads(self, video_ids):
+        """Presses dl_ buttons in new chats and waits until each chat got its audio. Returns (latencies, timeouts)."""
+        chats = self.new_chats(len(video_ids))
+        started = {}
+        for chat_id in chats:
+            started[chat_id] = time.perf_counter()
+        await asyncio.gather(*(
+            self.application.process_update(self.Update.de_json(self.callback_update(chat_id, f"dl_{video_id}"), self.application.bot))
+            for chat_id, video_id in zip(chats, video_ids)
+        ))
+        deadline = time.perf_counter() + self.args.timeout
+        while time.perf_counter() < deadline and not all(chat_id in self.stub.audio_sent for chat_id in chats):
+            await asyncio.sleep(0.01)
+        latencies = [self.stub.audio_sent[chat_id][0] - started[chat_id] for chat_id in chats if chat_id in self.stub.audio_sent]
+        return latencies, len(chats) - len(latencies)
+
+    def _cpu_snapshot(self):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        total = usage.ru_utime + usage.ru_stime
+        pool = self.executor._download_pool
+        for process in (pool._processes or {}).values() if pool else []:
+            total += _proc_cpu_seconds(process.pid) or 0.0
+        return total
+
+    async def run_scenario(self, name):
+        chats = self.args.chats
+        search_queries = [f"bench query {i}" for i in range(chats)]
+        miss_ids = fakes._video_ids_for("bench-download", chats)
+        cpu_before, wall_started = self._cpu_snapshot(), time.perf_counter()
+        errors_before = self.handler_errors
+        timeouts = 0
+
+        if name in ("search_miss", "search_hit"):
+            latencies = await self._run_searches(search_queries)
+        elif name in ("cache_miss", "cache_hit"):
+            latencies, timeouts = await self._run_downloads(miss_ids)
+        else:
+            popular = fakes._video_ids_for("bench-burst", 3)
+            downloads = [popular[i % len(popular)] for i in range(chats - chats // 2)]
+            (search_latencies, (download_latencies, timeouts)) = await asyncio.gather(
+                self._run_searches([f"burst query {i}" for i in range(chats // 2)]),
+                self._run_downloads(downloads),
+            )
+            latencies = search_latencies + download_latencies
+
+        wall = time.perf_counter() - wall_started
+        return {
+            "requests": len(latencies) + timeouts,
+            "completed": len(latencies),
+            "timeouts": timeouts,
+            "handler_errors": self.handler_errors - errors_before,
+            "wall_seconds": wall,
+            "throughput_per_s": len(latencies) / wall if wall else None,
+            "latency_ms": {
+                label: (value * 1000 if value is not None else None)
+                for label, value in (("p50", _percentile(latencies, 0.50)), ("p95", _percentile(latencies, 0.95)),
+                                     ("p99", _percentile(latencies, 0.99)), ("max", max(latencies, default=None)))
+            },
+            "cpu_seconds": self._cpu_snapshot() - cpu_before,
+        }
+
+    def rss(self):
+        pool = self.executor._download_pool
+        workers = [_proc_peak_rss_kib(process.pid) for process in (pool._processes or {}).values()] if pool else []
+        return {
+            # ru_maxrss is in KiB on Linux
+            "main_peak_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "download_workers_peak_kib": [value for value in workers if value is not None],
+        }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _compare(report, baseline_path):
+    """Prints the relative change against a previous report to stderr."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"Compared with {baseline.get('git_commit')}:", file=sys.stderr)
+    for name, result in report["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        changes = []
+        for label in ("p50", "p95", "p99"):
+            new_value, old_value = result["latency_ms"][label], old["latency_ms"][label]
+            if new_value is not None and old_value:
+                changes.append(f"{label} {100 * (new_value - old_value) / old_value:+.1f}%")
+        if result["throughput_per_s"] and old.get("throughput_per_s"):
+            changes.append(f"throughput {100 * (result['throughput_per_s'] - old['throughput_per_s']) / old['throughput_per_s']:+.1f}%")
+        print(f"  {name}: {', '.join(changes)}", file=sys.stderr)
+
+
+async def _main(args):
+    work_dir = tempfile.mkdtemp(prefix="bench_bot_")
+    bench = _Bench(args, work_dir)
+    await bench.setup()
+    scenarios = {}
+    try:
+        for name in args.scenarios:
+            scenarios[name] = await bench.run_scenario(name)
+            print(f"{name}: p50={scenarios[name]['latency_ms']['p50']} ms", file=sys.stderr)
+        rss = bench.rss()
+        calls = dict(bench.stub.calls)
+        uploaded = bench.stub.uploaded_bytes
+    finally:
+        await bench.teardown()
+    return {
+        "benchmark": "bot",
+        "git_commit": _git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "scenarios": scenarios,
+        "rss": rss,
+        "telegram_calls": calls,
+        "uploaded_bytes": uploaded,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=20, help="synthetic chats per scenario")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=4, help="global download limit of the job scheduler")
+    parser.add_argument("--download-workers", type=int, default=2)
+    parser.add_argument("--upload-latency", type=float, default=0.05, help="seconds the stub takes per audio upload")
+    parser.add_argument("--timeout", type=float, default=180.0, help="seconds to wait for the downloads of a scenario")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--compare", help="previous JSON report to compare against")
+    args = parser.parse_args()
+
+    report = asyncio.run(_main(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    if args.compare:
+        _compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+# benchmarks/shared_cache_standin.py
+"""
+Runs several bot nodes (separate processes, each with its own ./cache) against one shared cache
+storage and has all of them request the same tracks at the same time. YTMusic/yt-dlp are faked
+(benchmarks/fakes.py), so nothing leaves the machine.
+
+The storage is either a shared directory (--storage local) or a minimal S3-compatible server started
+here (--storage s3): path-style GET/PUT/DELETE with If-None-Match/If-Match conditional writes,
+the subset of S3 that cache_storage.S3Storage uses, like a local MinIO. The s3 mode needs boto3.
+
+Checks that every track was fetched from YouTube by exactly one node while the others copied it from
+the storage, and that a file_id stored by one node reaches a node that pulls the track later.
+Exits with 1 when a check fails.
+
+    python benchmarks/shared_cache_standin.py [--storage s3] [--nodes 4] [--tracks 6] [--output results.json]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, unquote
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fakes  # noqa: E402
+
+BUCKET = "bot-cache"
+
+
+class _S3Handler(BaseHTTPRequestHandler):
+    """Path-style S3 object requests on an in-memory dict {(bucket, key): (body, etag)}."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _object_key(self):
+        bucket, _, key = unquote(urlsplit(self.path).path).lstrip("/").partition("/")
+        return bucket, key
+
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _error(self, status, code):
+        body = f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code><Message>{code}</Message></Error>'.encode()
+        self._send(status, body, {"Content-Type": "application/xml"})
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            raw = b""
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if size == 0:
+                    # Trailers (e.g. x-amz-checksum-crc32) up to the empty line
+                    while self.rfile.readline().strip():
+                        pass
+                    break
+                raw += self.rfile.read(size)
+                self.rfile.readline()
+        else:
+            raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if "aws-chunked" not in self.headers.get("Content-Encoding", "") and \
+                not self.headers.get("x-amz-content-sha256", "").startswith("STREAMING"):
+            return raw
+        # aws-chunked: "<hex size>[;chunk-signature=...]\r\n<data>\r\n" ... "0\r\n<trailers>\r\n\r\n"
+        body, position = b"", 0
+        while True:
+            line_end = raw.index(b"\r\n", position)
+            size = int(raw[position:line_end].split(b";")[0], 16)
+            if size == 0:
+                return body
+            body += raw[line_end + 2:line_end + 2 + size]
+            position = line_end + 2 + size + 2
+
+    def do_PUT(self):
+        bucket, key = self._object_key()
+        body = self._read_body()
+        store, lock = self.server.objects, self.server.objects_lock
+        with lock:
+            existing = store.get((bucket, key))
+            if self.headers.get("If-None-Match") == "*" and existing is not None:
+                return self._error(412, "PreconditionFailed")
+            if_match = self.headers.get("If-Match")
+            if if_match is not None:
+                if existing is None:
+                    return self._error(404, "NoSuchKey")
+                if if_match != existing[1]:
+                    return self._error(412, "PreconditionFailed")
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            store[(bucket, key)] = (body, etag)
+            self.server.puts += 1
+        self._send(200, headers={"ETag": etag})
+
+    def do_GET(self):
+        bucket, key = self._object_key()
+        with self.server.objects_lock:
+            existing = self.server.objects.get((bucket, key))
+        if existing is None:
+            return self._error(404, "NoSuchKey")
+        self._send(200, existing[0], {"ETag": existing[1], "Content-Type": "application/octet-stream"})
+
+    do_HEAD = do_GET
+
+    def do_DELETE(self):
+        bucket, key = self._object_key()
+        with self.server.objects_lock:
+            self.server.objects.pop((bucket, key), None)
+        self._send(204)
+
+
+def start_s3_standin():
+    """Starts the S3 stand-in on a free local port. Returns the server, its endpoint is server.endpoint_url."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _S3Handler)
+    server.objects, server.objects_lock, server.puts = {}, threading.Lock(), 0
+    server.endpoint_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _node(node_dir, location, endpoint_url, video_ids, start_at):
+    """One bot node: fetches all tracks concurrently through the shared storage. Returns its counters."""
+    import logging
+    import executor
+    import metrics
+    from cache_manager import init_cache
+    from cache_storage import init_storage
+    import yt_downloader
+
+    logging.basicConfig(level=logging.WARNING)
+    fakes.install()
+    executor._download_pool = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn"), initializer=fakes.install)
+    init_cache(cache_dir=node_dir)
+    init_storage(location, endpoint_url=endpoint_url)
+
+    async def fetch_all():
+        # All nodes start together, so they race for the same locks
+        await asyncio.sleep(max(0.0, start_at - time.time()))
+        started = time.perf_counter()
+        entries = await asyncio.gather(*(yt_downloader._fetch_track_shared(video_id) for video_id in video_ids))
+        return entries, time.perf_counter() - started
+
+    try:
+        entries, seconds = asyncio.run(fetch_all())
+    finally:
+        executor.shutdown_pools(wait=True)
+    return {
+        "fetched": metrics.CACHE_REQUESTS.value(cache="shared", result="miss"),
+        "pulled": metrics.CACHE_REQUESTS.value(cache="shared", result="hit"),
+        "cached": sum(1 for entry in entries if entry and os.path.exists(entry["audio_path"])),
+        "seconds": round(seconds, 3),
+    }
+
+
+def _late_node(node_dir, location, endpoint_url, video_id):
+    """A node started later that sets a file_id through one storage handle and pulls the track through another."""
+    from cache_manager import AudioCache
+    from cache_storage import open_storage
+
+    open_storage(location, endpoint_url).update_file_id(video_id, "standin-file-id", "standin-unique-id")
+    entry = AudioCache(node_dir).pull(video_id, open_storage(location, endpoint_url))
+    return entry and entry["file_id"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--storage", choices=("local", "s3"), default="local")
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--tracks", type=int, default=6)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    os.environ.setdefault("BENCH_EXTRACT_LATENCY", "0.3")
+    os.environ.setdefault("BENCH_DOWNLOAD_LATENCY", "0.5")
+    os.environ.setdefault("BENCH_PAYLOAD_BYTES", "500000")
+    work_dir = tempfile.mkdtemp(prefix="bench_shared_cache_")
+    server = None
+    endpoint_url = None
+    if args.storage == "s3":
+        server = start_s3_standin()
+        endpoint_url = server.endpoint_url
+        location = f"s3://{BUCKET}/tracks"
+        for name, value in (("AWS_ACCESS_KEY_ID", "standin"), ("AWS_SECRET_ACCESS_KEY", "standin"), ("AWS_DEFAULT_REGION", "us-east-1")):
+            os.environ.setdefault(name, value)
+    else:
+        location = os.path.join(work_dir, "shared")
+
+    video_ids = fakes._video_ids_for("shared-cache", args.tracks)
+    start_at = time.time() + 3
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=args.nodes, mp_context=context) as nodes:
+        futures = [
+            nodes.submit(_node, os.path.join(work_dir, f"node{i}"), location, endpoint_url, video_ids, start_at)
+            for i in range(args.nodes)
+        ]
+        node_results = [future.result() for future in futures]
+        late_file_id = nodes.submit(_late_node, os.path.join(work_dir, "late"), location, endpoint_url, video_ids[0]).result()
+
+    fetched = sum(result["fetched"] for result in node_results)
+    pulled = sum(result["pulled"] for result in node_results)
+    checks = {
+        "each_track_fetched_once": fetched == args.tracks,
+        "other_nodes_pulled": pulled == args.tracks * (args.nodes - 1),
+        "every_node_cached_every_track": all(result["cached"] == args.tracks for result in node_results),
+        "file_id_shared": late_file_id == "standin-file-id",
+    }
+    results = {
+        "storage": args.storage, "nodes": args.nodes, "tracks": args.tracks,
+        "fetched_from_youtube": fetched, "pulled_from_storage": pulled,
+        "upstream_fetches_without_sharing": args.tracks * args.nodes,
+        "node_results": node_results, "checks": checks,
+    }
+    if server is not None:
+        results["s3_puts"] = server.puts
+        server.shutdown()
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    sys.exit(0 if all(checks.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# benchmarks/telegram_stub.py
+"""
+Local stand-in for the Telegram Bot API. Accepts the methods the bot calls (getMe, sendMessage,
+editMessageText, sendAudio, sendDocument, sendMediaGroup, deleteMessage, answerCallbackQuery, answerInlineQuery, ...)
+and records when audio was sent to each chat, the last keyboard shown in each chat and which results
+each inline query was answered with.
+
+Point the bot at it with Application.builder().base_url(stub.base_url).
+"""
+import http.server
+import itertools
+import json
+import re
+import threading
+import time
+import urllib.parse
+
+BOT_ID = 1000
+
+
+class TelegramStub:
+    def __init__(self, upload_latency=0.0):
+        self.upload_latency = upload_latency
+        self.calls = {}  # method -> count
+        self.audio_sent = {}  # chat_id -> list of perf_counter timestamps
+        self.uploaded_bytes = 0
+        self.inline_answers = {}  # inline query id -> (perf_counter timestamp, list of results)
+        self.keyboards = {}  # chat_id -> inline keyboard (rows of button dicts) last sent or edited into a message
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/bot"
+
+    def start(self):
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                method = self.path.rsplit("/", 1)[-1]
+                result = stub.handle(method, body, self.headers.get("Content-Type", ""))
+                payload = json.dumps({"ok": True, "result": result}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        class Server(http.server.ThreadingHTTPServer):
+            # The bot opens many connections at once under load, the default listen backlog of 5 drops some
+            request_queue_size = 128
+
+        self._server = Server(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+    @staticmethod
+    def _params(body, content_type):
+        """Reads the request parameters. PTB posts form fields, or multipart when it uploads a file."""
+        if content_type.startswith("multipart/form-data"):
+            fields = dict(re.findall(rb'name="([^"]+)"\r\n\r\n([^\r]*)\r\n', body))
+            return {key.decode(): value.decode(errors="replace") for key, value in fields.items()}, True
+        if content_type.startswith("application/json"):
+            return json.loads(body or b"{}"), False
+        return {key: values[0] for key, values in urllib.parse.parse_qs(body.decode()).items()}, False
+
+    def _message(self, chat_id, text=None, **extra):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "BenchBot"},
+        }
+        if text is not None:
+            message["text"] = text
+        message.update(extra)
+        return message
+
+    def handle(self, method, body, content_type):
+        params, is_upload = self._params(body, content_type)
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getMe":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "BenchBot", "username": "bench_bot"}
+        if method in ("sendMessage", "editMessageText"):
+            message = self._message(params.get("chat_id", 0), params.get("text", ""))
+            if method == "editMessageText" and params.get("message_id"):
+                message["message_id"] = int(params["message_id"])
+            reply_markup = params.get("reply_markup")
+            if reply_markup:
+                if isinstance(reply_markup, str):
+                    reply_markup = json.loads(reply_markup)
+                with self._lock:
+                    self.keyboards[int(params.get("chat_id", 0))] = reply_markup.get("inline_keyboard") or []
+            return message
+        if method in ("sendAudio", "sendDocument"):
+            if is_upload:
+                time.sleep(self.upload_latency)
+                with self._lock:
+                    self.uploaded_bytes += len(body)
+            file_number = next(self._file_ids)
+            sent_file = {"file_id": f"bench-file-{file_number}", "file_unique_id": f"bench-{file_number}"}
+            if method == "sendAudio":
+                message = self._message(params.get("chat_id", 0), audio={**sent_file, "duration": 0})
+            else:
+                message = self._message(params.get("chat_id", 0), document=sent_file)
+            with self._lock:
+                self.audio_sent.setdefault(int(params.get("chat_id", 0)), []).append(time.perf_counter())
+            return message
+        if method == "answerInlineQuery":
+            results = params.get("results") or []
+            if isinstance(results, str):
+                results = json.loads(results)
+            with self._lock:
+                self.inline_answers[params.get("inline_query_id")] = (time.perf_counter(), results)
+            return True
+        if method == "sendMediaGroup":
+            if is_upload:
+                time.sleep(self.upload_latency)
+                with self._lock:
+                    self.uploaded_bytes += len(body)
+            media = params.get("media") or []
+            if isinstance(media, str):
+                media = json.loads(media)
+            messages = []
+            for _ in media:
+                file_number = next(self._file_ids)
+                audio = {"file_id": f"bench-file-{file_number}", "file_unique_id": f"bench-{file_number}", "duration": 0}
+                messages.append(self._message(params.get("chat_id", 0), audio=audio))
+            with self._lock:
+                self.audio_sent.setdefault(int(params.get("chat_id", 0)), []).extend(time.perf_counter() for _ in messages)
+            return messages
+        return True
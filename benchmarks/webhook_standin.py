@@ -0,0 +1,135 @@
+# benchmarks/webhook_standin.py
+"""
+Runs the bot in webhook mode against local stand-ins and POSTs Update payloads to it, the way
+Telegram would. YTMusic/yt-dlp are faked (benchmarks/fakes.py) and the Bot API is the local stub
+(benchmarks/telegram_stub.py), so nothing leaves the machine.
+
+Checks that requests without the secret token are rejected, that searches and downloads sent
+through the webhook are answered, and that shutdown lets the running downloads finish while the
+ones not started yet stay queued. Exits with 1 when a check fails.
+Needs the webhooks extra: pip install "python-telegram-bot[webhooks]"
+
+    python benchmarks/webhook_standin.py [--chats 10] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import fakes  # noqa: E402
+from run_bench import _Bench, _percentile  # noqa: E402
+
+SECRET_TOKEN = "standin-secret"
+URL_PATH = "telegram"
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _post(client, url, payload, secret_token):
+    """POSTs one update like Telegram does. Returns (status code, seconds until the webhook answered)."""
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret_token} if secret_token else {}
+    started = time.perf_counter()
+    response = await client.post(url, json=payload, headers=headers)
+    return response.status_code, time.perf_counter() - started
+
+
+async def _main(args):
+    bench = _Bench(args, tempfile.mkdtemp(prefix="bench_webhook_"))
+    await bench.setup()
+    application = bench.application
+    port = _free_port()
+    webhook_url = f"http://127.0.0.1:{port}/{URL_PATH}"
+    # The same steps run_webhook() takes, without blocking on signals
+    await application.updater.start_webhook(
+        listen="127.0.0.1", port=port, url_path=URL_PATH, webhook_url=webhook_url, secret_token=SECRET_TOKEN,
+    )
+    await application.start()
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        rejected = [
+            (await _post(client, webhook_url, bench.message_update(1, "no secret"), None))[0],
+            (await _post(client, webhook_url, bench.message_update(1, "wrong secret"), "wrong"))[0],
+        ]
+        search_chats = bench.new_chats(args.chats)
+        download_chats = bench.new_chats(args.chats)
+        video_ids = fakes._video_ids_for("webhook-download", args.chats)
+        started = time.perf_counter()
+        responses = await asyncio.gather(
+            *(_post(client, webhook_url, bench.message_update(chat_id, f"webhook query {chat_id}"), SECRET_TOKEN)
+              for chat_id in search_chats),
+            *(_post(client, webhook_url, bench.callback_update(chat_id, f"dl_{video_id}"), SECRET_TOKEN)
+              for chat_id, video_id in zip(download_chats, video_ids)),
+        )
+
+    # Shut down while downloads are still running: post_stop has to let them finish
+    deadline = time.perf_counter() + args.timeout
+    while not bench.scheduler.in_flight() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    await application.updater.stop()
+    await application.stop()
+    in_flight_at_stop = bench.scheduler.in_flight()
+    await application.post_stop(application)
+    # Jobs that had not started yet stay queued for the next start
+    queued_after_drain = len(bench.scheduler._pending_jobs())
+    downloads_sent = sum(1 for chat_id in download_chats if chat_id in bench.stub.audio_sent)
+    download_latencies = [bench.stub.audio_sent[chat_id][0] - started for chat_id in download_chats if chat_id in bench.stub.audio_sent]
+    searches_answered = bench.stub.calls.get("editMessageText", 0)
+    await bench.teardown()
+
+    statuses = [status for status, _ in responses]
+    return {
+        "benchmark": "webhook",
+        "rejected_without_secret": rejected,
+        "accepted": statuses.count(200),
+        "failed": len(statuses) - statuses.count(200),
+        "webhook_response_ms": {
+            "p50": _percentile([seconds * 1000 for _, seconds in responses], 0.50),
+            "p95": _percentile([seconds * 1000 for _, seconds in responses], 0.95),
+        },
+        "handler_errors": bench.handler_errors,
+        "edits_sent": searches_answered,
+        "downloads_in_flight_at_stop": in_flight_at_stop,
+        "downloads_sent": downloads_sent,
+        "downloads_queued_after_drain": queued_after_drain,
+        "downloads_expected": len(download_chats),
+        "download_p95_ms": (_percentile(download_latencies, 0.95) or 0) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=10, help="chats that search, and as many that download")
+    parser.add_argument("--concurrency", type=int, default=4, help="global download limit of the job scheduler")
+    parser.add_argument("--download-workers", type=int, default=2)
+    parser.add_argument("--upload-latency", type=float, default=0.05, help="seconds the stub takes per audio upload")
+    parser.add_argument("--timeout", type=float, default=180.0, help="seconds shutdown waits for running downloads")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(_main(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    ok = (all(status == 403 for status in report["rejected_without_secret"]) and not report["failed"]
+          and report["downloads_sent"] + report["downloads_queued_after_drain"] == report["downloads_expected"])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
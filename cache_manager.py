@@ -0,0 +1,331 @@
+# cache_manager.py
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = "./cache"
+INDEX_FILE_NAME = "index.sqlite3"
+
+# Byte budget for cached audio, older/less used entries are evicted above it
+CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# "lru" evicts the least recently used entries first, "lfu" the least frequently used
+CACHE_EVICTION_POLICY = "lru"
+
+AUDIO_EXTENSIONS = (".mp3", ".m4a", ".opus")
+
+# Quality variants of a track (see yt_downloader.AUDIO_VARIANTS) are cached as entries of their own,
+# keyed <video_id>@<quality>, with their own eviction and file_id
+VARIANT_SEPARATOR = "@"
+
+
+def variant_key(video_id, quality):
+    """The cache key of a quality variant of `video_id`."""
+    return f"{video_id}{VARIANT_SEPARATOR}{quality}"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    video_id TEXT PRIMARY KEY,
+    audio_path TEXT NOT NULL,
+    metadata_path TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    duration INTEGER NOT NULL DEFAULT 0,
+    title TEXT,
+    artist TEXT,
+    container TEXT,
+    codec TEXT,
+    file_id TEXT,
+    file_unique_id TEXT,
+    hit_count INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+)
+"""
+
+# Columns added after the first version of the schema, added to older index files on open
+_ADDED_COLUMNS = {"container": "TEXT", "codec": "TEXT"}
+
+
+def _write_json_atomic(path, data):
+    """Writes JSON next to `path` and moves it into place so readers never see a partial file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+
+def _is_cache_metadata(path, key):
+    """True when `path` holds metadata the cache wrote for `key`: a JSON object naming the key's video_id."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return isinstance(metadata, dict) and metadata.get("video_id") == key.split(VARIANT_SEPARATOR)[0]
+
+
+class AudioCache:
+    """
+    Index of the audio files in the cache directory, kept in SQLite.
+    Entries hold the paths, size, duration, hit count, last access and the Telegram file_id of each track.
+    Every entry also has a <video_id>.json metadata file next to its audio so the directory stays readable without the index.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, eviction_policy=CACHE_EVICTION_POLICY):
+        if eviction_policy not in ("lru", "lfu"):
+            raise ValueError(f"Unknown cache eviction policy: {eviction_policy}")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.eviction_policy = eviction_policy
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, INDEX_FILE_NAME), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.execute(_SCHEMA)
+            existing = {row["name"] for row in self._db.execute("PRAGMA table_info(tracks)")}
+            for column, column_type in _ADDED_COLUMNS.items():
+                if column not in existing:
+                    self._db.execute(f"ALTER TABLE tracks ADD COLUMN {column} {column_type}")
+
+    def audio_path(self, video_id, ext="mp3"):
+        return os.path.join(self.cache_dir, f"{video_id}.{ext}")
+
+    def metadata_path(self, video_id):
+        return os.path.join(self.cache_dir, f"{video_id}.json")
+
+    def lookup(self, video_id):
+        """
+        Returns the index entry for `video_id` as a dict, or None on a miss.
+        Entries whose audio file is missing or has the wrong size are dropped and reported as a miss.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT * FROM tracks WHERE video_id = ?", (video_id,)).fetchone()
+        if row is None:
+            return None
+        entry = dict(row)
+        try:
+            actual_size = os.path.getsize(entry["audio_path"])
+        except OSError:
+            actual_size = None
+        if actual_size != entry["size_bytes"]:
+            logger.warning("[%s] Cached audio failed integrity check (expected %s bytes, found %s). Dropping entry.", video_id, entry['size_bytes'], actual_size)
+            self.remove(video_id)
+            return None
+        return entry
+
+    def record_hit(self, video_id):
+        """Counts a served request for `video_id`."""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE tracks SET hit_count = hit_count + 1, last_access = ? WHERE video_id = ?",
+                (time.time(), video_id),
+            )
+
+    def insert(self, video_id, temp_audio_path, metadata, container=None):
+        """
+        Moves a finished audio file into the cache and indexes it. `container` is the file extension
+        to store it under, taken from `temp_audio_path` when not given.
+        The metadata file is written first and the audio is moved into place with os.replace,
+        the index row is only added once both are complete. Audio of an earlier entry for `video_id` stored
+        under another container (the delivery mode changed) is deleted. Returns the new entry.
+        """
+        audio_path = self.audio_path(video_id, container or os.path.splitext(temp_audio_path)[1].lstrip("."))
+        metadata_path = self.metadata_path(video_id)
+        with self._lock:
+            previous = self._db.execute("SELECT audio_path FROM tracks WHERE video_id = ?", (video_id,)).fetchone()
+        _write_json_atomic(metadata_path, metadata)
+        os.replace(temp_audio_path, audio_path)
+        self._index(video_id, audio_path, metadata_path, metadata)
+        # Once re-indexed, the old file is outside the byte budget and reconcile would not see it as an orphan
+        if previous and previous["audio_path"] != audio_path and os.path.exists(previous["audio_path"]):
+            os.remove(previous["audio_path"])
+        logger.info("[%s] Added to cache: %s", video_id, audio_path)
+        self.evict(keep=video_id)
+        return self.lookup(video_id)
+
+    def _index(self, video_id, audio_path, metadata_path, metadata, hit_count=0):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO tracks (video_id, audio_path, metadata_path, size_bytes, duration, title, artist,"
+                " container, codec, file_id, file_unique_id, hit_count, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    video_id, audio_path, metadata_path, os.path.getsize(audio_path),
+                    int(metadata.get("duration") or 0), metadata.get("title"), metadata.get("artist"),
+                    # Entries from before the container was recorded are MP3s
+                    metadata.get("container") or os.path.splitext(audio_path)[1].lstrip("."),
+                    metadata.get("codec") or ("mp3" if audio_path.endswith(".mp3") else None),
+                    metadata.get("file_id"), metadata.get("file_unique_id"), hit_count, now, now,
+                ),
+            )
+
+    def set_file_id(self, video_id, file_id, file_unique_id=None):
+        """Stores (or clears, with None) the Telegram file_id of a cached track in the index and its metadata file."""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE tracks SET file_id = ?, file_unique_id = ? WHERE video_id = ?",
+                (file_id, file_unique_id, video_id),
+            )
+        metadata_path = self.metadata_path(video_id)
+        try:
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+            metadata["file_id"] = file_id
+            metadata["file_unique_id"] = file_unique_id
+            _write_json_atomic(metadata_path, metadata)
+        except Exception as json_err:
+            logger.error("[%s] Failed to store file_id in %s: %s", video_id, metadata_path, json_err)
+
+    def pull(self, video_id, storage):
+        """
+        Copies a track from the shared storage (see cache_storage) into the cache, including its file_id.
+        Returns the new entry, or None when the storage does not have the track. Blocking.
+        """
+        metadata = storage.get_metadata(video_id)
+        if metadata is None:
+            return None
+        container = metadata.get("container") or "mp3"
+        temp_path = os.path.join(self.cache_dir, f"{video_id}_temp.{container}.part")
+        try:
+            if not storage.download_audio(video_id, container, temp_path):
+                logger.warning("[%s] Shared storage has metadata but no audio.", video_id)
+                return None
+            entry = self.insert(video_id, temp_path, metadata, container=container)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        logger.info("[%s] Pulled from shared storage.", video_id)
+        return entry
+
+    def push(self, video_id, storage):
+        """Copies a cached track and its metadata file to the shared storage. Blocking."""
+        entry = self.lookup(video_id)
+        if entry is None:
+            return
+        with open(entry["metadata_path"], "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        # Entries from before the container was recorded only have it in the index
+        metadata.setdefault("container", entry["container"])
+        storage.put_track(video_id, entry["audio_path"], metadata)
+        logger.info("[%s] Pushed to shared storage.", video_id)
+
+    def remove(self, video_id):
+        """Deletes a track's files and index entry."""
+        with self._lock, self._db:
+            row = self._db.execute("SELECT audio_path, metadata_path FROM tracks WHERE video_id = ?", (video_id,)).fetchone()
+            self._db.execute("DELETE FROM tracks WHERE video_id = ?", (video_id,))
+        paths = [row["audio_path"], row["metadata_path"]] if row else [self.metadata_path(video_id)]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def entries(self):
+        """Returns video_id, title, artist, duration and file_id of every cached track, without the quality variants."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT video_id, title, artist, duration, file_id FROM tracks WHERE instr(video_id, ?) = 0", (VARIANT_SEPARATOR,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def total_bytes(self):
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM tracks").fetchone()[0]
+
+    def evict(self, keep=None):
+        """Removes entries by the eviction policy until the cache fits into max_bytes. `keep` is never evicted."""
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+        order = "last_access ASC" if self.eviction_policy == "lru" else "hit_count ASC, last_access ASC"
+        with self._lock:
+            candidates = self._db.execute(f"SELECT video_id, size_bytes FROM tracks ORDER BY {order}").fetchall()
+        for row in candidates:
+            if total <= self.max_bytes:
+                break
+            if row["video_id"] == keep:
+                continue
+            self.remove(row["video_id"])
+            total -= row["size_bytes"]
+            logger.info("[%s] Evicted from cache (%s), %s bytes freed.", row['video_id'], self.eviction_policy, row['size_bytes'])
+
+    def reconcile(self):
+        """
+        Startup pass that brings the index and the directory in line:
+        index entries with missing or resized audio are dropped, audio+metadata pairs that are
+        not indexed are adopted, and audio without metadata, audio replaced by another container of an indexed track,
+        metadata without audio and leftover temp files are removed.
+        Other files in the directory (anything that is not a track's audio, metadata or temp file) are left alone.
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT video_id, audio_path, size_bytes FROM tracks").fetchall()
+        indexed = set()
+        indexed_paths = set()
+        for row in rows:
+            if not os.path.exists(row["audio_path"]) or os.path.getsize(row["audio_path"]) != row["size_bytes"]:
+                logger.warning("[%s] Indexed audio missing or changed on disk. Removing entry.", row['video_id'])
+                self.remove(row["video_id"])
+            else:
+                indexed.add(row["video_id"])
+                indexed_paths.add(os.path.normpath(row["audio_path"]))
+
+        adopted = removed = 0
+        names = set(os.listdir(self.cache_dir))
+        for name in sorted(names):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(INDEX_FILE_NAME) or not os.path.isfile(path):
+                continue
+            video_id, ext = os.path.splitext(name)
+            if "_temp" in video_id or name.endswith((".part", ".json.tmp")):
+                os.remove(path)
+                removed += 1
+            elif ext in AUDIO_EXTENSIONS and video_id in indexed and os.path.normpath(path) not in indexed_paths:
+                # Audio of an indexed track under a container it was replaced by
+                os.remove(path)
+                removed += 1
+            elif ext in AUDIO_EXTENSIONS and video_id not in indexed:
+                metadata_path = self.metadata_path(video_id)
+                try:
+                    with open(metadata_path, "r", encoding="utf-8") as f:
+                        metadata = json.load(f)
+                except (OSError, ValueError):
+                    logger.warning("[%s] Cached audio has no readable metadata. Removing orphan %s.", video_id, path)
+                    os.remove(path)
+                    removed += 1
+                    continue
+                self._index(video_id, path, metadata_path, metadata)
+                indexed.add(video_id)
+                adopted += 1
+            elif ext == ".json" and not any(f"{video_id}{audio_ext}" in names for audio_ext in AUDIO_EXTENSIONS) \
+                    and _is_cache_metadata(path, video_id):
+                os.remove(path)
+                removed += 1
+        logger.info("Cache reconciled: %s tracks indexed, %s adopted, %s orphan files removed.", len(indexed), adopted, removed)
+        self.evict()
+
+
+_cache = None
+
+
+def init_cache(cache_dir=CACHE_DIR, max_bytes=None, eviction_policy=None):
+    """Creates the shared cache index and reconciles it with the directory. Call once at startup."""
+    global _cache
+    _cache = AudioCache(
+        cache_dir,
+        max_bytes=max_bytes or CACHE_MAX_BYTES,
+        eviction_policy=eviction_policy or CACHE_EVICTION_POLICY,
+    )
+    _cache.reconcile()
+    return _cache
+
+
+def get_cache():
+    """Returns the shared cache index, creating it with the defaults if init_cache() was not called."""
+    if _cache is None:
+        return init_cache()
+    return _cache
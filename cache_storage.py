@@ -0,0 +1,264 @@
+# cache_storage.py
+import abc
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Seconds a node may hold the fetch lock of a video_id before other nodes may take it over
+SHARED_LOCK_TTL = 300
+# Seconds between checks while another node fetches a track
+SHARED_LOCK_POLL_INTERVAL = 1.0
+# Identifies this bot instance as the owner of its locks
+NODE_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class CacheStorage(abc.ABC):
+    """
+    Storage shared by several bot instances: one audio object and one metadata JSON per video_id
+    (the same metadata as the local <video_id>.json, including the Telegram file_id), plus a
+    lock per video_id so only one node fetches a track from YouTube. All methods are blocking.
+    """
+
+    @abc.abstractmethod
+    def get_metadata(self, video_id):
+        """Returns the metadata dict of a stored track, or None."""
+
+    @abc.abstractmethod
+    def put_metadata(self, video_id, metadata):
+        pass
+
+    @abc.abstractmethod
+    def download_audio(self, video_id, container, dest_path):
+        """Copies the stored audio to `dest_path`. Returns False when it does not exist."""
+
+    @abc.abstractmethod
+    def upload_audio(self, video_id, container, src_path):
+        pass
+
+    @abc.abstractmethod
+    def acquire_lock(self, video_id, ttl=SHARED_LOCK_TTL):
+        """Takes the fetch lock of a video_id for this node. Returns False while another node holds it."""
+
+    @abc.abstractmethod
+    def release_lock(self, video_id):
+        pass
+
+    def put_track(self, video_id, audio_path, metadata):
+        """Stores a finished track. The audio goes first, so a node that sees the metadata can always get the audio."""
+        self.upload_audio(video_id, metadata["container"], audio_path)
+        self.put_metadata(video_id, metadata)
+
+    def update_file_id(self, video_id, file_id, file_unique_id=None):
+        """Stores (or clears, with None) the Telegram file_id in the shared metadata."""
+        metadata = self.get_metadata(video_id)
+        if metadata is None:
+            return
+        metadata["file_id"] = file_id
+        metadata["file_unique_id"] = file_unique_id
+        self.put_metadata(video_id, metadata)
+
+
+def _lock_body(ttl):
+    return {"owner": NODE_ID, "expires_at": time.time() + ttl}
+
+
+class LocalStorage(CacheStorage):
+    """Storage in a directory, e.g. an NFS mount shared by the nodes. Locks are files created with O_EXCL."""
+
+    def __init__(self, root):
+        self.root = root
+        for sub_dir in ("audio", "meta", "locks"):
+            os.makedirs(os.path.join(root, sub_dir), exist_ok=True)
+
+    def _path(self, kind, name):
+        return os.path.join(self.root, kind, name)
+
+    def get_metadata(self, video_id):
+        try:
+            with open(self._path("meta", f"{video_id}.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put_metadata(self, video_id, metadata):
+        path = self._path("meta", f"{video_id}.json")
+        tmp_path = f"{path}.{NODE_ID}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, path)
+
+    def download_audio(self, video_id, container, dest_path):
+        try:
+            with open(self._path("audio", f"{video_id}.{container}"), "rb") as src, open(dest_path, "wb") as dest:
+                while chunk := src.read(1024 * 1024):
+                    dest.write(chunk)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def upload_audio(self, video_id, container, src_path):
+        path = self._path("audio", f"{video_id}.{container}")
+        tmp_path = f"{path}.{NODE_ID}.tmp"
+        with open(src_path, "rb") as src, open(tmp_path, "wb") as dest:
+            while chunk := src.read(1024 * 1024):
+                dest.write(chunk)
+        os.replace(tmp_path, path)
+
+    def acquire_lock(self, video_id, ttl=SHARED_LOCK_TTL):
+        path = self._path("locks", f"{video_id}.lock")
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        lock = json.load(f)
+                except (OSError, ValueError):
+                    return False  # being written or released right now
+                if lock.get("expires_at", 0) > time.time():
+                    return lock.get("owner") == NODE_ID
+                # Expired: only the node whose rename succeeds clears it, then everyone races for O_EXCL again
+                try:
+                    os.rename(path, f"{path}.{NODE_ID}.expired")
+                    os.remove(f"{path}.{NODE_ID}.expired")
+                except OSError:
+                    pass
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(_lock_body(ttl), f)
+            return True
+        return False
+
+    def release_lock(self, video_id):
+        path = self._path("locks", f"{video_id}.lock")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                if json.load(f).get("owner") == NODE_ID:
+                    os.remove(path)
+        except (OSError, ValueError):
+            pass
+
+
+class S3Storage(CacheStorage):
+    """
+    Storage in an S3-compatible bucket (AWS S3, MinIO, ...). Needs boto3.
+    Locks are objects written with conditional requests (If-None-Match / If-Match),
+    so only one node can create a lock or take over an expired one.
+    """
+
+    def __init__(self, bucket, prefix="", endpoint_url=None, **client_kwargs):
+        import boto3
+        from botocore.exceptions import ClientError
+        self._ClientError = ClientError
+        self.bucket = bucket
+        self.prefix = f"{prefix.strip('/')}/" if prefix.strip("/") else ""
+        self._s3 = boto3.client("s3", endpoint_url=endpoint_url, **client_kwargs)
+
+    def _key(self, kind, name):
+        return f"{self.prefix}{kind}/{name}"
+
+    def _error_code(self, error):
+        return error.response.get("Error", {}).get("Code")
+
+    def get_metadata(self, video_id):
+        try:
+            response = self._s3.get_object(Bucket=self.bucket, Key=self._key("meta", f"{video_id}.json"))
+        except self._ClientError as e:
+            if self._error_code(e) in ("NoSuchKey", "404"):
+                return None
+            raise
+        return json.loads(response["Body"].read())
+
+    def put_metadata(self, video_id, metadata):
+        self._s3.put_object(
+            Bucket=self.bucket, Key=self._key("meta", f"{video_id}.json"),
+            Body=json.dumps(metadata, ensure_ascii=False).encode(), ContentType="application/json",
+        )
+
+    def download_audio(self, video_id, container, dest_path):
+        try:
+            response = self._s3.get_object(Bucket=self.bucket, Key=self._key("audio", f"{video_id}.{container}"))
+        except self._ClientError as e:
+            if self._error_code(e) in ("NoSuchKey", "404"):
+                return False
+            raise
+        with open(dest_path, "wb") as dest:
+            for chunk in response["Body"].iter_chunks(1024 * 1024):
+                dest.write(chunk)
+        return True
+
+    def upload_audio(self, video_id, container, src_path):
+        with open(src_path, "rb") as src:
+            self._s3.put_object(Bucket=self.bucket, Key=self._key("audio", f"{video_id}.{container}"), Body=src)
+
+    def acquire_lock(self, video_id, ttl=SHARED_LOCK_TTL):
+        key = self._key("locks", f"{video_id}.lock")
+        body = json.dumps(_lock_body(ttl)).encode()
+        try:
+            self._s3.put_object(Bucket=self.bucket, Key=key, Body=body, IfNoneMatch="*")
+            return True
+        except self._ClientError as e:
+            if self._error_code(e) not in ("PreconditionFailed", "412", "ConditionalRequestConflict"):
+                raise
+        try:
+            response = self._s3.get_object(Bucket=self.bucket, Key=key)
+        except self._ClientError as e:
+            if self._error_code(e) in ("NoSuchKey", "404"):
+                return False  # released in between, the next attempt can create it
+            raise
+        lock = json.loads(response["Body"].read())
+        if lock.get("expires_at", 0) > time.time():
+            return lock.get("owner") == NODE_ID
+        # Take over the expired lock, unless another node replaced it since it was read
+        try:
+            self._s3.put_object(Bucket=self.bucket, Key=key, Body=body, IfMatch=response["ETag"])
+            return True
+        except self._ClientError as e:
+            if self._error_code(e) in ("PreconditionFailed", "412", "ConditionalRequestConflict", "NoSuchKey", "404"):
+                return False
+            raise
+
+    def release_lock(self, video_id):
+        key = self._key("locks", f"{video_id}.lock")
+        try:
+            response = self._s3.get_object(Bucket=self.bucket, Key=key)
+            if json.loads(response["Body"].read()).get("owner") == NODE_ID:
+                self._s3.delete_object(Bucket=self.bucket, Key=key)
+        except self._ClientError as e:
+            if self._error_code(e) not in ("NoSuchKey", "404"):
+                raise
+
+
+_storage = None
+
+
+def open_storage(location, endpoint_url=None):
+    """
+    Opens the shared storage at `location`: "s3://bucket/prefix" for an S3-compatible bucket
+    (`endpoint_url` points at MinIO or another non-AWS server), anything else is a directory path.
+    """
+    if location.startswith("s3://"):
+        parts = urlsplit(location)
+        storage = S3Storage(parts.netloc, parts.path, endpoint_url=endpoint_url)
+    else:
+        storage = LocalStorage(location)
+    logger.info("Shared cache storage: %s (node %s)", location, NODE_ID)
+    return storage
+
+
+def init_storage(location=None, endpoint_url=None):
+    """Opens the shared storage used by all nodes. None for `location` keeps the cache local to this node."""
+    global _storage
+    _storage = open_storage(location, endpoint_url) if location else None
+    return _storage
+
+
+def get_storage():
+    """Returns the shared storage, or None when init_storage() was not called with a location."""
+    return _storage
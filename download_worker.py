@@ -0,0 +1,185 @@
+# download_worker.py
+# Blocking download and transcode functions run in the download process pool (see executor.run_download).
+# Kept apart from yt_downloader so that spawning a pool process only imports this module, not the
+# Telegram client and the rest of the bot; yt_dlp itself is imported on the first job.
+import os
+import re
+import subprocess
+import threading
+import time
+from ydl_pool import get_ydl
+
+# Container -> ffmpeg muxer, needed because streamed output is written to a .part file
+CONTAINER_MUXERS = {"m4a": "ipod", "mp3": "mp3"}
+
+STREAM_READ_SIZE = 64 * 1024
+# YouTube throttles unranged downloads, so the stream is fetched in ranges (like yt-dlp's http_chunk_size)
+STREAM_RANGE_SIZE = 10 * 1024 * 1024
+_CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+# Timestamps of the running download, written by the hooks of the pooled YoutubeDL instances
+_timing = threading.local()
+
+
+class StreamingUnsupported(Exception):
+    """Raised when the selected format cannot be streamed into ffmpeg, the temp-file pipeline is used instead."""
+
+
+def _add_timing_hooks(ydl):
+    def progress_hook(progress):
+        if progress.get("status") == "finished":
+            _timing.marks["downloaded"] = time.perf_counter()
+
+    def postprocessor_hook(progress):
+        if progress.get("postprocessor") == "ExtractAudio" and progress.get("status") in ("started", "finished"):
+            _timing.marks[f"transcode_{progress['status']}"] = time.perf_counter()
+
+    ydl.add_progress_hook(progress_hook)
+    ydl.add_postprocessor_hook(postprocessor_hook)
+
+
+def download(ydl_opts, track_info):
+    """
+    Blocking download + FFmpeg postprocessing.
+    Works on the already-extracted info via process_ie_result, so the page, player and formats are not resolved again.
+    Returns the seconds spent downloading and transcoding, {"download": ..., "transcode": ...}.
+    """
+    marks = _timing.marks = {}
+    ydl = get_ydl(ydl_opts, setup=_add_timing_hooks)
+    started = time.perf_counter()
+    ydl.process_ie_result(track_info, download=True)
+    finished = time.perf_counter()
+    transcode_started = marks.get("transcode_started", finished)
+    return {
+        "download": marks.get("downloaded", transcode_started) - started,
+        "transcode": marks.get("transcode_finished", finished) - transcode_started,
+    }
+
+
+def _stream_output(mode, source_codec, metadata):
+    """Returns (container, ffmpeg output args) for streaming a source with `source_codec` in a delivery mode."""
+    if mode == "native":
+        container = "m4a"
+        # Same rule as FFmpegExtractAudio: copy AAC, encode anything else
+        codec_args = ["-c:a", "copy"] if source_codec.startswith("mp4a") else ["-c:a", "aac", "-b:a", "128k"]
+    else:
+        container = "mp3"
+        codec_args = ["-c:a", "libmp3lame", "-b:a", "128k"]
+    tag_args = []
+    for key in ("title", "artist"):
+        if metadata.get(key):
+            tag_args += ["-metadata", f"{key}={metadata[key]}"]
+    return container, ["-vn", *codec_args, *tag_args, "-f", CONTAINER_MUXERS[container]]
+
+
+def _pipe_to_ffmpeg(chunks, ffmpeg_output_args, output_path):
+    """
+    Feeds the byte chunks to ffmpeg over stdin and has it write `output_path`.
+    Returns the number of input bytes. On failure the output file is removed and RuntimeError is raised.
+    """
+    process = subprocess.Popen(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", "pipe:0", *ffmpeg_output_args, output_path],
+        stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    received = 0
+    try:
+        for chunk in chunks:
+            process.stdin.write(chunk)
+            received += len(chunk)
+        process.stdin.close()
+    except BrokenPipeError:
+        pass # ffmpeg exited early, its exit code and stderr tell why
+    except BaseException:
+        process.kill()
+        process.wait()
+        if os.path.exists(output_path): os.remove(output_path)
+        raise
+    stderr = process.stderr.read().decode(errors="replace").strip()
+    if process.wait() != 0:
+        if os.path.exists(output_path): os.remove(output_path)
+        raise RuntimeError(f"ffmpeg failed with exit code {process.returncode}: {stderr}")
+    return received
+
+
+def _run_ffmpeg(args):
+    """Runs ffmpeg with `args`. Returns (exit code, stderr text)."""
+    process = subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", *args], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    return process.returncode, process.stderr.decode(errors="replace").strip()
+
+
+def transcode(source_path, output_path, ffmpeg_output_args):
+    """
+    Blocking re-encode of a cached file into `output_path`, keeping its tags (e.g. a quality variant of a track).
+    Returns the seconds it took. On failure the output file is removed and RuntimeError is raised.
+    """
+    started = time.perf_counter()
+    returncode, stderr = _run_ffmpeg(["-i", source_path, "-vn", "-map_metadata", "0", *ffmpeg_output_args, output_path])
+    if returncode != 0:
+        if os.path.exists(output_path): os.remove(output_path)
+        raise RuntimeError(f"ffmpeg failed with exit code {returncode}: {stderr}")
+    return time.perf_counter() - started
+
+
+def _http_chunks(open_range):
+    """
+    Yields a response body in STREAM_READ_SIZE chunks, requested in STREAM_RANGE_SIZE ranges.
+    `open_range(start, end)` returns a response for that byte range (with .read(), .close(), .status and .headers).
+    A server that ignores the Range header (200 to the first request) is read once, whole. Raises StreamingUnsupported
+    when a later range is not answered with exactly the bytes asked for.
+    """
+    start = 0
+    while True:
+        end = start + STREAM_RANGE_SIZE - 1
+        response = open_range(start, end)
+        total = None
+        if response.status == 206:
+            match = _CONTENT_RANGE_RE.match(response.headers.get("Content-Range") or "")
+            if not match or int(match.group(1)) != start or int(match.group(2)) > end:
+                response.close()
+                raise StreamingUnsupported(f"asked for bytes {start}-{end}, got range '{response.headers.get('Content-Range')}'")
+            total = int(match.group(3)) if match.group(3) != "*" else None
+        elif start > 0:
+            response.close()
+            raise StreamingUnsupported(f"asked for bytes {start}-{end}, got status {response.status}")
+        received = 0
+        try:
+            while True:
+                chunk = response.read(STREAM_READ_SIZE)
+                if not chunk:
+                    break
+                received += len(chunk)
+                yield chunk
+        finally:
+            response.close()
+        start += received
+        if response.status != 206 or received < STREAM_RANGE_SIZE or (total is not None and start >= total):
+            break
+
+
+def stream_download(ydl_opts, track_info, output_base, mode, metadata):
+    """
+    Blocking streaming download: selects the audio format from the already-extracted info and pipes it
+    into ffmpeg, which writes `<output_base>.<container>.part`.
+    Returns that path. Raises StreamingUnsupported for formats that are not a single HTTP(S) stream.
+    """
+    import yt_dlp
+    from yt_dlp.networking import Request
+    from yt_dlp.networking.exceptions import RequestError
+    ydl = get_ydl(ydl_opts)
+    selected = ydl.process_ie_result(track_info, download=False)
+    if selected.get("requested_formats") or selected.get("protocol") not in ("http", "https"):
+        raise StreamingUnsupported(f"protocol {selected.get('protocol')} cannot be streamed")
+    container, ffmpeg_output_args = _stream_output(mode, selected.get("acodec") or "", metadata)
+    output_path = f"{output_base}.{container}.part"
+    headers = selected.get("http_headers") or {}
+
+    def open_range(start, end):
+        # Requests go through the ydl so proxy, cookies and headers apply as for normal downloads
+        return ydl.urlopen(Request(selected["url"], headers={**headers, "Range": f"bytes={start}-{end}"}))
+
+    try:
+        _pipe_to_ffmpeg(_http_chunks(open_range), ffmpeg_output_args, output_path)
+    except RequestError as request_err:
+        # Reported like yt-dlp's own download errors (e.g. "HTTP Error 403: Forbidden")
+        raise yt_dlp.utils.DownloadError(str(request_err)) from None
+    return output_path
@@ -0,0 +1,233 @@
+# egress_pool.py
+import logging
+import random
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+import metrics
+from rate_limiter import get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Shared by search and download
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:125.0) Gecko/20100101 Firefox/125.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:125.0) Gecko/20100101 Firefox/125.0",
+]
+
+# Attempts per request, each through a different egress, when YouTube blocks one
+MAX_EGRESS_ATTEMPTS = 3
+# Seconds an egress is avoided after a 403/429, doubled for every further block in a row
+EGRESS_COOLDOWN = 300
+EGRESS_COOLDOWN_MAX = 3600
+# A video keeps its egress and User-Agent this long: YouTube's stream URLs only work from the IP that extracted them
+STICKY_TTL = 1800
+# Weight of the latest outcome in the health score, and the latency at which the score is halved
+HEALTH_ALPHA = 0.2
+LATENCY_REFERENCE = 5.0
+
+# YouTube's bot check ("Sign in to confirm you're not a bot") is an IP block as well
+_BLOCK_PATTERN = re.compile(r"\b(403|429)\b|Too Many Requests|Forbidden|not a bot", re.IGNORECASE)
+_EGRESS_ERROR_PATTERN = re.compile(r"proxy|Connection refused|Connection reset|Tunnel connection failed", re.IGNORECASE)
+
+EGRESS_REQUESTS = metrics.register(metrics.Counter("bot_egress_requests_total", "Requests per egress and outcome."))
+
+
+def classify_error(error):
+    """
+    Returns "blocked" for 403/429 responses and bot checks, "egress" for proxy/connection failures, None for anything else.
+    negative_cache.classify_failure uses the same test for blocks.
+    """
+    message = str(error)
+    if _BLOCK_PATTERN.search(message):
+        return "blocked"
+    if _EGRESS_ERROR_PATTERN.search(message):
+        return "egress"
+    return None
+
+
+def egress_label(proxy):
+    """Proxy without credentials, for logs and metrics."""
+    if not proxy:
+        return "direct"
+    parts = urlsplit(proxy)
+    return f"{parts.hostname}:{parts.port}" if parts.hostname else "proxy"
+
+
+class Egress:
+    """One way out to YouTube (a proxy, or None for a direct connection) and its recent track record."""
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.health = 1.0
+        self.latency = 0.0  # moving average of successful requests, seconds
+        self.successes = 0
+        self.blocks = 0
+        self.errors = 0
+        self.consecutive_blocks = 0
+        self.blocked_until = 0.0
+
+    def score(self):
+        return max(0.01, self.health / (1.0 + self.latency / LATENCY_REFERENCE))
+
+
+class EgressPool:
+    """
+    Picks proxies and User-Agents for YouTube requests. Egresses are weighted by a health score
+    from their recent successes, blocks and latency, and are avoided for a cooldown after a block.
+    Requests for the same key (a video_id) stick to the same egress until it gets blocked.
+    Thread-safe, search backends report from the search pool threads.
+    """
+
+    def __init__(self, proxies=None, user_agents=None):
+        self._egresses = {proxy: Egress(proxy) for proxy in (proxies or [None])}
+        self.user_agents = list(dict.fromkeys(user_agents or USER_AGENTS))
+        self._sticky = {}  # key -> (proxy, user_agent, expires_at)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._egresses)
+
+    def choose(self, key=None, exclude=()):
+        """
+        Returns (proxy, user_agent) for a request, or None when every egress is in `exclude`.
+        Egresses in cooldown are only used when all others are excluded or cooling down as well.
+        """
+        now = time.monotonic()
+        with self._lock:
+            sticky = self._sticky.get(key) if key is not None else None
+            if sticky and sticky[2] > now and sticky[0] not in exclude and self._egresses[sticky[0]].blocked_until <= now:
+                return sticky[0], sticky[1]
+            candidates = [egress for proxy, egress in self._egresses.items() if proxy not in exclude]
+            if not candidates:
+                return None
+            ready = [egress for egress in candidates if egress.blocked_until <= now]
+            if ready:
+                egress = random.choices(ready, weights=[egress.score() for egress in ready])[0]
+            else:
+                egress = min(candidates, key=lambda egress: egress.blocked_until)
+            user_agent = random.choice(self.user_agents)
+            if key is not None:
+                self._sticky[key] = (egress.proxy, user_agent, now + STICKY_TTL)
+                if len(self._sticky) > 10000:
+                    self._sticky = {k: v for k, v in self._sticky.items() if v[2] > now}
+            return egress.proxy, user_agent
+
+    def report(self, proxy, outcome, latency=None, key=None):
+        """
+        Records the outcome of a request: "ok" (with its latency), "blocked", "egress" (proxy/connection failure)
+        or "error". The egress's rate limit is adjusted as well.
+        """
+        now = time.monotonic()
+        get_rate_limiter().report(egress_label(proxy), outcome)
+        EGRESS_REQUESTS.inc(egress=egress_label(proxy), outcome=outcome)
+        with self._lock:
+            egress = self._egresses.get(proxy)
+            if egress is None:
+                # A pinned proxy outside the pool
+                return
+            if outcome == "ok":
+                egress.successes += 1
+                egress.consecutive_blocks = 0
+                egress.health += HEALTH_ALPHA * (1.0 - egress.health)
+                if latency is not None:
+                    egress.latency = latency if egress.successes == 1 else egress.latency + HEALTH_ALPHA * (latency - egress.latency)
+            elif outcome == "blocked":
+                egress.blocks += 1
+                egress.consecutive_blocks += 1
+                egress.health -= HEALTH_ALPHA * egress.health
+                cooldown = min(EGRESS_COOLDOWN_MAX, EGRESS_COOLDOWN * 2 ** (egress.consecutive_blocks - 1))
+                egress.blocked_until = now + cooldown
+                logger.warning("Egress %s was blocked, cooling down for %ss.", egress_label(proxy), cooldown)
+            else:
+                egress.errors += 1
+                egress.health -= HEALTH_ALPHA * egress.health / 2
+            if outcome != "ok" and key is not None:
+                self._sticky.pop(key, None)
+
+    def stats(self):
+        """Per-egress health, latency, counts and remaining cooldown, keyed by egress_label()."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                egress_label(proxy): {
+                    "score": round(egress.score(), 3),
+                    "health": round(egress.health, 3),
+                    "latency": round(egress.latency, 3),
+                    "successes": egress.successes,
+                    "blocks": egress.blocks,
+                    "errors": egress.errors,
+                    "cooldown": max(0.0, round(egress.blocked_until - now, 1)),
+                }
+                for proxy, egress in self._egresses.items()
+            }
+
+
+def call_with_failover(func, key=None, proxy_config=None, attempts=MAX_EGRESS_ATTEMPTS):
+    """
+    Calls the blocking func(proxy, user_agent) through the pool, paced by the rate limiter of the
+    chosen egress. When it fails with a block or a
+    proxy error, it is retried through another egress, up to `attempts` times; the last error is raised.
+    A given `proxy_config` pins the proxy and bypasses the pool.
+    """
+    pool = get_egress_pool()
+    if proxy_config:
+        get_rate_limiter().acquire_blocking(egress_label(proxy_config))
+        try:
+            result = func(proxy_config, random.choice(pool.user_agents))
+        except Exception as e:
+            pool.report(proxy_config, classify_error(e) or "error")
+            raise
+        pool.report(proxy_config, "ok")
+        return result
+    tried = []
+    last_error = None
+    for _ in range(attempts):
+        choice = pool.choose(key, exclude=tried)
+        if choice is None:
+            break
+        proxy, user_agent = choice
+        get_rate_limiter().acquire_blocking(egress_label(proxy))
+        started = time.monotonic()
+        try:
+            result = func(proxy, user_agent)
+        except Exception as e:
+            outcome = classify_error(e)
+            if outcome is None:
+                raise
+            pool.report(proxy, outcome, key=key)
+            tried.append(proxy)
+            last_error = e
+            logger.info("Request via %s failed (%s), trying another egress.", egress_label(proxy), outcome)
+            continue
+        pool.report(proxy, "ok", time.monotonic() - started, key=key)
+        return result
+    raise last_error
+
+
+_pool = None
+
+
+def init_egress_pool(proxies=None, user_agents=None):
+    """
+    Creates the shared pool. `proxies` is a proxy URL, a list of them, or None for direct connections only;
+    put None in the list to use the direct connection alongside the proxies.
+    """
+    global _pool
+    if isinstance(proxies, str):
+        proxies = [proxies]
+    _pool = EgressPool(proxies, user_agents)
+    logger.info("Egress pool: %s", [egress_label(proxy) for proxy in _pool._egresses])
+    return _pool
+
+
+def get_egress_pool():
+    """Returns the shared pool, creating a direct-only one if init_egress_pool() was not called."""
+    if _pool is None:
+        return init_egress_pool()
+    return _pool
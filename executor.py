@@ -0,0 +1,121 @@
+# executor.py
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# POOL SIZES - network-bound work (search, info extraction) runs in threads,
+# CPU-bound work (download + FFmpeg transcode) runs in separate processes.
+SEARCH_WORKERS = 4
+EXTRACT_WORKERS = 4
+DOWNLOAD_WORKERS = os.cpu_count() or 2
+# Transfers to and from the shared cache storage (see cache_storage.py)
+STORAGE_WORKERS = 4
+# Modules the forkserver imports once, so download processes start as forks with them already loaded
+# ("__main__" keeps every worker from importing the bot script again)
+DOWNLOAD_PRELOAD = ["__main__", "download_worker", "yt_dlp"]
+
+_search_pool = None
+_extract_pool = None
+_download_pool = None
+_storage_pool = None
+
+
+def configure_pools(search_workers=None, extract_workers=None, download_workers=None, storage_workers=None):
+    """
+    Sets the pool sizes. Must be called before the first job is submitted,
+    pools that already exist are not resized.
+    """
+    global SEARCH_WORKERS, EXTRACT_WORKERS, DOWNLOAD_WORKERS, STORAGE_WORKERS
+    if search_workers:
+        SEARCH_WORKERS = search_workers
+    if extract_workers:
+        EXTRACT_WORKERS = extract_workers
+    if download_workers:
+        DOWNLOAD_WORKERS = download_workers
+    if storage_workers:
+        STORAGE_WORKERS = storage_workers
+    logger.info("Executor pools configured: search=%s, extract=%s, download=%s", SEARCH_WORKERS, EXTRACT_WORKERS, DOWNLOAD_WORKERS)
+
+
+def _get_search_pool():
+    global _search_pool
+    if _search_pool is None:
+        _search_pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search")
+    return _search_pool
+
+
+def _get_extract_pool():
+    global _extract_pool
+    if _extract_pool is None:
+        _extract_pool = ThreadPoolExecutor(max_workers=EXTRACT_WORKERS, thread_name_prefix="extract")
+    return _extract_pool
+
+
+def _download_context():
+    """
+    "forkserver" where available: a clean, single-threaded server process imports DOWNLOAD_PRELOAD once and
+    the workers are forked from it. Otherwise "spawn", where every worker starts a fresh interpreter.
+    Both avoid forking a process that already runs the event loop and HTTP client threads.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(DOWNLOAD_PRELOAD)
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def _get_download_pool():
+    global _download_pool
+    if _download_pool is None:
+        _download_pool = ProcessPoolExecutor(max_workers=DOWNLOAD_WORKERS, mp_context=_download_context())
+    return _download_pool
+
+
+def _get_storage_pool():
+    global _storage_pool
+    if _storage_pool is None:
+        _storage_pool = ThreadPoolExecutor(max_workers=STORAGE_WORKERS, thread_name_prefix="storage")
+    return _storage_pool
+
+
+async def _run_in(pool, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, functools.partial(func, *args, **kwargs))
+
+
+async def run_search(func, *args, **kwargs):
+    """Runs a blocking search call in the search thread pool."""
+    return await _run_in(_get_search_pool(), func, *args, **kwargs)
+
+
+async def run_extract(func, *args, **kwargs):
+    """Runs a blocking info extraction call in the extract thread pool."""
+    return await _run_in(_get_extract_pool(), func, *args, **kwargs)
+
+
+async def run_download(func, *args, **kwargs):
+    """
+    Runs a blocking download/transcode call in the download process pool.
+    `func` and its arguments must be picklable (module-level function, plain data).
+    """
+    return await _run_in(_get_download_pool(), func, *args, **kwargs)
+
+
+async def run_storage(func, *args, **kwargs):
+    """Runs a blocking shared cache storage call in the storage thread pool."""
+    return await _run_in(_get_storage_pool(), func, *args, **kwargs)
+
+
+def shutdown_pools(wait=True):
+    """Shuts down all pools that were started."""
+    global _search_pool, _extract_pool, _download_pool, _storage_pool
+    for pool in (_search_pool, _extract_pool, _download_pool, _storage_pool):
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=not wait)
+    _search_pool = _extract_pool = _download_pool = _storage_pool = None
+    logger.info("Executor pools shut down.")
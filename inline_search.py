@@ -0,0 +1,107 @@
+# inline_search.py
+import asyncio
+import logging
+import time
+import metrics
+import result_sets
+import search_cache
+from search_orchestrator import search_tracks
+from prewarmer import downloads_busy
+from title_index import get_title_index
+from yt_downloader import prewarm_track, TrackFetchError
+
+logger = logging.getLogger(__name__)
+
+# Results per inline answer (Telegram allows up to 50)
+INLINE_MAX_RESULTS = 20
+# Matches without a file_id that are fetched and uploaded (to the prewarm chat, see Prewarmer) in the background
+# per query, at once overall, and waiting at most. Further matches are dropped while the backlog is full.
+INLINE_PREFETCH = 3
+INLINE_PREFETCH_CONCURRENCY = 2
+INLINE_PREFETCH_BACKLOG = 20
+# A query the index has nothing for is searched upstream in the background, once the user stopped typing
+# for this many seconds, and only when it is at least this long. Its results are then found through the search cache.
+INLINE_SEARCH_DELAY = 1.0
+INLINE_SEARCH_MIN_LENGTH = 3
+INLINE_SEARCH_RESULTS = 5
+
+_background = set()  # running background tasks, referenced so they are not garbage collected
+_prefetching = set()  # video_ids being fetched in the background
+_prefetch_slots = asyncio.Semaphore(INLINE_PREFETCH_CONCURRENCY)
+_latest_queries = {}  # user id -> (normalized query, monotonic time) of the user's last inline query
+
+
+def _spawn(coro):
+    task = asyncio.ensure_future(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def _prefetch(video_id, context, upload_chat_id):
+    try:
+        async with _prefetch_slots:
+            # Users' downloads may have started while this one waited for a slot
+            if downloads_busy():
+                logger.info("[%s] Inline prefetch dropped: downloads are busy.", video_id)
+                return
+            result = await prewarm_track(video_id, context, upload_chat_id=upload_chat_id)
+        logger.info("[%s] Inline prefetch: %s.", video_id, result)
+    except TrackFetchError as fetch_error:
+        logger.info("[%s] Inline prefetch skipped: %s", video_id, fetch_error)
+    except Exception as e:
+        logger.error("[%s] Inline prefetch failed: %s", video_id, e, exc_info=True)
+    finally:
+        _prefetching.discard(video_id)
+
+
+async def _search_when_idle(user_id, query):
+    """Searches upstream for `query` unless the user typed something else within INLINE_SEARCH_DELAY."""
+    await asyncio.sleep(INLINE_SEARCH_DELAY)
+    if _latest_queries.get(user_id, (None,))[0] != query:
+        return
+    try:
+        # The results land in the title index through the track info cache
+        await search_tracks(query, max_results=INLINE_SEARCH_RESULTS)
+    except Exception as e:
+        logger.warning("Background search for inline query '%s' failed: %s", query, e)
+
+
+def lookup(query, user_id, context=None, upload_chat_id=None):
+    """
+    Answers an inline query from the search cache (the results of an earlier search for the same query)
+    and the title index, without any upstream request. Returns the matching tracks that have a Telegram file_id.
+    In the background, matches without a file_id are fetched and uploaded to `upload_chat_id` (which is
+    needed to get their file_id, so without one nothing is fetched), and a query nothing is known for is
+    searched upstream, so the same query finds its tracks a moment later. Prefetches are skipped while users'
+    downloads are busy (see prewarmer.downloads_busy) and once INLINE_PREFETCH_BACKLOG of them are waiting.
+    """
+    normalized = search_cache.normalize_query(query)
+    _latest_queries[user_id] = (normalized, time.monotonic())
+    # Forget users that stopped typing a while ago
+    if len(_latest_queries) > 10000:
+        cutoff = time.monotonic() - 60
+        for stale_user in [user for user, (_, at) in _latest_queries.items() if at < cutoff]:
+            del _latest_queries[stale_user]
+    index = get_title_index()
+    with metrics.span("inline_lookup"):
+        # Results of an inline search of this query, or of the same query searched in a chat
+        searched_results = search_cache.peek(normalized, INLINE_SEARCH_RESULTS) or search_cache.peek(normalized, result_sets.RESULT_SET_SIZE) or []
+        searched = [index.get(track["id"]) for track in searched_results]
+        matches = list({track["video_id"]: track for track in searched + index.search(normalized, limit=INLINE_MAX_RESULTS) if track}.values())
+        matches = matches[:INLINE_MAX_RESULTS]
+    sendable = [track for track in matches if track["file_id"]]
+    metrics.CACHE_REQUESTS.inc(cache="inline", result="hit" if sendable else "miss")
+
+    if not matches and len(normalized) >= INLINE_SEARCH_MIN_LENGTH:
+        _spawn(_search_when_idle(user_id, normalized))
+    started = 0
+    prefetch = upload_chat_id is not None and not downloads_busy()
+    for track in matches if prefetch else ():
+        if started >= INLINE_PREFETCH or len(_prefetching) >= INLINE_PREFETCH_BACKLOG:
+            break
+        if track["file_id"] or track["video_id"] in _prefetching:
+            continue
+        _prefetching.add(track["video_id"])
+        _spawn(_prefetch(track["video_id"], context, upload_chat_id))
+        started += 1
+    return sendable
@@ -0,0 +1,314 @@
+# job_scheduler.py
+import asyncio
+import contextlib
+import logging
+import sqlite3
+import time
+from collections import deque
+from telegram.error import BadRequest, RetryAfter
+import metrics
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB_FILE = "./jobs.sqlite3"
+
+# Downloads running at once over all chats, and per chat
+MAX_CONCURRENT_JOBS = 4
+MAX_JOBS_PER_CHAT = 1
+# Backpressure: further requests from a chat are refused while it has this many jobs waiting
+MAX_PENDING_PER_CHAT = 10
+# Queue positions shown to waiting users are edited at most once per this many seconds,
+# and at most this many messages per round, the front of the queue first
+POSITION_UPDATE_INTERVAL = 2.0
+POSITION_UPDATES_PER_ROUND = 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    video_id TEXT NOT NULL,
+    kind TEXT NOT NULL DEFAULT 'track',
+    quality TEXT,
+    message_id INTEGER,
+    status TEXT NOT NULL DEFAULT 'pending',
+    created_at REAL NOT NULL
+)
+"""
+
+# Columns added after the first version of the schema, added to older job files on open
+_ADDED_COLUMNS = {"kind": "TEXT NOT NULL DEFAULT 'track'", "quality": "TEXT"}
+
+
+class QueueFullError(Exception):
+    """Raised by submit() when a chat already has MAX_PENDING_PER_CHAT jobs waiting."""
+
+
+class JobScheduler:
+    """
+    Download queue with a global and a per-chat concurrency cap. Chats are served round-robin,
+    so one chat queuing many tracks cannot hold up the others. Jobs are stored in SQLite and
+    the ones still pending or running when the bot stopped are resumed by resume().
+
+    `job_runner` is the coroutine function that performs a job:
+    job_runner(video_id, chat_id, context, message_to_edit, kind, quality).
+    `kind` is "track", or "album"/"playlist" for a batch, whose `video_id` is then the album or playlist id.
+    `quality` is the requested variant of a track (see yt_downloader.AUDIO_VARIANTS), None for the cached original.
+    A batch takes one job slot however many tracks it has. Its tracks are fetched with download permits
+    (see download_permit) that track jobs hold as well, so batches stay within the same global and per-chat limits.
+    """
+
+    def __init__(self, job_runner, db_path=JOBS_DB_FILE, max_concurrent=MAX_CONCURRENT_JOBS,
+                 max_per_chat=MAX_JOBS_PER_CHAT, max_pending_per_chat=MAX_PENDING_PER_CHAT):
+        self.job_runner = job_runner
+        self.max_concurrent = max_concurrent
+        self.max_per_chat = max_per_chat
+        self.max_pending_per_chat = max_pending_per_chat
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.execute(_SCHEMA)
+            existing = {row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in _ADDED_COLUMNS.items():
+                if column not in existing:
+                    self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        self._context = None
+        self._messages = {}  # job id -> Message to edit with progress
+        self._traces = {}  # job id -> trace id of the request that queued it
+        self._shown_positions = {}  # job id -> queue position last shown to the user
+        self._positions_changed = False  # positions may differ from the shown ones since the last round of edits
+        self._position_task = None  # background task editing the queue positions, see _schedule_position_update
+        self._running = {}  # job id -> asyncio.Task
+        self._permits = asyncio.Semaphore(max_concurrent)  # downloads running at once, tracks of batches included
+        self._chat_permits = {}  # chat_id -> [asyncio.Semaphore of max_per_chat, number of holders and waiters]
+        self._chat_order = deque()  # round-robin order of chats with jobs
+        self._draining = False
+
+    def attach(self, context):
+        """Sets the object passed to job_runner as `context` (anything with a .bot, e.g. the Application)."""
+        self._context = context
+
+    def _pending_jobs(self):
+        return [dict(row) for row in self._db.execute("SELECT * FROM jobs WHERE status = 'pending' ORDER BY id")]
+
+    def _running_per_chat(self):
+        counts = {}
+        for row in self._db.execute("SELECT chat_id, COUNT(*) AS n FROM jobs WHERE status = 'running' GROUP BY chat_id"):
+            counts[row["chat_id"]] = row["n"]
+        return counts
+
+    async def submit(self, chat_id, video_id, message_to_edit=None, kind="track", quality=None):
+        """
+        Queues a download (a track, or an album/playlist with `kind`) for a chat and dispatches it if there is capacity.
+        `quality` selects a quality variant of a track.
+        Raises QueueFullError when the chat has too many jobs waiting.
+        """
+        pending_in_chat = self._db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE chat_id = ? AND status = 'pending'", (chat_id,)
+        ).fetchone()[0]
+        if pending_in_chat >= self.max_pending_per_chat:
+            raise QueueFullError(f"You already have {pending_in_chat} tracks waiting. Please wait for them to finish.")
+        with self._db:
+            job_id = self._db.execute(
+                "INSERT INTO jobs (chat_id, video_id, kind, quality, message_id, status, created_at) VALUES (?, ?, ?, ?, ?, 'pending', ?)",
+                (chat_id, video_id, kind, quality, message_to_edit.message_id if message_to_edit else None, time.time()),
+            ).lastrowid
+        if message_to_edit:
+            self._messages[job_id] = message_to_edit
+        self._traces[job_id] = metrics.current_trace()
+        if chat_id not in self._chat_order:
+            # A chat that had nothing queued goes first, the others have been served more recently
+            self._chat_order.appendleft(chat_id)
+        logger.info("[%s] Queued job %s for chat %s", video_id, job_id, chat_id)
+        await self._dispatch()
+        return job_id
+
+    def _next_job(self, pending, running_per_chat):
+        """Picks the next pending job round-robin over the chats that are below their limit."""
+        oldest_by_chat = {}
+        for job in pending:
+            oldest_by_chat.setdefault(job["chat_id"], job)
+        for _ in range(len(self._chat_order)):
+            chat_id = self._chat_order[0]
+            self._chat_order.rotate(-1)
+            if chat_id in oldest_by_chat and running_per_chat.get(chat_id, 0) < self.max_per_chat:
+                return oldest_by_chat[chat_id]
+        return None
+
+    async def _dispatch(self):
+        """Starts pending jobs while there is capacity, then schedules a refresh of the queue positions shown to users."""
+        while len(self._running) < self.max_concurrent and self._context is not None and not self._draining:
+            job = self._next_job(self._pending_jobs(), self._running_per_chat())
+            if job is None:
+                break
+            with self._db:
+                self._db.execute("UPDATE jobs SET status = 'running' WHERE id = ?", (job["id"],))
+            self._shown_positions.pop(job["id"], None)
+            self._running[job["id"]] = asyncio.ensure_future(self._run(job))
+        self._schedule_position_update()
+
+    def _queue_order(self):
+        """Pending jobs in the order the round-robin dispatch would start them."""
+        per_chat = {}
+        for job in self._pending_jobs():
+            per_chat.setdefault(job["chat_id"], deque()).append(job)
+        order = []
+        chats = [chat_id for chat_id in self._chat_order if chat_id in per_chat]
+        while chats:
+            for chat_id in list(chats):
+                order.append(per_chat[chat_id].popleft())
+                if not per_chat[chat_id]:
+                    chats.remove(chat_id)
+        return order
+
+    def _schedule_position_update(self):
+        """Refreshes the queue positions shown to users in the background, one round per POSITION_UPDATE_INTERVAL at most."""
+        self._positions_changed = True
+        if self._position_task is None or self._position_task.done():
+            self._position_task = asyncio.ensure_future(self._position_updates())
+
+    async def _position_updates(self):
+        # Changes that arrive during a round or the pause after it are picked up by the next round
+        while self._positions_changed and not self._draining:
+            self._positions_changed = False
+            await asyncio.sleep(await self._update_positions())
+
+    async def _update_positions(self):
+        """
+        Edits the messages of waiting jobs whose position changed, up to POSITION_UPDATES_PER_ROUND of them.
+        A position only counts as shown once its edit went through, so failed edits are retried in a later round.
+        Returns the seconds to wait before the next round.
+        """
+        edits = 0
+        for position, job in enumerate(self._queue_order(), start=1):
+            message = self._messages.get(job["id"])
+            if not message or job["id"] in self._running or self._shown_positions.get(job["id"]) == position:
+                continue
+            if edits >= POSITION_UPDATES_PER_ROUND:
+                self._positions_changed = True
+                break
+            edits += 1
+            try:
+                await message.edit_text(f"Queued for download: position {position} in line...")
+            except RetryAfter as flood_error:
+                # Flood control: the remaining edits wait for the next round after the given pause
+                self._positions_changed = True
+                retry_after = flood_error.retry_after  # seconds, or a timedelta in newer python-telegram-bot versions
+                if hasattr(retry_after, "total_seconds"):
+                    retry_after = retry_after.total_seconds()
+                return max(POSITION_UPDATE_INTERVAL, retry_after)
+            except BadRequest as e:
+                # Deleted or unchanged messages: retrying would fail the same way
+                logger.warning("Could not update queue position for job %s: %s", job['id'], e)
+            except Exception as e:
+                logger.warning("Could not update queue position for job %s: %s", job['id'], e)
+                self._positions_changed = True
+                continue
+            self._shown_positions[job["id"]] = position
+        return POSITION_UPDATE_INTERVAL
+
+    async def _run(self, job):
+        message = self._messages.get(job["id"])
+        # The task may have been started by another chat's job finishing, so carry over the submitter's trace
+        metrics.set_trace(self._traces.pop(job["id"], None) or metrics.new_trace())
+        metrics.observe_stage("queue_wait", max(0.0, time.time() - job["created_at"]))
+        try:
+            # A batch takes a download permit per track it fetches, see download_permit
+            async with self.download_permit(job["chat_id"]) if job["kind"] == "track" else contextlib.nullcontext():
+                await self.job_runner(job["video_id"], job["chat_id"], self._context, message, job["kind"], job["quality"])
+        except asyncio.CancelledError:
+            # Shutting down: leave the row in place so the job is resumed on the next start
+            raise
+        except Exception as e:
+            logger.error("[%s] Job %s failed: %s", job['video_id'], job['id'], e, exc_info=True)
+        with self._db:
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job["id"],))
+        self._running.pop(job["id"], None)
+        self._messages.pop(job["id"], None)
+        if not self._db.execute("SELECT 1 FROM jobs WHERE chat_id = ? LIMIT 1", (job["chat_id"],)).fetchone():
+            if job["chat_id"] in self._chat_order:
+                self._chat_order.remove(job["chat_id"])
+        await self._dispatch()
+
+    async def resume(self):
+        """
+        Requeues the jobs left over from the previous run. Each affected chat gets a new
+        progress message, since the old ones cannot be recovered from the database.
+        """
+        with self._db:
+            self._db.execute("UPDATE jobs SET status = 'pending' WHERE status = 'running'")
+        jobs = self._pending_jobs()
+        for job in jobs:
+            if job["chat_id"] not in self._chat_order:
+                self._chat_order.append(job["chat_id"])
+            try:
+                message = await self._context.bot.send_message(
+                    chat_id=job["chat_id"], text="The bot restarted. Your download has been queued again..."
+                )
+                self._messages[job["id"]] = message
+                with self._db:
+                    self._db.execute("UPDATE jobs SET message_id = ? WHERE id = ?", (message.message_id, job["id"]))
+            except Exception as e:
+                logger.warning("Could not notify chat %s about resumed job %s: %s", job['chat_id'], job['id'], e)
+        if jobs:
+            logger.info("Resumed %s queued jobs from the previous run.", len(jobs))
+        await self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def download_permit(self, chat_id):
+        """
+        Waits for one of the max_concurrent download permits, and one of the chat's max_per_chat, and holds them
+        for the enclosed block. Track jobs run under one, and batches take one for each track they fetch.
+        """
+        chat_permits = self._chat_permits.setdefault(chat_id, [asyncio.Semaphore(self.max_per_chat), 0])
+        chat_permits[1] += 1
+        try:
+            async with chat_permits[0], self._permits:
+                yield
+        finally:
+            chat_permits[1] -= 1
+            if not chat_permits[1]:
+                del self._chat_permits[chat_id]
+
+    def in_flight(self):
+        """Number of jobs currently running."""
+        return len(self._running)
+
+    def idle(self):
+        """True when no job is running or waiting."""
+        return not self._running and not self._db.execute("SELECT 1 FROM jobs WHERE status = 'pending' LIMIT 1").fetchone()
+
+    async def drain(self, timeout=None):
+        """
+        Stops starting new jobs and waits up to `timeout` seconds for the running ones to finish.
+        Pending jobs, and running jobs that did not finish in time, stay in the database and are resumed on the next start.
+        """
+        self._draining = True
+        if self._position_task is not None:
+            self._position_task.cancel()
+        if self._running:
+            logger.info("Waiting for %s running downloads to finish...", len(self._running))
+            done, still_running = await asyncio.wait(list(self._running.values()), timeout=timeout)
+            if still_running:
+                logger.warning("%s downloads did not finish in time, they will be resumed on the next start.", len(still_running))
+
+    def close(self):
+        self._db.close()
+
+
+_scheduler = None
+
+
+def init_scheduler(job_runner, db_path=JOBS_DB_FILE, max_concurrent=None, max_per_chat=None, max_pending_per_chat=None):
+    """Creates the shared scheduler. Call once at startup, then attach() and resume() once the bot is running."""
+    global _scheduler
+    _scheduler = JobScheduler(
+        job_runner, db_path,
+        max_concurrent=max_concurrent or MAX_CONCURRENT_JOBS,
+        max_per_chat=max_per_chat or MAX_JOBS_PER_CHAT,
+        max_pending_per_chat=max_pending_per_chat or MAX_PENDING_PER_CHAT,
+    )
+    return _scheduler
+
+
+def get_scheduler():
+    return _scheduler
@@ -0,0 +1,205 @@
+# metrics.py
+import contextvars
+import http.server
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets in seconds, covering Telegram file_id sends (ms) up to slow downloads (minutes)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+
+
+def new_trace():
+    """Starts a new trace for the current task (e.g. one incoming update) and returns its id."""
+    trace_id = uuid.uuid4().hex[:16]
+    _trace_id.set(trace_id)
+    return trace_id
+
+
+def set_trace(trace_id):
+    """Continues an existing trace in the current task, e.g. a queued job started from another task."""
+    _trace_id.set(trace_id)
+
+
+def current_trace():
+    return _trace_id.get()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for name, value in items)
+    return "{" + ",".join(escaped) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}  # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, {'le': bound})} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+STAGE_DURATION = Histogram("bot_stage_duration_seconds", "Time spent per request stage.")
+STAGE_ERRORS = Counter("bot_stage_errors_total", "Stages that ended with an exception.")
+CACHE_REQUESTS = Counter("bot_cache_requests_total", "Audio and search cache lookups by cache and result.")
+UPSTREAM_BLOCKS = Counter("bot_upstream_403_total", "HTTP 403 responses from YouTube by stage.")
+BACKEND_ERRORS = Counter("bot_search_backend_errors_total", "Failed or timed out search backend calls.")
+
+_METRICS = [STAGE_DURATION, STAGE_ERRORS, CACHE_REQUESTS, UPSTREAM_BLOCKS, BACKEND_ERRORS]
+
+
+def register(metric):
+    """Adds a metric defined in another module to the /metrics output."""
+    _METRICS.append(metric)
+    return metric
+
+
+def observe_stage(stage, seconds, **labels):
+    """Records a stage duration measured elsewhere (e.g. inside a worker process) and logs it."""
+    STAGE_DURATION.observe(seconds, stage=stage, **labels)
+    logger.info(
+        "stage %s took %.1f ms", stage, seconds * 1000,
+        extra={"event": "span", "stage": stage, "duration_ms": round(seconds * 1000, 3), **labels},
+    )
+
+
+@contextmanager
+def span(stage, **labels):
+    """Times the enclosed block as `stage`, recording the duration histogram and a span log record."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage, **labels)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - started, **labels)
+
+
+def render():
+    """Returns all metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class TraceIdFilter(logging.Filter):
+    """Adds the current trace id to every log record as `trace_id`."""
+
+    def filter(self, record):
+        record.trace_id = _trace_id.get()
+        return True
+
+
+# LogRecord attributes that are not extra fields
+_STANDARD_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "trace_id"}
+
+
+class JsonLogFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, including the trace id and any `extra` fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "trace_id": getattr(record, "trace_id", None),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(json_logs=False):
+    """Attaches the trace id filter to the root handlers and optionally switches them to JSON lines."""
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(TraceIdFilter())
+        if json_logs:
+            handler.setFormatter(JsonLogFormatter())
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Serves the metrics on http://host:port/metrics from a background thread. Returns the server."""
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Metrics endpoint listening on http://%s:%s/metrics", *server.server_address[:2])
+    return server
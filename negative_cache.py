@@ -0,0 +1,93 @@
+# negative_cache.py
+import logging
+import re
+from egress_pool import classify_error
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Seconds a failed video_id is answered from the cache, per failure class
+NEGATIVE_TTLS = {
+    "unavailable": 24 * 3600,   # removed, private, terminated account
+    "region_locked": 6 * 3600,  # may work again through another egress or after a proxy change
+    "auth": 3600,               # age or login restricted, until the cookies are updated
+    "blocked": 600,             # every egress got a 403/429, transient
+    "failing": 900,             # unclassified errors, after FAILURES_BEFORE_NEGATIVE in a row
+}
+# Failure classes that lie with the video itself. Search results of such tracks are marked and get no download button.
+# "blocked" and "failing" are more likely our egress or a passing problem, they only answer download requests early.
+VIDEO_FAILURE_CLASSES = ("unavailable", "region_locked", "auth")
+# Unclassified failures of a video_id before it is cached as "failing"
+FAILURES_BEFORE_NEGATIVE = 3
+
+# Checked in order after blocks (see egress_pool.classify_error), the first match decides the class
+_FAILURE_PATTERNS = [
+    ("region_locked", re.compile(r"in your country|geo.?restrict|not available in your (country|region)", re.IGNORECASE)),
+    ("auth", re.compile(r"confirm your age|age.restricted|members.only|login required|sign in|authenticat", re.IGNORECASE)),
+    ("unavailable", re.compile(r"video unavailable|is unavailable|private video|video is private|has been removed|"
+                               r"account .* terminated|no longer available|does not exist", re.IGNORECASE)),
+]
+
+_failures = TTLCache(max_entries=10000, ttl=NEGATIVE_TTLS["failing"])
+_unclassified_counts = TTLCache(max_entries=10000, ttl=NEGATIVE_TTLS["failing"])
+
+
+def classify_failure(error):
+    """Returns the failure class of an extraction/download error ("unavailable", "region_locked", "auth", "blocked") or None."""
+    message = str(error)
+    # The same test the egress pool fails over on, so a block cools down the egress before it is cached here
+    if classify_error(message) == "blocked":
+        return "blocked"
+    for failure_class, pattern in _FAILURE_PATTERNS:
+        if pattern.search(message):
+            return failure_class
+    return None
+
+
+def record_failure(video_id, failure_class, message):
+    """
+    Remembers that fetching `video_id` failed with the user-facing `message`. Classified failures are
+    cached right away, unclassified ones (None) once they happened FAILURES_BEFORE_NEGATIVE times in a row.
+    """
+    if failure_class is None:
+        count = _unclassified_counts.get(video_id, 0) + 1
+        _unclassified_counts.set(video_id, count)
+        if count < FAILURES_BEFORE_NEGATIVE:
+            return
+        failure_class = "failing"
+    _failures.set(video_id, {"class": failure_class, "message": message}, ttl=NEGATIVE_TTLS[failure_class])
+    logger.info("[%s] Cached as %s for %ss.", video_id, failure_class, NEGATIVE_TTLS[failure_class])
+
+
+def get_failure(video_id):
+    """Returns {"class", "message"} for a video_id known to fail, or None."""
+    return _failures.get(video_id)
+
+
+def clear_failure(video_id):
+    """Forgets failures of a video_id, e.g. after it was fetched successfully."""
+    _failures.invalidate(video_id)
+    _unclassified_counts.invalidate(video_id)
+
+
+def known_video_failure(video_id):
+    """Returns the failure class of a video_id known to fail for one of VIDEO_FAILURE_CLASSES, or None."""
+    failure = _failures.get(video_id)
+    return failure["class"] if failure and failure["class"] in VIDEO_FAILURE_CLASSES else None
+
+
+def mark_results(results):
+    """
+    Returns the search results with "known_failure" set to the failure class on tracks known to fail
+    for a reason of the video itself (see VIDEO_FAILURE_CLASSES).
+    Works on copies, so results stored in the search cache are not changed.
+    """
+    marked = []
+    for track in results:
+        failure_class = known_video_failure(track.get("id"))
+        marked.append({**track, "known_failure": failure_class} if failure_class else track)
+    return marked
+
+
+def stats():
+    return _failures.stats()
@@ -0,0 +1,146 @@
+# prewarmer.py
+import asyncio
+import logging
+import time
+import metrics
+import result_sets
+from access_log import get_access_log
+from job_scheduler import get_scheduler
+from rate_limiter import get_rate_limiter
+from search_orchestrator import search_tracks
+from yt_downloader import prewarm_track, TrackFetchError
+
+logger = logging.getLogger(__name__)
+
+# Seconds between prewarm passes, and before the first one after startup
+PREWARM_INTERVAL = 600
+PREWARM_STARTUP_DELAY = 60
+# Most requested tracks to keep warm, and most frequent search queries whose top results are kept warm
+PREWARM_TOP_TRACKS = 50
+PREWARM_TOP_QUERIES = 10
+PREWARM_RESULTS_PER_QUERY = 2
+# Only tracks and queries requested at least this often within PREWARM_WINDOW seconds count as popular
+PREWARM_MIN_REQUESTS = 2
+PREWARM_WINDOW = 7 * 24 * 3600
+# Seconds to wait between two fetched tracks, and between checks while users' downloads are running
+PREWARM_PAUSE = 5.0
+
+PREWARMED = metrics.register(metrics.Counter("bot_prewarm_tracks_total", "Tracks handled by the prewarmer by result."))
+
+
+def downloads_busy():
+    """
+    True while users' downloads need the upstream capacity: a download job is queued or running, or an egress
+    is rate-limited after a block. Background fetches wait or skip then. Fetches in flight are not counted,
+    they include the background fetches themselves.
+    """
+    scheduler = get_scheduler()
+    return (scheduler is not None and not scheduler.idle()) or get_rate_limiter().backed_off()
+
+
+class Prewarmer:
+    """
+    Background task that keeps the popular tracks in the cache, ranked by the access log: the most
+    requested tracks, then the top search results of the most frequent queries. It only fetches while
+    no download job is queued or running and no egress is rate-limited after a block, one track at a time,
+    so users' requests always go first. With `upload_chat_id` it also uploads each track once to get its file_id.
+    """
+
+    def __init__(self, upload_chat_id=None, interval=PREWARM_INTERVAL, top_tracks=PREWARM_TOP_TRACKS,
+                 top_queries=PREWARM_TOP_QUERIES, results_per_query=PREWARM_RESULTS_PER_QUERY):
+        self.upload_chat_id = upload_chat_id
+        self.interval = interval
+        self.top_tracks = top_tracks
+        self.top_queries = top_queries
+        self.results_per_query = results_per_query
+        self.last_report = None
+        self._context = None
+        self._task = None
+
+    async def candidates(self):
+        """The video_ids to keep warm, most popular first."""
+        access_log = get_access_log()
+        since = time.time() - PREWARM_WINDOW
+        video_ids = [key for key, _ in access_log.top("download", self.top_tracks, since, PREWARM_MIN_REQUESTS)]
+        for query, _ in access_log.top("search", self.top_queries, since, PREWARM_MIN_REQUESTS):
+            try:
+                # The size chat searches use, so a query searched recently is answered by the search cache
+                results = await search_tracks(query, max_results=result_sets.RESULT_SET_SIZE)
+            except Exception as search_error:
+                logger.warning("Prewarm search for '%s' failed: %s", query, search_error)
+                continue
+            video_ids += [track["id"] for track in results if track.get("id") and not track.get("known_failure")][:self.results_per_query]
+        return list(dict.fromkeys(video_ids))
+
+    async def run_once(self):
+        """One prewarm pass over the candidates. Returns the counts per result and the hit ratio of the window."""
+        counts = {"warm": 0, "fetched": 0, "uploaded": 0, "failed": 0}
+        for video_id in await self.candidates():
+            while downloads_busy():
+                await asyncio.sleep(PREWARM_PAUSE)
+            try:
+                result = await prewarm_track(video_id, self._context, upload_chat_id=self.upload_chat_id)
+            except TrackFetchError as fetch_error:
+                logger.info("[%s] Prewarm skipped: %s", video_id, fetch_error)
+                result = "failed"
+            except Exception as prewarm_error:
+                logger.error("[%s] Prewarm failed: %s", video_id, prewarm_error, exc_info=True)
+                result = "failed"
+            counts[result] += 1
+            PREWARMED.inc(result=result)
+            if result != "warm":
+                await asyncio.sleep(PREWARM_PAUSE)
+        self.last_report = {**counts, **get_access_log().hit_ratio(since=time.time() - PREWARM_WINDOW)}
+        logger.info(
+            "Prewarm pass done: %s already warm, %s fetched, %s uploaded, %s failed. Downloads in the last %s days: %s,"
+            " %.1f%% served from cache, %.1f%% by file_id.",
+            counts["warm"], counts["fetched"], counts["uploaded"], counts["failed"], PREWARM_WINDOW // 86400,
+            self.last_report["requests"], self.last_report["hit_ratio"] * 100, self.last_report["file_id_ratio"] * 100,
+        )
+        return self.last_report
+
+    async def _run(self):
+        await asyncio.sleep(PREWARM_STARTUP_DELAY)
+        while True:
+            try:
+                get_access_log().prune()
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Prewarm pass failed: %s", e, exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    def start(self, context):
+        """Starts the background task. `context` is anything with a .bot (e.g. the Application), used for uploads."""
+        self._context = context
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Cancels the background task. A track being fetched finishes in the background for its single-flight waiters."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+_prewarmer = None
+
+
+def init_prewarmer(upload_chat_id=None, interval=None, top_tracks=None, top_queries=None):
+    """Creates the shared prewarmer. Call once at startup, then start() it once the bot is running."""
+    global _prewarmer
+    _prewarmer = Prewarmer(
+        upload_chat_id, interval=interval or PREWARM_INTERVAL,
+        top_tracks=top_tracks or PREWARM_TOP_TRACKS, top_queries=top_queries or PREWARM_TOP_QUERIES,
+    )
+    return _prewarmer
+
+
+def get_prewarmer():
+    """Returns the shared prewarmer, or None when prewarming is disabled."""
+    return _prewarmer
@@ -0,0 +1,118 @@
+# rate_limiter.py
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Sustained requests per second to YouTube per egress, and how many may go out at once after a quiet period
+RATE_LIMIT_PER_SECOND = 2.0
+RATE_LIMIT_BURST = 10
+# On a 403/429 the rate is multiplied by RATE_BACKOFF_FACTOR (not below RATE_LIMIT_MIN),
+# every successful request adds RATE_RECOVERY_STEP * RATE_LIMIT_PER_SECOND back
+RATE_BACKOFF_FACTOR = 0.5
+RATE_RECOVERY_STEP = 0.1
+RATE_LIMIT_MIN = 0.05
+
+
+class TokenBucket:
+    """Token bucket whose refill rate is lowered on blocks and raised again on successes (AIMD)."""
+
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        """Takes a token and returns the seconds to wait before using it, 0 when one was available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        # Tokens below zero are reservations of earlier callers that are still waiting
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def blocked(self):
+        self.rate = max(RATE_LIMIT_MIN, self.rate * RATE_BACKOFF_FACTOR)
+        # No more bursts until the rate has recovered
+        self.tokens = min(self.tokens, 0.0)
+
+    def succeeded(self):
+        self.rate = min(self.max_rate, self.rate + RATE_RECOVERY_STEP * self.max_rate)
+
+
+class RateLimiter:
+    """
+    One token bucket per upstream key (an egress, see egress_pool.egress_label).
+    Requests only wait when the recent rate exceeds the bucket, so an idle bot does not wait at all.
+    Thread-safe: search backends wait in the search pool threads, downloads wait on the event loop.
+    """
+
+    def __init__(self, rate=RATE_LIMIT_PER_SECOND, burst=RATE_LIMIT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _reserve(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            return bucket.reserve()
+
+    async def acquire(self, key):
+        """Waits on the event loop until a request to `key` may go out. Returns the seconds waited."""
+        delay = self._reserve(key)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def acquire_blocking(self, key):
+        """Like acquire(), for code running in a worker thread."""
+        delay = self._reserve(key)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def report(self, key, outcome):
+        """Adjusts the rate of `key` to a request's outcome: "blocked" halves it, "ok" raises it back step by step."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return
+            if outcome == "blocked":
+                bucket.blocked()
+                logger.warning("Rate limit for %s lowered to %.2f requests/s.", key, bucket.rate)
+            elif outcome == "ok":
+                bucket.succeeded()
+
+    def backed_off(self):
+        """True while any key runs below the configured rate because of recent 403/429 responses."""
+        with self._lock:
+            return any(bucket.rate < bucket.max_rate for bucket in self._buckets.values())
+
+    def stats(self):
+        """Current rate (requests/s) and available tokens per key."""
+        with self._lock:
+            return {key: {"rate": round(bucket.rate, 3), "tokens": round(bucket.tokens, 2)} for key, bucket in self._buckets.items()}
+
+
+_limiter = None
+
+
+def configure_rate_limiter(rate=None, burst=None):
+    """Creates the shared limiter. None keeps the module defaults."""
+    global _limiter
+    _limiter = RateLimiter(rate or RATE_LIMIT_PER_SECOND, burst or RATE_LIMIT_BURST)
+    return _limiter
+
+
+def get_rate_limiter():
+    """Returns the shared limiter, creating it with the defaults if configure_rate_limiter() was not called."""
+    if _limiter is None:
+        return configure_rate_limiter()
+    return _limiter
@@ -0,0 +1,62 @@
+# result_sets.py
+import logging
+import secrets
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Results fetched per search (one upstream search) and shown per page of the results keyboard
+RESULT_SET_SIZE = 30
+RESULTS_PER_PAGE = 5
+# Seconds the buttons of a search keep working, and how many searches are kept
+RESULT_SET_TTL = 6 * 3600
+RESULT_SET_MAX_ENTRIES = 4096
+# Fields kept of each search result, enough to label its button and to skip looking the track up again
+TRACK_FIELDS = ("id", "title", "artist", "duration")
+
+_sets = TTLCache(max_entries=RESULT_SET_MAX_ENTRIES, ttl=RESULT_SET_TTL)
+
+
+def configure_result_sets(size=None, per_page=None, ttl=None):
+    """Sets RESULT_SET_SIZE, RESULTS_PER_PAGE and RESULT_SET_TTL. None keeps the defaults. Drops the stored sets."""
+    global _sets, RESULT_SET_SIZE, RESULTS_PER_PAGE, RESULT_SET_TTL
+    RESULT_SET_SIZE = size or RESULT_SET_SIZE
+    RESULTS_PER_PAGE = per_page or RESULTS_PER_PAGE
+    RESULT_SET_TTL = ttl or RESULT_SET_TTL
+    _sets = TTLCache(max_entries=RESULT_SET_MAX_ENTRIES, ttl=RESULT_SET_TTL)
+
+
+def create(query, tracks):
+    """
+    Stores the results of a search and returns the short id its buttons refer to (8 URL-safe characters),
+    so a button's callback data only needs the id and a position instead of the whole track.
+    """
+    set_id = secrets.token_urlsafe(6)
+    _sets.set(set_id, {
+        "id": set_id, "query": query,
+        "tracks": [{field: track.get(field) for field in TRACK_FIELDS} for track in tracks if track.get("id")],
+    })
+    return set_id
+
+
+def get(set_id):
+    """Returns the stored result set ({"id", "query", "tracks"}), or None once it expired."""
+    return _sets.get(set_id)
+
+
+def track(set_id, index):
+    """Returns the track at `index` of a result set, or None when the set expired or has no such track."""
+    result_set = get(set_id)
+    if result_set is None or not 0 <= index < len(result_set["tracks"]):
+        return None
+    return result_set["tracks"][index]
+
+
+def page_count(result_set):
+    return max(1, -(-len(result_set["tracks"]) // RESULTS_PER_PAGE))
+
+
+def page(result_set, number):
+    """Returns the (index, track) pairs on page `number` (from 0) of a result set."""
+    start = number * RESULTS_PER_PAGE
+    return list(enumerate(result_set["tracks"]))[start:start + RESULTS_PER_PAGE]
@@ -0,0 +1,126 @@
+# search_cache.py
+import json
+import logging
+import os
+import re
+import time
+import unicodedata
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_TTL = 30 * 60
+SEARCH_CACHE_MAX_ENTRIES = 2048
+# Set to a file path to keep the search cache across restarts, None keeps it in memory only
+SEARCH_CACHE_FILE = None
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+_cache = TTLCache(max_entries=SEARCH_CACHE_MAX_ENTRIES, ttl=SEARCH_CACHE_TTL)
+
+
+def normalize_query(query):
+    """
+    Normalizes a search query for use as a cache key: Unicode NFKC (full-width and
+    compatibility forms fold together), case-folded, whitespace collapsed and trimmed.
+    """
+    query = unicodedata.normalize("NFKC", query or "")
+    return _WHITESPACE_RE.sub(" ", query.casefold()).strip()
+
+
+def _key(query, max_results, kind="tracks"):
+    key = f"{max_results}:{normalize_query(query)}"
+    # Track searches keep the key format of files persisted before albums and playlists were searched
+    return key if kind == "tracks" else f"{kind}:{key}"
+
+
+def configure_search_cache(ttl=None, max_entries=None, persist_file=None):
+    """Replaces the search cache with one using the given settings, loading persisted entries if a file is set."""
+    global _cache, SEARCH_CACHE_TTL, SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_FILE
+    SEARCH_CACHE_TTL = ttl or SEARCH_CACHE_TTL
+    SEARCH_CACHE_MAX_ENTRIES = max_entries or SEARCH_CACHE_MAX_ENTRIES
+    SEARCH_CACHE_FILE = persist_file
+    _cache = TTLCache(max_entries=SEARCH_CACHE_MAX_ENTRIES, ttl=SEARCH_CACHE_TTL)
+    if SEARCH_CACHE_FILE:
+        load()
+
+
+def get(query, max_results, kind="tracks"):
+    """Returns cached results for the query, or None on a miss. `kind` is "tracks", "albums" or "playlists"."""
+    return _cache.get(_key(query, max_results, kind))
+
+
+def peek(query, max_results, kind="tracks"):
+    """Like get(), but not counted in the hit ratio, for lookups that are not searches (e.g. inline queries)."""
+    return _cache.peek(_key(query, max_results, kind))
+
+
+def put(query, max_results, results, kind="tracks"):
+    """Caches the results of a query. Empty result lists are not cached so a later search can retry."""
+    if results:
+        _cache.set(_key(query, max_results, kind), results)
+
+
+def invalidate(query=None, max_results=None):
+    """
+    Drops cached results. With no query the whole cache is cleared, with a query but
+    no max_results every entry for that query is dropped. Returns the number of entries removed.
+    """
+    if query is None:
+        removed = len(_cache)
+        _cache.clear()
+        return removed
+    if max_results is not None:
+        return int(_cache.invalidate(_key(query, max_results)))
+    suffix = f":{normalize_query(query)}"
+    removed = 0
+    for key, _, _ in _cache.items():
+        if key.endswith(suffix) and _cache.invalidate(key):
+            removed += 1
+    return removed
+
+
+def track_results():
+    """Returns the result lists of all cached track searches (not album or playlist searches)."""
+    return [results for key, results, _ in _cache.items() if key.split(":", 1)[0].isdigit()]
+
+
+def stats():
+    """Returns entry count, hits, misses and hit ratio."""
+    return _cache.stats()
+
+
+def load():
+    """Loads unexpired entries from SEARCH_CACHE_FILE."""
+    if not SEARCH_CACHE_FILE or not os.path.exists(SEARCH_CACHE_FILE):
+        return
+    try:
+        with open(SEARCH_CACHE_FILE, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error("Failed to load search cache from %s: %s", SEARCH_CACHE_FILE, e)
+        return
+    now = time.time()
+    loaded = 0
+    for key, expires_at, results in stored:
+        if expires_at > now:
+            _cache.set(key, results, ttl=expires_at - now)
+            loaded += 1
+    logger.info("Loaded %s search cache entries from %s", loaded, SEARCH_CACHE_FILE)
+
+
+def save():
+    """Writes the unexpired entries to SEARCH_CACHE_FILE."""
+    if not SEARCH_CACHE_FILE:
+        return
+    # Entries expire on the monotonic clock, store them with a wall-clock expiry instead
+    offset = time.time() - time.monotonic()
+    stored = [[key, expires_at + offset, results] for key, results, expires_at in _cache.items()]
+    tmp_path = f"{SEARCH_CACHE_FILE}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(stored, f, ensure_ascii=False)
+        os.replace(tmp_path, SEARCH_CACHE_FILE)
+        logger.info("Saved %s search cache entries to %s", len(stored), SEARCH_CACHE_FILE)
+    except OSError as e:
+        logger.error("Failed to save search cache to %s: %s", SEARCH_CACHE_FILE, e)
@@ -0,0 +1,192 @@
+# search_orchestrator.py
+import asyncio
+import logging
+import time
+from collections import deque
+import metrics
+import search_cache
+import negative_cache
+from executor import run_search
+from yt_music_search import search_ytmusic, search_ytdlp, search_ytmusic_collections, remember_results
+from egress_pool import call_with_failover, egress_label
+
+logger = logging.getLogger(__name__)
+
+# Backends in order of preference. Results of a more preferred backend win,
+# the others only fill up and are used when it fails or finds nothing.
+BACKEND_ORDER = ("ytmusic_songs", "ytmusic_videos", "ytdlp")
+
+# Seconds each backend may take before its answer is given up on
+BACKEND_DEADLINES = {
+    "ytmusic_songs": 6.0,
+    "ytmusic_videos": 6.0,
+    "ytdlp": 12.0,
+}
+
+# Seconds an album or playlist search may take, it has no fallback backend to hedge with
+COLLECTION_SEARCH_DEADLINE = 8.0
+
+# The fallback backends are started once the primary has been running this long.
+# The delay adapts to the primary's recent latency (HEDGE_PERCENTILE), bounded by these limits.
+HEDGE_DELAY_DEFAULT = 1.0
+HEDGE_DELAY_MIN = 0.3
+HEDGE_DELAY_MAX = 3.0
+HEDGE_PERCENTILE = 0.95
+LATENCY_WINDOW = 100
+MIN_LATENCY_SAMPLES = 10
+
+_latencies = {name: deque(maxlen=LATENCY_WINDOW) for name in BACKEND_ORDER}
+_errors = {name: 0 for name in BACKEND_ORDER}
+
+
+def _backend_call(name, query, max_results, proxy_config):
+    """Returns a blocking callable for the backend. It goes through the egress pool unless `proxy_config` pins a proxy."""
+    if name == "ytmusic_songs":
+        search = lambda proxy, user_agent: search_ytmusic(query, "songs", max_results, proxy)
+    elif name == "ytmusic_videos":
+        search = lambda proxy, user_agent: search_ytmusic(query, "videos", max_results, proxy)
+    else:
+        search = lambda proxy, user_agent: search_ytdlp(query, max_results, proxy, user_agent)
+    return lambda: call_with_failover(search, proxy_config=proxy_config)
+
+
+async def _run_backend(name, call):
+    """Runs one backend in the search pool under its deadline and records its latency. Returns None on failure."""
+    started = time.monotonic()
+    try:
+        with metrics.span("search", backend=name):
+            results = await asyncio.wait_for(run_search(call), BACKEND_DEADLINES[name])
+    except asyncio.CancelledError:
+        raise
+    except asyncio.TimeoutError:
+        _errors[name] += 1
+        metrics.BACKEND_ERRORS.inc(backend=name, reason="timeout")
+        logger.warning("Search backend %s missed its %.1fs deadline.", name, BACKEND_DEADLINES[name])
+        return None
+    except Exception as e:
+        _errors[name] += 1
+        metrics.BACKEND_ERRORS.inc(backend=name, reason="error")
+        logger.warning("Search backend %s failed: %s", name, e)
+        return None
+    _latencies[name].append(time.monotonic() - started)
+    return results
+
+
+def hedge_delay():
+    """Seconds to wait for the primary backend before starting the fallbacks."""
+    samples = sorted(_latencies[BACKEND_ORDER[0]])
+    if len(samples) < MIN_LATENCY_SAMPLES:
+        return HEDGE_DELAY_DEFAULT
+    delay = samples[min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE))]
+    return min(HEDGE_DELAY_MAX, max(HEDGE_DELAY_MIN, delay))
+
+
+def backend_stats():
+    """Returns per-backend sample count, median and p95 latency (seconds) and error count."""
+    stats = {}
+    for name in BACKEND_ORDER:
+        samples = sorted(_latencies[name])
+        stats[name] = {
+            "samples": len(samples),
+            "p50": samples[len(samples) // 2] if samples else None,
+            "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))] if samples else None,
+            "errors": _errors[name],
+        }
+    return stats
+
+
+def _merge(finished, max_results):
+    """Merges finished backend results in preference order, dropping duplicate video ids."""
+    merged, seen = [], set()
+    for name in BACKEND_ORDER:
+        for track in finished.get(name) or []:
+            if track["id"] not in seen:
+                seen.add(track["id"])
+                merged.append(track)
+    return merged[:max_results]
+
+
+def _decided(finished):
+    """
+    True once the answer can no longer improve: the most preferred backend that did not fail
+    or come back empty has answered, or every backend is done.
+    """
+    for name in BACKEND_ORDER:
+        if name not in finished:
+            return False
+        if finished[name]:
+            return True
+    return True
+
+
+async def search_tracks(query, max_results=5, proxy_config=None):
+    """
+    Async search that hedges across backends: YTMusicAPI songs starts first, YTMusicAPI videos
+    and yt-dlp start when it is slower than hedge_delay() or comes back empty. Returns as soon as
+    the preferred answer is known, with the results of finished backends merged and deduplicated by video id.
+    Remaining backend tasks are cancelled (a blocking call already running in the pool finishes in the background).
+    Returns the same result dicts as search_youtube_music, including the "known_failure" marks.
+    """
+    cached_results = search_cache.get(query, max_results)
+    if cached_results is not None:
+        metrics.CACHE_REQUESTS.inc(cache="search", result="hit")
+        logger.info("Search cache hit for query: '%s'", query)
+        return negative_cache.mark_results(cached_results)
+    metrics.CACHE_REQUESTS.inc(cache="search", result="miss")
+
+    logger.info("Starting hedged search for query: '%s' with max_results: %s, proxy: %s", query, max_results, egress_label(proxy_config))
+    tasks = {}
+
+    def start(name):
+        if name not in tasks:
+            tasks[name] = asyncio.ensure_future(_run_backend(name, _backend_call(name, query, max_results, proxy_config)))
+
+    start(BACKEND_ORDER[0])
+    hedged = False
+    hedge_at = time.monotonic() + hedge_delay()
+    finished = {}
+    try:
+        while not _decided(finished):
+            pending = [task for task in tasks.values() if not task.done()]
+            timeout = None if hedged else max(0.0, hedge_at - time.monotonic())
+            if pending:
+                await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for name, task in tasks.items():
+                if task.done() and name not in finished:
+                    finished[name] = task.result()
+            if not hedged and (time.monotonic() >= hedge_at or BACKEND_ORDER[0] in finished):
+                if not finished.get(BACKEND_ORDER[0]):
+                    for name in BACKEND_ORDER[1:]:
+                        start(name)
+                hedged = True
+    finally:
+        for task in tasks.values():
+            task.cancel()
+
+    results = _merge(finished, max_results)
+    logger.info("Hedged search for '%s' answered by %s.", query, [name for name in BACKEND_ORDER if finished.get(name)])
+    remember_results(query, max_results, results)
+    return negative_cache.mark_results(results)
+
+
+async def search_collections(query, kind, max_results=5, proxy_config=None):
+    """
+    Searches YouTube Music for albums or playlists (`kind` is "album" or "playlist") in the search pool.
+    Returns collection dicts (id, kind, title, artist, year, count), cached like track searches.
+    Raises on failure or when the search misses COLLECTION_SEARCH_DEADLINE.
+    """
+    cached_results = search_cache.get(query, max_results, kind=f"{kind}s")
+    if cached_results is not None:
+        metrics.CACHE_REQUESTS.inc(cache="search", result="hit")
+        return cached_results
+    metrics.CACHE_REQUESTS.inc(cache="search", result="miss")
+    search = lambda proxy, user_agent: search_ytmusic_collections(query, kind, max_results, proxy)
+    try:
+        with metrics.span("search", backend=f"ytmusic_{kind}s"):
+            results = await asyncio.wait_for(run_search(lambda: call_with_failover(search, proxy_config=proxy_config)), COLLECTION_SEARCH_DEADLINE)
+    except Exception as e:
+        metrics.BACKEND_ERRORS.inc(backend=f"ytmusic_{kind}s", reason="timeout" if isinstance(e, asyncio.TimeoutError) else "error")
+        raise
+    logger.info("%s search for '%s' found %s results.", kind.capitalize(), query, len(results))
+    search_cache.put(query, max_results, results, kind=f"{kind}s")
+    return results
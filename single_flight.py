@@ -0,0 +1,38 @@
+# single_flight.py
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# key -> asyncio.Task of the fetch currently running for that key
+_in_flight = {}
+
+
+def join(key, coro_factory):
+    """
+    Returns (task, is_leader) for `key`. The first caller starts `coro_factory()` as a task
+    and becomes the leader, callers arriving while it runs get the same task.
+    Await the task through asyncio.shield() so a cancelled waiter does not cancel the fetch for everyone.
+    """
+    task = _in_flight.get(key)
+    if task is not None:
+        logger.info("Joining in-flight work for %s", key)
+        return task, False
+
+    task = asyncio.ensure_future(coro_factory())
+    _in_flight[key] = task
+
+    def _forget(done_task):
+        if _in_flight.get(key) is done_task:
+            del _in_flight[key]
+        # Mark the exception as retrieved if every waiter went away before it finished
+        if not done_task.cancelled():
+            done_task.exception()
+
+    task.add_done_callback(_forget)
+    return task, True
+
+
+def in_flight_count():
+    """Number of keys currently being worked on."""
+    return len(_in_flight)
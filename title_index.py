@@ -0,0 +1,153 @@
+# title_index.py
+import bisect
+import heapq
+import logging
+import re
+import threading
+from collections import OrderedDict
+from search_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+# Tracks kept in the index, the least recently added or updated ones are dropped beyond that
+TITLE_INDEX_MAX_TRACKS = 20000
+
+# The last query token is matched as a prefix once it is this long, shorter ones must match a whole word
+PREFIX_MIN_LENGTH = 2
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Splits a title, artist or query into normalized word tokens (see search_cache.normalize_query)."""
+    return _TOKEN_RE.findall(normalize_query(text))
+
+
+class TitleIndex:
+    """
+    In-memory token index over the titles and artists of known tracks: the ones in the audio cache
+    and the ones seen in search results. Answers inline queries without an upstream search.
+    Every query token must match a token of the track's title or artist, the last one as a prefix
+    (so results appear while the user is typing). Tracks keep their Telegram file_id here even after
+    their audio was evicted from the cache, the file_id stays valid.
+    """
+
+    def __init__(self, max_tracks=TITLE_INDEX_MAX_TRACKS):
+        self.max_tracks = max_tracks
+        self._tracks = OrderedDict()  # video_id -> {"added", "video_id", "title", "artist", "duration", "file_id", "tokens"}
+        self._postings = {}  # token -> set of video_ids
+        self._sorted_tokens = []  # the keys of _postings, sorted for prefix lookups
+        self._added = 0  # increases with every add, orders the results by recency
+        self._lock = threading.Lock()
+
+    def _unlink(self, video_id):
+        track = self._tracks.pop(video_id, None)
+        if track is None:
+            return None
+        for token in track["tokens"]:
+            postings = self._postings.get(token)
+            postings.discard(video_id)
+            if not postings:
+                del self._postings[token]
+                del self._sorted_tokens[bisect.bisect_left(self._sorted_tokens, token)]
+        return track
+
+    def add(self, video_id, title, artist, duration=0, file_id=None):
+        """Adds or updates a track. A file_id of None keeps the one already known, use set_file_id() to clear it."""
+        if not video_id or not title:
+            return
+        with self._lock:
+            previous = self._unlink(video_id)
+            tokens = set(tokenize(f"{title} {artist or ''}"))
+            self._added += 1
+            self._tracks[video_id] = {
+                "added": self._added, "video_id": video_id, "title": title, "artist": artist, "duration": int(duration or 0),
+                "file_id": file_id or (previous and previous["file_id"]), "tokens": tokens,
+            }
+            for token in tokens:
+                if token not in self._postings:
+                    self._postings[token] = set()
+                    bisect.insort(self._sorted_tokens, token)
+                self._postings[token].add(video_id)
+            while len(self._tracks) > self.max_tracks:
+                self._unlink(next(iter(self._tracks)))
+
+    def add_track(self, track):
+        """Adds a search result or cache entry dict (with "id" or "video_id")."""
+        self.add(track.get("video_id") or track.get("id"), track.get("title"), track.get("artist"),
+                 track.get("duration"), track.get("file_id"))
+
+    def set_file_id(self, video_id, file_id):
+        """Stores (or clears, with None) the file_id of an indexed track."""
+        with self._lock:
+            track = self._tracks.get(video_id)
+            if track is not None:
+                track["file_id"] = file_id
+
+    def _public(self, track):
+        return {key: value for key, value in track.items() if key not in ("tokens", "added")}
+
+    def get(self, video_id):
+        """Returns the indexed track dict of a video_id, or None."""
+        with self._lock:
+            track = self._tracks.get(video_id)
+            return track and self._public(track)
+
+    def _prefix_matches(self, prefix):
+        if len(prefix) < PREFIX_MIN_LENGTH:
+            return set(self._postings.get(prefix, ()))
+        matches = set()
+        start = bisect.bisect_left(self._sorted_tokens, prefix)
+        for token in self._sorted_tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            matches |= self._postings[token]
+        return matches
+
+    def search(self, query, limit=20):
+        """
+        Returns up to `limit` track dicts (video_id, title, artist, duration, file_id) matching the query.
+        Tracks with a file_id come first, then the most recently seen ones.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        *words, prefix = tokens
+        with self._lock:
+            if words:
+                postings = sorted((self._postings.get(token, set()) for token in words), key=len)
+                video_ids = postings[0].intersection(*postings[1:])
+                # Checking the few remaining tracks is cheaper than collecting every track of a short prefix
+                tokens_match = (lambda tokens: prefix in tokens) if len(prefix) < PREFIX_MIN_LENGTH else \
+                    (lambda tokens: any(token.startswith(prefix) for token in tokens))
+                video_ids = [video_id for video_id in video_ids if tokens_match(self._tracks[video_id]["tokens"])]
+            else:
+                video_ids = self._prefix_matches(prefix)
+            ranked = heapq.nsmallest(limit, video_ids, key=lambda video_id: (self._tracks[video_id]["file_id"] is None, -self._tracks[video_id]["added"]))
+            return [self._public(self._tracks[video_id]) for video_id in ranked]
+
+    def __len__(self):
+        return len(self._tracks)
+
+
+_index = TitleIndex()
+
+
+def get_title_index():
+    return _index
+
+
+def init_title_index(cache_entries=(), search_results=(), max_tracks=None):
+    """
+    Builds the shared index from the cached tracks and the results in the search cache. Call once at startup,
+    after the audio and search caches were loaded. Later tracks are added as they are searched and cached.
+    """
+    global _index
+    _index = TitleIndex(max_tracks or TITLE_INDEX_MAX_TRACKS)
+    for results in search_results:
+        for track in results:
+            _index.add_track(track)
+    for entry in cache_entries:
+        _index.add_track(entry)
+    logger.info("Title index built with %s tracks.", len(_index))
+    return _index
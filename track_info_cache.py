@@ -0,0 +1,41 @@
+# track_info_cache.py
+import logging
+from ttl_cache import TTLCache
+from title_index import get_title_index
+
+logger = logging.getLogger(__name__)
+
+# Extracted yt-dlp info holds signed stream URLs that expire after a few hours, keep it short
+EXTRACTED_INFO_TTL = 600
+# Track summaries from search results (title, artist, duration) change rarely
+SEARCH_SUMMARY_TTL = 6 * 3600
+
+_extracted_info = TTLCache(max_entries=256, ttl=EXTRACTED_INFO_TTL)
+_search_summaries = TTLCache(max_entries=4096, ttl=SEARCH_SUMMARY_TTL)
+
+
+def get_extracted_info(video_id):
+    """Returns the cached yt-dlp info dict for `video_id`, or None."""
+    return _extracted_info.get(video_id)
+
+
+def put_extracted_info(video_id, info):
+    _extracted_info.set(video_id, info)
+
+
+def invalidate_extracted_info(video_id):
+    """Drops cached info, e.g. after its stream URLs were rejected."""
+    _extracted_info.invalidate(video_id)
+
+
+def put_search_results(results):
+    """Remembers the track dicts returned by search_youtube_music, keyed by their video id, and indexes their titles for inline queries."""
+    for track in results:
+        if track.get("id"):
+            _search_summaries.set(track["id"], track)
+            get_title_index().add_track(track)
+
+
+def get_search_summary(video_id):
+    """Returns the search result dict (id, title, artist, duration, ...) last seen for `video_id`, or None."""
+    return _search_summaries.get(video_id)
@@ -0,0 +1,64 @@
+# ydl_pool.py
+import atexit
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Instances kept per thread (or per download process), the least recently used one is closed beyond that
+YDL_POOL_SIZE = 8
+
+_local = threading.local()
+_open_instances = set()
+_open_lock = threading.Lock()
+
+
+def get_ydl(params, setup=None):
+    """
+    Returns a yt_dlp.YoutubeDL for `params`, owned by the calling thread and reused by its later calls with
+    equal params, so the extractors, cookie jar and HTTP connections are set up once instead of per operation.
+    yt_dlp is imported on the first call. `setup(ydl)` runs once on a new instance (e.g. to add hooks)
+    and is part of the reuse key.
+    """
+    import yt_dlp
+    key = (json.dumps(params, sort_keys=True, default=str), setup)
+    instances = getattr(_local, "instances", None)
+    if instances is None:
+        instances = _local.instances = OrderedDict()
+    ydl = instances.get(key)
+    if ydl is not None:
+        instances.move_to_end(key)
+        return ydl
+    ydl = yt_dlp.YoutubeDL(dict(params))
+    if setup:
+        setup(ydl)
+    instances[key] = ydl
+    with _open_lock:
+        _open_instances.add(ydl)
+    while len(instances) > YDL_POOL_SIZE:
+        _, evicted = instances.popitem(last=False)
+        _close(evicted)
+    return ydl
+
+
+def _close(ydl):
+    with _open_lock:
+        _open_instances.discard(ydl)
+    try:
+        # Also writes the cookie jar back to the cookie file, like leaving a `with YoutubeDL(...)` block
+        ydl.close()
+    except Exception as close_error:
+        logger.warning("Failed to close YoutubeDL instance: %s", close_error)
+
+
+def close_all():
+    """Closes every pooled instance of this process. Runs at exit, including in download pool processes."""
+    with _open_lock:
+        instances = list(_open_instances)
+    for ydl in instances:
+        _close(ydl)
+
+
+atexit.register(close_all)
@@ -1,235 +1,564 @@
 # yt_downloader.py
-import yt_dlp
 import os
 import logging
 import random
-import json
 import asyncio
-from telegram import InputFile
+import contextlib
+import time
+from telegram import InputFile, InputMediaAudio
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
+from executor import run_search, run_extract, run_download, run_storage
+from download_worker import download, stream_download, transcode, StreamingUnsupported
+from ydl_pool import get_ydl
+import single_flight
+import negative_cache
+import metrics
+from cache_manager import get_cache, variant_key, VARIANT_SEPARATOR
+from cache_storage import get_storage, SHARED_LOCK_TTL, SHARED_LOCK_POLL_INTERVAL
+from rate_limiter import get_rate_limiter
+from egress_pool import get_egress_pool, call_with_failover, classify_error, egress_label, MAX_EGRESS_ATTEMPTS
+from track_info_cache import get_extracted_info, put_extracted_info, invalidate_extracted_info, get_search_summary, put_search_results
+from ttl_cache import TTLCache
+from job_scheduler import get_scheduler
+from title_index import get_title_index
+from yt_music_search import get_collection_tracks
 
 logger = logging.getLogger(__name__)
 
-CACHE_DIR = "./cache"
+# AUDIO DELIVERY MODE
+# "native": send the m4a (AAC) stream as-is, only remuxed into an audio container with a stream copy.
+#           Sources that Telegram cannot play (e.g. opus/webm only) are transcoded to AAC.
+# "mp3":    always transcode to 128 kbps MP3.
+AUDIO_DELIVERY_MODE = "native"
+DELIVERY_MODES = ("native", "mp3")
 
-USER_AGENTS = [
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
-    "Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36",
-    
+# Container of the cached file -> codec it holds
+CONTAINER_CODECS = {"m4a": "aac", "mp3": "mp3"}
 
-    # ask chatgbt or any other AI for other User-Agents 
+# QUALITY VARIANTS - other qualities of a track are transcoded from its cached download (the master) in the
+# download pool, so they cost CPU but no further requests to YouTube. Each is cached as an entry of its own
+# (see cache_manager.variant_key), with its own eviction and Telegram file_id. A variant can't sound better than
+# the master, so in "mp3" mode (a 128 kbps master) variants above its bitrate are not offered.
+# quality -> button label, bitrate (kbps), container, codec and ffmpeg output options.
+AUDIO_VARIANTS = {
+    "mp3_64": {"label": "64k", "bitrate": 64, "container": "mp3", "codec": "mp3", "ffmpeg_args": ["-c:a", "libmp3lame", "-b:a", "64k", "-f", "mp3"]},
+    "mp3_128": {"label": "128k", "bitrate": 128, "container": "mp3", "codec": "mp3", "ffmpeg_args": ["-c:a", "libmp3lame", "-b:a", "128k", "-f", "mp3"]},
+    "mp3_320": {"label": "320k", "bitrate": 320, "container": "mp3", "codec": "mp3", "ffmpeg_args": ["-c:a", "libmp3lame", "-b:a", "320k", "-f", "mp3"]},
+    "opus": {"label": "Opus", "bitrate": 128, "container": "opus", "codec": "opus", "ffmpeg_args": ["-c:a", "libopus", "-b:a", "128k", "-f", "ogg"]},
+}
+# Bitrate (kbps) of the master per delivery mode, None where it is the source's own (native stream copy)
+MASTER_BITRATES = {"native": None, "mp3": 128}
+# Telegram only plays these as audio, other containers (opus) are sent as documents
+AUDIO_MESSAGE_EXTENSIONS = (".mp3", ".m4a")
 
-]
+# ALBUM/PLAYLIST BATCHES - tracks taken from one album or playlist, and how many of them are fetched at once at most.
+# Each fetch takes a download permit from the job scheduler like a track download, so batches stay within its
+# global and per-chat limits (with one download per chat, a batch fetches one track at a time).
+BATCH_MAX_TRACKS = 50
+BATCH_FETCH_CONCURRENCY = 3
+# Telegram sends 2-10 audio files as one media group
+MEDIA_GROUP_SIZE = 10
+# Seconds between edits of a batch's progress message, Telegram limits how often a message can be edited
+BATCH_PROGRESS_INTERVAL = 2.0
+# Track lists of albums and playlists that were opened recently
+_collections = TTLCache(max_entries=256, ttl=3600)
 
-async def download_and_send_track(video_id: str, chat_id: int, context: ContextTypes.DEFAULT_TYPE, message_to_edit=None, proxy_config: str = None):
+# STREAMING PIPELINE - pipe the audio stream straight into ffmpeg and write the result into the
+# cache directory, instead of downloading to a temp file and converting it afterwards.
+# Formats that are not plain HTTP(S) (e.g. HLS) still use the temp-file pipeline.
+STREAMING_PIPELINE = False
+
+def set_delivery_mode(mode, streaming=None):
+    """Selects how downloaded audio is delivered, see AUDIO_DELIVERY_MODE, and optionally the STREAMING_PIPELINE."""
+    global AUDIO_DELIVERY_MODE, STREAMING_PIPELINE
+    if mode not in DELIVERY_MODES:
+        raise ValueError(f"Unknown audio delivery mode: {mode}")
+    AUDIO_DELIVERY_MODE = mode
+    if streaming is not None:
+        STREAMING_PIPELINE = streaming
+    logger.info("Audio delivery mode: %s, streaming pipeline: %s", mode, STREAMING_PIPELINE)
+
+def configure_batches(max_tracks=None, concurrency=None):
+    """Sets BATCH_MAX_TRACKS and BATCH_FETCH_CONCURRENCY. None keeps the defaults."""
+    global BATCH_MAX_TRACKS, BATCH_FETCH_CONCURRENCY
+    if max_tracks:
+        BATCH_MAX_TRACKS = max_tracks
+    if concurrency:
+        BATCH_FETCH_CONCURRENCY = concurrency
+
+def _delivery_options(mode):
+    """Returns the yt-dlp format selector and postprocessor for a delivery mode."""
+    if mode == "native":
+        # FFmpegExtractAudio copies the stream when the source is already AAC and only encodes otherwise
+        return "bestaudio[ext=m4a]/bestaudio[acodec^=mp4a]/bestaudio/best", {
+            "key": "FFmpegExtractAudio",
+            "preferredcodec": "m4a",
+            "preferredquality": "128",
+        }
+    return "bestaudio[ext=m4a]/bestaudio[ext=opus]/bestaudio/best", {
+        "key": "FFmpegExtractAudio",
+        "preferredcodec": "mp3",
+        "preferredquality": "128",
+    }
+
+class TrackFetchError(Exception):
     """
-    Downloads a track from YouTube, converts it to MP3, adds metadata (via yt-dlp),
-    caches it with a separate metadata file, and sends it to the user.
-    Uses rotating User-Agents, optional proxy, and adds a small delay.
+    Raised when a track could not be downloaded into the cache. The message is shown to the user.
+    `egress_failure` is "blocked" or "egress" when the proxy/IP used was at fault, so another egress may succeed.
+    `failure_class` is the negative cache class of the underlying error (see negative_cache.classify_failure).
+    """
+
+    def __init__(self, message, egress_failure=None, failure_class=None):
+        super().__init__(message)
+        self.egress_failure = egress_failure
+        self.failure_class = failure_class
+
+def _extract_info(ydl_opts, url):
+    """
+    Blocking info extraction, run in the extract thread pool.
+    The info is sanitized so it can be cached and passed to the download process pool.
+    """
+    ydl = get_ydl(ydl_opts)
+    return ydl.sanitize_info(ydl.extract_info(url, download=False), remove_private_keys=True)
+
+async def _fetch_track(video_id: str, proxy_config: str = None, mode: str = "native"):
+    """
+    Extracts info, downloads the track in the given delivery mode and adds it to the cache index.
+    Runs once per video_id, shared by concurrent requests.
+    The egress (proxy and User-Agent) comes from the egress pool and sticks to the video; when YouTube
+    blocks it, the track is fetched again through another one. A given `proxy_config` pins the proxy instead.
+    Returns the new cache entry, raises TrackFetchError with a user-facing message on failure.
+    """
+    pool = get_egress_pool()
+    if proxy_config:
+        try:
+            entry = await _fetch_track_via(video_id, mode, proxy_config, random.choice(pool.user_agents))
+        except TrackFetchError as fetch_error:
+            pool.report(proxy_config, fetch_error.egress_failure or "error")
+            raise
+        pool.report(proxy_config, "ok")
+        return entry
+    tried = []
+    last_error = None
+    for _ in range(MAX_EGRESS_ATTEMPTS):
+        choice = pool.choose(video_id, exclude=tried)
+        if choice is None:
+            break
+        proxy, user_agent = choice
+        started = time.monotonic()
+        try:
+            entry = await _fetch_track_via(video_id, mode, proxy, user_agent)
+        except TrackFetchError as fetch_error:
+            if not fetch_error.egress_failure:
+                raise
+            pool.report(proxy, fetch_error.egress_failure, key=video_id)
+            tried.append(proxy)
+            last_error = fetch_error
+            logger.warning("[%s] Egress %s failed (%s), retrying through another one.", video_id, egress_label(proxy), fetch_error.egress_failure)
+            continue
+        pool.report(proxy, "ok", time.monotonic() - started, key=video_id)
+        return entry
+    raise last_error
+
+async def _fetch_track_shared(video_id: str, proxy_config: str = None, mode: str = "native"):
     """
+    _fetch_track for nodes that share a cache storage (see cache_storage). A track another node already
+    fetched is copied from the storage; otherwise this node takes the storage lock of the video_id, fetches
+    the track and puts it into the storage. While another node holds the lock, the storage is polled until
+    the track appears or the lock is free, for at most SHARED_LOCK_TTL seconds, after which the track is fetched anyway.
+    """
+    storage = get_storage()
+    if storage is None:
+        return await _fetch_track(video_id, proxy_config, mode)
+    cache = get_cache()
+    deadline = time.monotonic() + SHARED_LOCK_TTL
+    locked = False
+    try:
+        while True:
+            with metrics.span("shared_pull"):
+                entry = await run_storage(cache.pull, video_id, storage)
+            if entry:
+                metrics.CACHE_REQUESTS.inc(cache="shared", result="hit")
+                return entry
+            locked = await run_storage(storage.acquire_lock, video_id)
+            if locked:
+                # The previous holder may have stored the track and released the lock since the pull above
+                entry = await run_storage(cache.pull, video_id, storage)
+                if entry:
+                    await _release_shared_lock(storage, video_id)
+                    metrics.CACHE_REQUESTS.inc(cache="shared", result="hit")
+                    return entry
+                break
+            if time.monotonic() >= deadline:
+                logger.warning("[%s] Shared lock still held by another node, fetching anyway.", video_id)
+                break
+            await asyncio.sleep(SHARED_LOCK_POLL_INTERVAL)
+    except Exception as storage_error:
+        # An unreachable storage must not fail the download, this node fetches the track itself
+        logger.error("[%s] Shared storage failed, fetching without it: %s", video_id, storage_error)
+        if locked:
+            await _release_shared_lock(storage, video_id)
+        metrics.CACHE_REQUESTS.inc(cache="shared", result="miss")
+        return await _fetch_track(video_id, proxy_config, mode)
+    metrics.CACHE_REQUESTS.inc(cache="shared", result="miss")
+    try:
+        entry = await _fetch_track(video_id, proxy_config, mode)
+        try:
+            with metrics.span("shared_push"):
+                await run_storage(cache.push, video_id, storage)
+        except Exception as push_error:
+            # The track is still served from the local cache, other nodes fetch it themselves
+            logger.error("[%s] Failed to put track into shared storage: %s", video_id, push_error)
+        return entry
+    finally:
+        if locked:
+            await _release_shared_lock(storage, video_id)
+
+async def _release_shared_lock(storage, video_id):
+    """Releases the storage lock of a video_id. A failure is only logged, the lock expires after SHARED_LOCK_TTL."""
+    try:
+        await run_storage(storage.release_lock, video_id)
+    except Exception as release_error:
+        logger.error("[%s] Failed to release shared lock: %s", video_id, release_error)
+
+async def _fetch_track_via(video_id: str, mode: str, proxy_config, selected_user_agent: str):
+    """One attempt of _fetch_track through the given proxy (None for a direct connection) and User-Agent."""
+    from yt_dlp.utils import DownloadError
+    cache = get_cache()
     script_dir = os.path.dirname(os.path.abspath(__file__))
     cookie_file_path = os.path.join(script_dir, "cookies.txt")
     cookie_file_to_use = cookie_file_path if os.path.exists(cookie_file_path) else None
 
     if not cookie_file_to_use:
-        logger.warning(f"[{video_id}] Cookie file not found at {cookie_file_path}. Proceeding without cookies.")
+        logger.warning("[%s] Cookie file not found at %s. Proceeding without cookies.", video_id, cookie_file_path)
 
-    logger.info(f"[{video_id}] Starting download for chat {chat_id}. Proxy: {proxy_config}")
-    final_file_path = os.path.join(CACHE_DIR, f"{video_id}.mp3")
-    metadata_file_path = os.path.join(CACHE_DIR, f"{video_id}.json")
-    temp_download_path_pattern = os.path.join(CACHE_DIR, f"{video_id}_temp.%(ext)s")
-    processed_temp_path = os.path.join(CACHE_DIR, f"{video_id}_temp.mp3")
+    # Not specific to the video, so one pooled YoutubeDL serves all downloads with the same options
+    temp_download_path_pattern = os.path.join(cache.cache_dir, "%(id)s_temp.%(ext)s")
+    audio_format, audio_postprocessor = _delivery_options(mode)
 
-    selected_user_agent = random.choice(USER_AGENTS)
     http_headers = {
         "User-Agent": selected_user_agent,
         "Accept-Language": "en-US,en;q=0.5",
     }
-    logger.info(f"[{video_id}] Using User-Agent: {selected_user_agent}")
-
-    try:
-        if os.path.exists(final_file_path) and os.path.exists(metadata_file_path):
-            logger.info(f"[{video_id}] Cache hit for audio and metadata.")
-            if message_to_edit:
-                await message_to_edit.edit_text("Track found in cache! Sending now...")
-            try:
-                with open(metadata_file_path, "r", encoding="utf-8") as meta_f:
-                    cached_metadata = json.load(meta_f)
-                title = cached_metadata.get("title", "Unknown Title")
-                artist = cached_metadata.get("artist", "Unknown Artist")
-                duration = cached_metadata.get("duration", 0)
-                caption = f"{title} - {artist}"
-                with open(final_file_path, "rb") as audio_file:
-                    await context.bot.send_audio(
-                        chat_id=chat_id,
-                        audio=InputFile(audio_file, filename=f"{title} - {artist}.mp3"),
-                        caption=caption, title=title, performer=artist, duration=duration,
-                        write_timeout=180, read_timeout=180, connect_timeout=180
-                    )
-                logger.info(f"[{video_id}] Successfully sent cached file.")
-                if message_to_edit: await message_to_edit.delete()
-                return
-            except Exception as send_error:
-                logger.error(f"[{video_id}] Error sending cached file {final_file_path}: {send_error}", exc_info=True)
-                if message_to_edit: await message_to_edit.edit_text("Error sending cached file. Will attempt redownload.")
+    logger.info("[%s] Using User-Agent: %s", video_id, selected_user_agent)
 
-        logger.info(f"[{video_id}] Cache miss or error. Proceeding with download.")
-        if message_to_edit: await message_to_edit.edit_text("Downloading and processing track... (this may take a moment)")
-
-        os.makedirs(CACHE_DIR, exist_ok=True)
+    base_ydl_opts = {
+        "quiet": True,
+        "no_warnings": True,
+        "source_address": "0.0.0.0",
+        "http_headers": http_headers,
+        "geo_bypass": True,
+        "force_ipv4": True,
+    }
+    if cookie_file_to_use:
+        base_ydl_opts["cookiefile"] = cookie_file_to_use
+        logger.info("[%s] Using cookie file for operations: %s", video_id, cookie_file_to_use)
+    if proxy_config:
+        base_ydl_opts["proxy"] = proxy_config
+        logger.info("[%s] Using proxy for operations: %s", video_id, egress_label(proxy_config))
 
-        base_ydl_opts = {
-            "quiet": True,
-            "no_warnings": True,
-            "source_address": "0.0.0.0",
-            "http_headers": http_headers,
-            "geo_bypass": True,
-            "force_ipv4": True,
-        }
-        if cookie_file_to_use:
-            base_ydl_opts["cookiefile"] = cookie_file_to_use
-            logger.info(f"[{video_id}] Using cookie file for operations: {cookie_file_to_use}")
-        if proxy_config:
-            base_ydl_opts["proxy"] = proxy_config
-            logger.info(f"[{video_id}] Using proxy for operations: {proxy_config}")
-
-        track_info = None
-        video_url = f"https://www.youtube.com/watch?v={video_id}"
-        logger.info(f"[{video_id}] Extracting track info from: {video_url}")
+    video_url = f"https://www.youtube.com/watch?v={video_id}"
+    track_info = get_extracted_info(video_id)
+    if track_info:
+        metrics.CACHE_REQUESTS.inc(cache="track_info", result="hit")
+        logger.info("[%s] Using recently extracted track info.", video_id)
+    else:
+        metrics.CACHE_REQUESTS.inc(cache="track_info", result="miss")
+        logger.info("[%s] Extracting track info from: %s", video_id, video_url)
         try:
-            await asyncio.sleep(random.uniform(0.5, 1.5))
+            with metrics.span("rate_limit", before="extract"):
+                await get_rate_limiter().acquire(egress_label(proxy_config))
             ydl_info_opts = base_ydl_opts.copy()
             # No download for info extraction
-            with yt_dlp.YoutubeDL(ydl_info_opts) as ydl_info:
-                track_info = ydl_info.extract_info(video_url, download=False)
-            logger.info(f"[{video_id}] Successfully extracted track info.")
+            with metrics.span("extract"):
+                track_info = await run_extract(_extract_info, ydl_info_opts, video_url)
+            logger.info("[%s] Successfully extracted track info.", video_id)
         except Exception as info_err:
-            logger.error(f"[{video_id}] Failed to extract info: {info_err}", exc_info=True)
+            logger.error("[%s] Failed to extract info: %s", video_id, info_err, exc_info=True)
             error_message = "Failed to get track information."
+            failure_class = negative_cache.classify_failure(info_err)
             if "authentication" in str(info_err).lower() or "login" in str(info_err).lower():
                 error_message += " (Authentication may be required - check cookies)"
             elif "HTTP Error 403" in str(info_err):
+                 metrics.UPSTREAM_BLOCKS.inc(stage="extract")
                  error_message += " (Blocked by YouTube - 403)"
-            if message_to_edit: await message_to_edit.edit_text(error_message)
-            return
+            elif failure_class == "unavailable":
+                error_message += " (The video is unavailable on YouTube)"
+            elif failure_class == "region_locked":
+                error_message += " (The video is not available in the bot's region)"
+            raise TrackFetchError(error_message, egress_failure=classify_error(info_err), failure_class=failure_class) from info_err
+        if track_info:
+            put_extracted_info(video_id, track_info)
 
-        if not track_info:
-            logger.error(f"[{video_id}] Track info was empty after extraction.")
-            if message_to_edit: await message_to_edit.edit_text("Could not retrieve track information.")
-            return
+    if not track_info:
+        logger.error("[%s] Track info was empty after extraction.", video_id)
+        raise TrackFetchError("Could not retrieve track information.")
 
-        ydl_download_opts = base_ydl_opts.copy()
-        ydl_download_opts.update({
-            "format": "bestaudio[ext=m4a]/bestaudio[ext=opus]/bestaudio/best",
-            "outtmpl": temp_download_path_pattern,
-            "force_overwrites": True,
-            "noplaylist": True,
-            "retries": 3,
-            "fragment_retries": 3,
-            "retry_sleep": {"http": random.randint(3, 7)}, # Randomized retry sleep
-            "addmetadata": True,
-            "throttledrate": "1M",
-            "sleep_interval_requests": random.uniform(0.5, 1.5),
-            "postprocessors": [{
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": "mp3",
-                "preferredquality": "128",
-            }],
-        })
-        
-        download_success = False
-        logger.info(f"[{video_id}] Starting download and processing for MP3...")
-        try:
-            delay = random.uniform(1.0, 3.0)
-            logger.info(f"[{video_id}] Waiting for {delay:.2f} seconds before download...")
-            await asyncio.sleep(delay)
-            
-            with yt_dlp.YoutubeDL(ydl_download_opts) as ydl:
-                download_target_url = track_info.get("webpage_url", video_url)
-                logger.info(f"[{video_id}] Passing URL to ydl.download: {download_target_url}")
-                error_code = ydl.download([download_target_url])
-                if error_code == 0:
-                    download_success = True
-                    logger.info(f"[{video_id}] yt-dlp download process completed successfully.")
-                else:
-                    logger.error(f"[{video_id}] yt-dlp download process failed with error code: {error_code}")
-        
-        except yt_dlp.utils.DownloadError as dl_err:
-            logger.error(f"[{video_id}] Download failed (DownloadError): {dl_err}", exc_info=False)
-            error_message = "Download failed. "
-            is_403 = "HTTP Error 403" in str(dl_err)
-            
-            # Simplified fallback: if cookies were used and it's a 403, try without cookies if proxy is not already set (or vice-versa)
-            # For now, just report the error more clearly.
-            if is_403:
-                error_message += "YouTube blocked the request (403 Forbidden). "
-                if cookie_file_to_use: error_message += "Try updating cookies or using a proxy. "
-                elif proxy_config: error_message += "The proxy might be blocked. "
-                else: error_message += "Consider using a proxy or cookies. "
-            elif "unavailable" in str(dl_err).lower():
-                error_message += "The video might be unavailable or region-locked."
-            else:
-                error_message += "Please try again later."
+    ydl_download_opts = base_ydl_opts.copy()
+    ydl_download_opts.update({
+        "format": audio_format,
+        "outtmpl": temp_download_path_pattern,
+        "force_overwrites": True,
+        "noplaylist": True,
+        "retries": 3,
+        "fragment_retries": 3,
+        "addmetadata": True,
+        "throttledrate": "1M",
+        "postprocessors": [audio_postprocessor],
+    })
 
-            if message_to_edit: await message_to_edit.edit_text(error_message)
-            # No return here, will be caught by `if not download_success` later for cleanup
+    title = track_info.get("title", "Unknown Title")
+    # Attempt to get artist from track_info, then from the search result, fallback to uploader/channel
+    search_summary = get_search_summary(video_id) or {}
+    artist_detail = track_info.get("artist") or search_summary.get("artist") or track_info.get("uploader") or track_info.get("channel", "Unknown Artist")
+    duration = int(track_info.get("duration", 0))
 
-        except Exception as dl_err:
-            logger.error(f"[{video_id}] Unexpected exception during yt-dlp download/processing: {dl_err}", exc_info=True)
-            if message_to_edit: await message_to_edit.edit_text("An unexpected error occurred during download.")
-            # No return here, will be caught by `if not download_success` later for cleanup
+    download_error_message = "Failed to download or process the track after attempts."
+    egress_failure = None
+    failure_class = None
+    download_success = False
+    processed_temp_path = None
+    logger.info("[%s] Starting download and processing (%s)...", video_id, mode)
+    try:
+        with metrics.span("rate_limit", before="download"):
+            delay = await get_rate_limiter().acquire(egress_label(proxy_config))
+        if delay:
+            logger.info("[%s] Waited %.2f seconds for the rate limit before download.", video_id, delay)
 
+        logger.info("[%s] Downloading from extracted info: %s", video_id, track_info.get('webpage_url', video_url))
+        if STREAMING_PIPELINE:
+            try:
+                # Download and transcode overlap here, so they are timed as one stage
+                with metrics.span("stream", mode=mode):
+                    processed_temp_path = await run_download(
+                        stream_download, ydl_download_opts, track_info, os.path.join(cache.cache_dir, video_id),
+                        mode, {"title": title, "artist": artist_detail},
+                    )
+                download_success = True
+                logger.info("[%s] Streamed download into %s.", video_id, processed_temp_path)
+            except StreamingUnsupported as unsupported:
+                logger.info("[%s] Streaming not possible (%s), using the temp-file pipeline.", video_id, unsupported)
         if not download_success:
-            logger.error(f"[{video_id}] Download/processing ultimately failed.")
-            # Ensure message_to_edit is updated if not already by a specific error message
-            if message_to_edit and "Download failed" not in message_to_edit.text and "403 Forbidden" not in message_to_edit.text:
-                 await message_to_edit.edit_text("Failed to download or process the track after attempts.")
-            # Cleanup temp files
-            if os.path.exists(processed_temp_path): os.remove(processed_temp_path)
-            for ext in ["webm", "opus", "mp4", "mkv", "aac", "m4a", "mp3", "part"]:
-                temp_f = os.path.join(CACHE_DIR, f"{video_id}_temp.{ext}")
-                if os.path.exists(temp_f): os.remove(temp_f)
-            return
+            # Timed inside the worker process, where the download and the ffmpeg run can be told apart
+            timings = await run_download(download, ydl_download_opts, track_info)
+            metrics.observe_stage("download", timings["download"])
+            metrics.observe_stage("transcode", timings["transcode"], mode=mode)
+            download_success = True
+            logger.info("[%s] yt-dlp download process completed successfully.", video_id)
 
-        if not os.path.exists(processed_temp_path):
-            logger.error(f"[{video_id}] Processed file {processed_temp_path} not found after download.")
-            if message_to_edit: await message_to_edit.edit_text("Processing failed: Final audio file not found.")
-            return
-        
-        title = track_info.get("title", "Unknown Title")
-        # Attempt to get artist from track_info, fallback to uploader/channel
-        artist_detail = track_info.get("artist") or track_info.get("uploader") or track_info.get("channel", "Unknown Artist")
-        duration = int(track_info.get("duration", 0))
-        metadata_to_save = {"title": title, "artist": artist_detail, "duration": duration, "video_id": video_id}
+    except DownloadError as dl_err:
+        logger.error("[%s] Download failed (DownloadError): %s", video_id, dl_err, exc_info=False)
+        error_message = "Download failed. "
+        is_403 = "HTTP Error 403" in str(dl_err)
+        # A block or proxy failure is retried through another egress by _fetch_track
+        egress_failure = classify_error(dl_err)
+        failure_class = negative_cache.classify_failure(dl_err)
+
+        if is_403:
+            metrics.UPSTREAM_BLOCKS.inc(stage="download")
+            error_message += "YouTube blocked the request (403 Forbidden). "
+            if cookie_file_to_use: error_message += "Try updating cookies or using a proxy. "
+            elif proxy_config: error_message += "The proxy might be blocked. "
+            else: error_message += "Consider using a proxy or cookies. "
+        elif "unavailable" in str(dl_err).lower():
+            error_message += "The video might be unavailable or region-locked."
+        else:
+            error_message += "Please try again later."
+        download_error_message = error_message
+
+    except Exception as dl_err:
+        logger.error("[%s] Unexpected exception during yt-dlp download/processing: %s", video_id, dl_err, exc_info=True)
+        download_error_message = "An unexpected error occurred during download."
+        egress_failure = classify_error(dl_err)
+
+    if not download_success:
+        logger.error("[%s] Download/processing ultimately failed.", video_id)
+        # The stream URLs in the info may be the reason, extract again next time
+        invalidate_extracted_info(video_id)
+        # Cleanup temp files
+        for ext in ["webm", "opus", "mp4", "mkv", "aac", "m4a", "mp3", "part"]:
+            temp_f = os.path.join(cache.cache_dir, f"{video_id}_temp.{ext}")
+            if os.path.exists(temp_f): os.remove(temp_f)
+        raise TrackFetchError(download_error_message, egress_failure=egress_failure, failure_class=failure_class)
+
+    for container in CONTAINER_CODECS:
+        candidate = os.path.join(cache.cache_dir, f"{video_id}_temp.{container}")
+        if not processed_temp_path and os.path.exists(candidate):
+            processed_temp_path = candidate
+    if not processed_temp_path:
+        logger.error("[%s] Processed audio file not found after download.", video_id)
+        raise TrackFetchError("Processing failed: Final audio file not found.")
+
+    container = os.path.splitext(processed_temp_path.removesuffix(".part"))[1].lstrip(".")
+    metadata_to_save = {
+        "title": title, "artist": artist_detail, "duration": duration, "video_id": video_id,
+        "container": container, "codec": CONTAINER_CODECS[container],
+    }
+    with metrics.span("cache_insert"):
+        return cache.insert(video_id, processed_temp_path, metadata_to_save, container=container)
+
+async def _store_file_id(video_id: str, file_id, file_unique_id=None):
+    """
+    Stores (or clears) the file_id of a cached track locally, in the title index for inline queries
+    and, when configured, in the shared storage. Quality variants only keep theirs locally.
+    """
+    cache = get_cache()
+    cache.set_file_id(video_id, file_id, file_unique_id)
+    if VARIANT_SEPARATOR in video_id:
+        # Quality variants are derived locally and are not searched for, only the cache keeps their file_id
+        return
+    entry = cache.lookup(video_id)
+    if entry:
+        get_title_index().add_track(entry)
+    get_title_index().set_file_id(video_id, file_id)
+    storage = get_storage()
+    if storage is None:
+        return
+    try:
+        await run_storage(storage.update_file_id, video_id, file_id, file_unique_id)
+    except Exception as storage_error:
+        logger.error("[%s] Failed to store file_id in shared storage: %s", video_id, storage_error)
+
+async def _send_cached_track(video_id: str, chat_id: int, context: ContextTypes.DEFAULT_TYPE, entry: dict, count_hit=True, silent=False):
+    """
+    Sends a cached track, by Telegram file_id when one is stored, otherwise by uploading the local file.
+    Containers Telegram cannot play (see AUDIO_MESSAGE_EXTENSIONS) are sent as documents.
+    Returns the sent message. `count_hit=False` leaves the hit count alone (e.g. for prewarm uploads),
+    `silent` sends without a notification.
+    """
+    cache = get_cache()
+    title = entry.get("title") or "Unknown Title"
+    artist = entry.get("artist") or "Unknown Artist"
+    duration = entry.get("duration", 0)
+    caption = f"{title} - {artist}"
+    extension = os.path.splitext(entry["audio_path"])[1]
+    as_document = extension not in AUDIO_MESSAGE_EXTENSIONS
+
+    def send(media, **timeouts):
+        if as_document:
+            return context.bot.send_document(chat_id=chat_id, document=media, caption=caption, disable_notification=silent, **timeouts)
+        return context.bot.send_audio(
+            chat_id=chat_id, audio=media,
+            caption=caption, title=title, performer=artist, duration=duration, disable_notification=silent, **timeouts
+        )
+
+    cached_file_id = entry.get("file_id")
+    if cached_file_id:
         try:
-            with open(metadata_file_path, "w", encoding="utf-8") as meta_f:
-                json.dump(metadata_to_save, meta_f, ensure_ascii=False, indent=4)
-            logger.info(f"[{video_id}] Saved metadata to {metadata_file_path}")
-        except Exception as json_err:
-            logger.error(f"[{video_id}] Failed to save metadata: {json_err}")
+            with metrics.span("upload", method="file_id"):
+                sent_message = await send(cached_file_id)
+            logger.info("[%s] Successfully sent cached track by file_id.", video_id)
+            if count_hit: cache.record_hit(video_id)
+            return sent_message
+        except BadRequest as file_id_error:
+            # Telegram no longer accepts this id, upload the local file and store the new one
+            logger.warning("[%s] Telegram rejected cached file_id: %s. Uploading local file.", video_id, file_id_error)
+            await _store_file_id(video_id, None)
+    with open(entry["audio_path"], "rb") as audio_file, metrics.span("upload", method="file"):
+        sent_message = await send(
+            InputFile(audio_file, filename=f"{title} - {artist}{extension}"),
+            write_timeout=180, read_timeout=180, connect_timeout=180
+        )
+    logger.info("[%s] Successfully sent audio file.", video_id)
+    if count_hit: cache.record_hit(video_id)
+    sent_file = sent_message.document if as_document else sent_message.audio
+    if sent_file:
+        # Later requests for this track are sent by file_id without uploading again
+        await _store_file_id(video_id, sent_file.file_id, sent_file.file_unique_id)
+    return sent_message
+
+def offered_qualities(qualities):
+    """
+    The qualities out of `qualities` worth deriving in the current delivery mode: known ones, not above the bitrate
+    of the master (re-encoding a 128 kbps MP3 at 320 kbps only makes the file bigger) and not the master itself.
+    """
+    master_bitrate = MASTER_BITRATES[AUDIO_DELIVERY_MODE]
+    return [
+        quality for quality in qualities
+        if quality in AUDIO_VARIANTS and not (AUDIO_DELIVERY_MODE == "mp3" and quality == "mp3_128")
+        and (master_bitrate is None or AUDIO_VARIANTS[quality]["bitrate"] <= master_bitrate)
+    ]
+
+def _variant_quality(quality):
+    """The AUDIO_VARIANTS key to derive for a requested quality, or None when the master is sent as it is."""
+    if quality and not offered_qualities([quality]):
+        logger.info("Audio quality %s is not offered in %s mode, sending the original.", quality, AUDIO_DELIVERY_MODE)
+        return None
+    return quality or None
+
+async def download_and_send_track(video_id: str, chat_id: int, context: ContextTypes.DEFAULT_TYPE, message_to_edit=None, proxy_config: str = None, quality: str = None):
+    """
+    Downloads a track from YouTube as M4A or MP3 (see AUDIO_DELIVERY_MODE), adds metadata (via yt-dlp),
+    caches it with a separate metadata file, and sends it to the user.
+    Proxies and User-Agents come from the egress pool (or the pinned proxy_config), and requests
+    to YouTube are paced by the shared rate limiter.
+    Concurrent requests for the same track share a single download, and with a shared cache storage
+    (see cache_storage) so do the bot instances.
+    `quality` sends one of the AUDIO_VARIANTS instead, transcoded from the cached download.
+    """
+    logger.info("[%s] Starting download for chat %s. Proxy: %s", video_id, chat_id, egress_label(proxy_config))
+    if _variant_quality(quality):
+        await _download_and_send_variant(video_id, _variant_quality(quality), chat_id, context, message_to_edit, proxy_config)
+        return
+    cache = get_cache()
+
+    try:
+        with metrics.span("cache_lookup"):
+            entry = cache.lookup(video_id)
+        metrics.CACHE_REQUESTS.inc(cache="audio", result="hit" if entry else "miss")
+        if entry:
+            logger.info("[%s] Cache hit for audio and metadata.", video_id)
+            if message_to_edit:
+                await message_to_edit.edit_text("Track found in cache! Sending now...")
+            try:
+                await _send_cached_track(video_id, chat_id, context, entry)
+                if message_to_edit: await message_to_edit.delete()
+                return
+            except Exception as send_error:
+                logger.error("[%s] Error sending cached file %s: %s", video_id, entry['audio_path'], send_error, exc_info=True)
+                if message_to_edit: await message_to_edit.edit_text("Error sending cached file. Will attempt redownload.")
 
-        os.rename(processed_temp_path, final_file_path)
-        logger.info(f"[{video_id}] Renamed {processed_temp_path} to {final_file_path}")
+        failure = negative_cache.get_failure(video_id)
+        if failure:
+            # Known to fail: answer with the earlier error instead of extracting again
+            metrics.CACHE_REQUESTS.inc(cache="negative", result="hit")
+            logger.info("[%s] Known to fail (%s), not downloading.", video_id, failure["class"])
+            if message_to_edit: await message_to_edit.edit_text(failure["message"])
+            else: await context.bot.send_message(chat_id=chat_id, text=failure["message"])
+            return
+
+        logger.info("[%s] Cache miss or error. Proceeding with download.", video_id)
+        mode = AUDIO_DELIVERY_MODE
+        fetch_task, is_leader = single_flight.join((video_id, mode), lambda: _fetch_track_shared(video_id, proxy_config, mode))
+        if message_to_edit:
+            if is_leader:
+                await message_to_edit.edit_text("Downloading and processing track... (this may take a moment)")
+            else:
+                await message_to_edit.edit_text("This track is already being downloaded for another request. Waiting for it to finish...")
+
+        try:
+            with metrics.span("fetch", shared=str(not is_leader).lower()):
+                entry = await asyncio.shield(fetch_task)
+        except TrackFetchError as fetch_error:
+            if is_leader:
+                negative_cache.record_failure(video_id, fetch_error.failure_class, str(fetch_error))
+            if message_to_edit: await message_to_edit.edit_text(str(fetch_error))
+            return
+        if is_leader:
+            negative_cache.clear_failure(video_id)
 
         if message_to_edit: await message_to_edit.edit_text("Upload starting...")
         try:
-            with open(final_file_path, "rb") as audio_file:
-                caption = f"{title} - {artist_detail}"
-                await context.bot.send_audio(
-                    chat_id=chat_id,
-                    audio=InputFile(audio_file, filename=f"{title} - {artist_detail}.mp3"),
-                    caption=caption, title=title, performer=artist_detail, duration=duration,
-                    write_timeout=180, read_timeout=180, connect_timeout=180
-                )
-            logger.info(f"[{video_id}] Successfully sent audio file.")
+            await _send_cached_track(video_id, chat_id, context, entry)
             if message_to_edit: await message_to_edit.delete()
         except Exception as send_error:
-            logger.error(f"[{video_id}] Error sending file {final_file_path}: {send_error}", exc_info=True)
+            logger.error("[%s] Error sending file %s: %s", video_id, entry['audio_path'], send_error, exc_info=True)
             if message_to_edit: await message_to_edit.edit_text(f"Error sending the track: {send_error}")
             else: await context.bot.send_message(chat_id=chat_id, text=f"Error sending the track: {send_error}")
 
     except Exception as e:
-        logger.error(f"[{video_id}] An unexpected error in download_and_send_track: {e}", exc_info=True)
+        logger.error("[%s] An unexpected error in download_and_send_track: %s", video_id, e, exc_info=True)
         final_error_message = "An unexpected error occurred while processing your request."
         if "403" in str(e): final_error_message = "Request blocked by YouTube (403). Try a proxy or updated cookies."
         if message_to_edit:
@@ -239,3 +568,255 @@ async def download_and_send_track(video_id: str, chat_id: int, context: ContextT
             await context.bot.send_message(chat_id=chat_id, text=final_error_message)
 
 
+async def get_track_entry(video_id: str, proxy_config: str = None, cache_label: str = "audio"):
+    """
+    Returns the cache entry of a track, fetching it on a cache miss (shared with concurrent requests, see single_flight).
+    Raises TrackFetchError with a user-facing message when it cannot be fetched or is known to fail.
+    `cache_label` is the cache label the lookup is counted under in the metrics.
+    """
+    entry = get_cache().lookup(video_id)
+    metrics.CACHE_REQUESTS.inc(cache=cache_label, result="hit" if entry else "miss")
+    if entry:
+        return entry
+    failure = negative_cache.get_failure(video_id)
+    if failure:
+        metrics.CACHE_REQUESTS.inc(cache="negative", result="hit")
+        raise TrackFetchError(failure["message"], failure_class=failure["class"])
+    mode = AUDIO_DELIVERY_MODE
+    fetch_task, is_leader = single_flight.join((video_id, mode), lambda: _fetch_track_shared(video_id, proxy_config, mode))
+    try:
+        with metrics.span("fetch", shared=str(not is_leader).lower()):
+            entry = await asyncio.shield(fetch_task)
+    except TrackFetchError as fetch_error:
+        if is_leader:
+            negative_cache.record_failure(video_id, fetch_error.failure_class, str(fetch_error))
+        raise
+    if is_leader:
+        negative_cache.clear_failure(video_id)
+    return entry
+
+async def _derive_variant(video_id: str, quality: str, master: dict):
+    """Transcodes a cached master into a quality variant in the download pool and caches it. Returns the new entry."""
+    variant = AUDIO_VARIANTS[quality]
+    key = variant_key(video_id, quality)
+    cache = get_cache()
+    temp_path = os.path.join(cache.cache_dir, f"{key}_temp.{variant['container']}.part")
+    try:
+        try:
+            seconds = await run_download(transcode, master["audio_path"], temp_path, variant["ffmpeg_args"])
+        except Exception as transcode_error:
+            logger.error("[%s] Transcoding to %s failed: %s", video_id, quality, transcode_error)
+            raise TrackFetchError(f"Could not prepare the {variant['label']} version of this track. Please try again later.")
+        metrics.observe_stage("transcode", seconds, mode=quality)
+        metadata = {
+            "title": master.get("title"), "artist": master.get("artist"), "duration": master.get("duration", 0),
+            "video_id": video_id, "quality": quality, "container": variant["container"], "codec": variant["codec"],
+        }
+        with metrics.span("cache_insert"):
+            return cache.insert(key, temp_path, metadata, container=variant["container"])
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+async def get_variant_entry(video_id: str, quality: str, proxy_config: str = None):
+    """
+    Returns the cache entry of a quality variant (see AUDIO_VARIANTS), transcoding it from the master on a miss
+    (shared with concurrent requests). The master is fetched first if it is not cached. Raises TrackFetchError.
+    """
+    key = variant_key(video_id, quality)
+    entry = get_cache().lookup(key)
+    metrics.CACHE_REQUESTS.inc(cache="variant", result="hit" if entry else "miss")
+    if entry:
+        return entry
+    master = await get_track_entry(video_id, proxy_config, cache_label="master")
+    derive_task, is_leader = single_flight.join(("variant", key), lambda: _derive_variant(video_id, quality, master))
+    with metrics.span("derive", shared=str(not is_leader).lower()):
+        return await asyncio.shield(derive_task)
+
+async def _download_and_send_variant(video_id: str, quality: str, chat_id: int, context: ContextTypes.DEFAULT_TYPE, message_to_edit=None, proxy_config: str = None):
+    """Sends a quality variant of a track, see download_and_send_track."""
+    key = variant_key(video_id, quality)
+    label = AUDIO_VARIANTS[quality]["label"]
+    try:
+        if message_to_edit:
+            await message_to_edit.edit_text(f"Preparing the {label} version of the track...")
+        entry = await get_variant_entry(video_id, quality, proxy_config)
+        if message_to_edit: await message_to_edit.edit_text("Upload starting...")
+        await _send_cached_track(key, chat_id, context, entry)
+        if message_to_edit: await message_to_edit.delete()
+    except TrackFetchError as fetch_error:
+        if message_to_edit: await message_to_edit.edit_text(str(fetch_error))
+        else: await context.bot.send_message(chat_id=chat_id, text=str(fetch_error))
+    except Exception as e:
+        logger.error("[%s] An unexpected error sending the %s version: %s", video_id, quality, e, exc_info=True)
+        final_error_message = "An unexpected error occurred while processing your request."
+        if message_to_edit:
+            try: await message_to_edit.edit_text(final_error_message)
+            except Exception: await context.bot.send_message(chat_id=chat_id, text=final_error_message)
+        else:
+            await context.bot.send_message(chat_id=chat_id, text=final_error_message)
+
+async def prewarm_track(video_id: str, context=None, upload_chat_id: int = None, proxy_config: str = None):
+    """
+    Fetches a track into the cache ahead of user requests, through the same path as a download
+    (shared storage, single-flight, negative cache, rate limiter). With `upload_chat_id`, a track without
+    a file_id is uploaded to that chat once and the message is deleted again, so users get it by file_id.
+    Returns "warm" when there was nothing to do, "fetched", or "uploaded" (fetched first if needed). Raises TrackFetchError.
+    """
+    entry = get_cache().lookup(video_id)
+    result = "warm"
+    if entry is None:
+        entry = await get_track_entry(video_id, proxy_config, cache_label="prewarm")
+        result = "fetched"
+    if upload_chat_id and not entry.get("file_id"):
+        sent_message = await _send_cached_track(video_id, upload_chat_id, context, entry, count_hit=False, silent=True)
+        result = "uploaded"
+        try:
+            await sent_message.delete()
+        except Exception as delete_error:
+            logger.warning("[%s] Could not delete the prewarm upload: %s", video_id, delete_error)
+    return result
+
+async def get_collection(kind: str, collection_id: str, proxy_config: str = None):
+    """Returns {"title", "artist", "tracks"} of an album or playlist, loaded in the search pool and cached for an hour."""
+    collection = _collections.get((kind, collection_id))
+    if collection is None:
+        load = lambda proxy, user_agent: get_collection_tracks(kind, collection_id, BATCH_MAX_TRACKS, proxy, user_agent)
+        with metrics.span("collection", kind=kind):
+            collection = await run_search(lambda: call_with_failover(load, proxy_config=proxy_config))
+        # Downloads of these tracks take the artist from the track list
+        put_search_results(collection["tracks"])
+        _collections.set((kind, collection_id), collection)
+    return collection
+
+async def _send_media_group(entries: list, chat_id: int, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Sends cached tracks as one media group, by file_id where one is stored and by uploading the others.
+    A single track is sent on its own. If Telegram rejects the group (e.g. a stale file_id), the tracks are sent one by one.
+    """
+    if len(entries) == 1:
+        await _send_cached_track(entries[0]["video_id"], chat_id, context, entries[0])
+        return
+    cache = get_cache()
+    open_files = []
+    try:
+        media = []
+        for entry in entries:
+            title = entry.get("title") or "Unknown Title"
+            artist = entry.get("artist") or "Unknown Artist"
+            audio = entry.get("file_id")
+            if not audio:
+                audio_file = open(entry["audio_path"], "rb")
+                open_files.append(audio_file)
+                audio = InputFile(audio_file, filename=f"{title} - {artist}{os.path.splitext(entry['audio_path'])[1]}")
+            media.append(InputMediaAudio(media=audio, caption=f"{title} - {artist}", title=title, performer=artist, duration=entry.get("duration", 0)))
+        with metrics.span("upload", method="media_group"):
+            sent_messages = await context.bot.send_media_group(
+                chat_id=chat_id, media=media, write_timeout=180, read_timeout=180, connect_timeout=180,
+            )
+    except BadRequest as group_error:
+        logger.warning("Telegram rejected a media group of %s tracks: %s. Sending them one by one.", len(entries), group_error)
+        for entry in entries:
+            await _send_cached_track(entry["video_id"], chat_id, context, entry)
+        return
+    finally:
+        for audio_file in open_files:
+            audio_file.close()
+    for entry, sent_message in zip(entries, sent_messages):
+        cache.record_hit(entry["video_id"])
+        if sent_message.audio and sent_message.audio.file_id != entry.get("file_id"):
+            await _store_file_id(entry["video_id"], sent_message.audio.file_id, sent_message.audio.file_unique_id)
+
+class _BatchProgress:
+    """The single progress message of a batch download, edited at most every BATCH_PROGRESS_INTERVAL seconds."""
+
+    def __init__(self, message, title, total):
+        self.message = message
+        self.title = title
+        self.total = total
+        self.ready = self.failed = self.sent = 0
+        self._last_text = None
+        self._last_edit = 0.0
+
+    def text(self):
+        text = f"{self.title}: {self.ready}/{self.total} tracks ready, {self.sent} sent"
+        return text + (f", {self.failed} failed" if self.failed else "") + "..."
+
+    async def update(self, text=None, force=False):
+        text = text or self.text()
+        if not self.message or text == self._last_text:
+            return
+        if not force and time.monotonic() - self._last_edit < BATCH_PROGRESS_INTERVAL:
+            return
+        self._last_text, self._last_edit = text, time.monotonic()
+        try:
+            await self.message.edit_text(text)
+        except Exception as edit_error:
+            logger.warning("Could not update batch progress: %s", edit_error)
+
+async def download_and_send_collection(kind: str, collection_id: str, chat_id: int, context: ContextTypes.DEFAULT_TYPE, message_to_edit=None, proxy_config: str = None):
+    """
+    Downloads the tracks of an album or playlist and sends them in media groups of up to MEDIA_GROUP_SIZE,
+    in album order. Up to BATCH_FETCH_CONCURRENCY tracks are fetched at once, each under a download permit of the
+    job scheduler, cached ones are not fetched again, and a group is sent as soon as its tracks are ready.
+    Progress is shown by editing `message_to_edit`.
+    """
+    try:
+        collection = await get_collection(kind, collection_id, proxy_config)
+    except Exception as e:
+        logger.error("Failed to load %s %s: %s", kind, collection_id, e, exc_info=True)
+        text = f"Could not load the {kind}. Please try again later."
+        if message_to_edit: await message_to_edit.edit_text(text)
+        else: await context.bot.send_message(chat_id=chat_id, text=text)
+        return
+    tracks = collection["tracks"]
+    if not tracks:
+        text = f"The {kind} '{collection['title']}' has no tracks that can be downloaded."
+        if message_to_edit: await message_to_edit.edit_text(text)
+        else: await context.bot.send_message(chat_id=chat_id, text=text)
+        return
+
+    logger.info("Downloading %s tracks of %s %s for chat %s.", len(tracks), kind, collection_id, chat_id)
+    progress = _BatchProgress(message_to_edit, collection["title"], len(tracks))
+    await progress.update(force=True)
+    semaphore = asyncio.Semaphore(BATCH_FETCH_CONCURRENCY)
+
+    scheduler = get_scheduler()
+
+    async def fetch(track):
+        async with semaphore:
+            try:
+                # A fetch counts against the same download limits as track jobs, a cached track needs no permit
+                needs_permit = scheduler is not None and get_cache().lookup(track["id"]) is None
+                async with scheduler.download_permit(chat_id) if needs_permit else contextlib.nullcontext():
+                    entry = await get_track_entry(track["id"], proxy_config)
+            except Exception as fetch_error:
+                logger.warning("[%s] Skipping track of %s %s: %s", track["id"], kind, collection_id, fetch_error)
+                progress.failed += 1
+                entry = None
+            else:
+                progress.ready += 1
+        await progress.update()
+        return entry
+
+    fetches = [asyncio.ensure_future(fetch(track)) for track in tracks]
+    try:
+        for start in range(0, len(fetches), MEDIA_GROUP_SIZE):
+            entries = [entry for entry in await asyncio.gather(*fetches[start:start + MEDIA_GROUP_SIZE]) if entry]
+            if not entries:
+                continue
+            try:
+                await _send_media_group(entries, chat_id, context)
+                progress.sent += len(entries)
+            except Exception as send_error:
+                logger.error("Error sending %s tracks of %s %s: %s", len(entries), kind, collection_id, send_error, exc_info=True)
+                progress.failed += len(entries)
+            await progress.update(force=True)
+    finally:
+        for fetch_task in fetches:
+            fetch_task.cancel()
+    summary = f"{collection['title']}: sent {progress.sent} of {progress.total} tracks."
+    if progress.failed:
+        summary += f" {progress.failed} could not be downloaded."
+    if message_to_edit: await progress.update(summary, force=True)
+    else: await context.bot.send_message(chat_id=chat_id, text=summary)